@@ -0,0 +1,82 @@
+"""Compute completions off the UI thread, for the latest input only.
+
+prompt_toolkit calls the completer of a buffer in a worker thread, one call
+at a time, and discards the completions if the text changed in the meantime.
+The :class:`AsyncCompleter` in front of the :class:`SQLCompleter` makes those
+calls cheap when they are no longer wanted:
+
+- While typing, it waits for a short pause in the keystrokes before
+  completing, and gives up if another keystroke arrives.
+- A completion in progress is abandoned as soon as the text or the cursor
+  moves on.
+
+The SQLCompleter it uses is a snapshot that is never changed once it is in
+use: a refresh builds a new one and swaps it in, so no lock is needed.
+"""
+from __future__ import unicode_literals
+
+import logging
+import time
+
+from prompt_toolkit.completion import Completer
+
+from .perfstats import PERF
+
+_logger = logging.getLogger(__name__)
+
+
+class AsyncCompleter(Completer):
+    """Complete with the *completer* snapshot, after *delay* seconds without
+    keystrokes.
+
+    :param completer: the SQLCompleter to use, replaced by assigning
+                      ``completer``.
+    :param delay: the debounce window, in seconds.
+    :param smart_completion: use context sensitive completion, defaults to
+                             the setting of *completer*.
+    """
+
+    def __init__(self, completer, delay=0.05, smart_completion=None):
+        self.completer = completer
+        self.delay = delay
+        if smart_completion is None:
+            smart_completion = completer.smart_completion
+        self.smart_completion = smart_completion
+        # The (text, cursor position) of the buffer as last seen, or None
+        # until a buffer is watched.
+        self._latest = None
+
+    def watch(self, buffer):
+        """Follow the edits of *buffer*, to cancel the completions of text
+        that has changed since."""
+        buffer.on_text_changed += self._buffer_changed
+        buffer.on_cursor_position_changed += self._buffer_changed
+        self._buffer_changed(buffer)
+
+    def _buffer_changed(self, buffer):
+        # Called from the UI thread; a tuple is swapped in atomically.
+        self._latest = (buffer.text, buffer.cursor_position)
+
+    def is_stale(self, document):
+        """Has the watched buffer moved on from *document*?"""
+        latest = self._latest
+        return latest is not None and latest != (document.text,
+                                                 document.cursor_position)
+
+    def get_completions(self, document, complete_event):
+        if (self.delay and complete_event is not None and
+                not complete_event.completion_requested):
+            time.sleep(self.delay)
+        if self.is_stale(document):
+            PERF.record('completion abandoned', 0.0)
+            return []
+
+        # Keep using this snapshot even if a new one is swapped in.
+        completer = self.completer
+        start = time.time()
+        completions = completer.get_completions(
+            document, complete_event, smart_completion=self.smart_completion,
+            cancelled=lambda: self.is_stale(document))
+        _logger.debug('Completed %r in %0.03fs.', document.text_before_cursor,
+                      time.time() - start)
+        return completions
@@ -4,7 +4,7 @@ from prompt_toolkit.enums import DEFAULT_BUFFER, EditingMode
 from prompt_toolkit.key_binding.vi_state import InputMode
 
 
-def create_toolbar_tokens_func(get_is_refreshing):
+def create_toolbar_tokens_func(get_is_refreshing, get_refresh_progress=None):
     """
     Return a function that generates the toolbar tokens.
     """
@@ -37,7 +37,12 @@ def create_toolbar_tokens_func(get_is_refreshing):
             result.append((token.On, '[F4] Emacs-mode'))
 
         if get_is_refreshing():
-            result.append((token, '     Refreshing completions...'))
+            progress = get_refresh_progress and get_refresh_progress()
+            if progress:
+                result.append((token, '     Refreshing completions '
+                               '({0})...'.format(progress)))
+            else:
+                result.append((token, '     Refreshing completions...'))
 
         return result
     return get_toolbar_tokens
@@ -1,90 +1,347 @@
+import logging
 import threading
+import time
 from collections import OrderedDict
-
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import groupby
+from operator import itemgetter
+from sys import intern
+
+from .metadata_cache import CachedMetadata, MetadataCache
+from .metadata_fetch import MetadataFetch, prefetch
+from .packages.ddlchanges import RELATION_KINDS
+from .packages.compactmetadata import Relations
+from .perfstats import PERF
 from .packages.special.main import COMMANDS
+from .refresh_progress import RefreshCancelled, RefreshProgress
 from .sqlcompleter import SQLCompleter
-from .sqlexecute import SQLExecute
+
+_logger = logging.getLogger(__name__)
 
 
 class CompletionRefresher(object):
 
     refreshers = OrderedDict()
-
-    def __init__(self):
+    # The names of the SQLExecute queries of each refresher, which are run
+    # concurrently in a parallel refresh.
+    refresher_queries = {}
+    # The refreshers left out when the completer fetches their objects as
+    # they are needed, with its lazy_metadata.
+    lazy_refreshers = ('tables',)
+    # The refreshers of the objects that are only loaded on first use, a
+    # schema at a time, by the LazyMetadata of the completer. Each returns
+    # the objects of a schema, given a session and the schema.
+    schema_refreshers = OrderedDict()
+
+    def __init__(self, cache_dir=None, parallelism=1, on_progress=None):
+        """
+        cache_dir - directory in which the metadata of each user and
+                    database is kept between sessions, or None to fetch it
+                    all at every refresh.
+        parallelism - number of sessions borrowed from the pool to run the
+                      queries of a refresh at the same time.
+        on_progress - function called with the RefreshProgress of the
+                      refresh when it changes.
+        """
+        self.cache_dir = cache_dir
+        self.parallelism = parallelism
+        self.on_progress = on_progress
+        # The RefreshProgress of the refresh in progress, or of the last one.
+        self.progress = None
+        # The completer last handed out, whose unchanged schemas the next
+        # one takes over.
+        self._published = None
         self._completer_thread = None
         self._restart_refresh = threading.Event()
-
-    def refresh(self, executor, callbacks, completer_options=None):
+        # The DDL changes waiting for the update thread, which is started
+        # with the arguments of the last update, once the refresh in
+        # progress, if any, is done.
+        self._changes = []
+        self._update_args = None
+        self._update_thread = None
+        self._update_lock = threading.Lock()
+        self._refreshing = False
+
+    def refresh(self, executor, callbacks, completer_options=None,
+                progressive=False, from_cache=False):
         """Creates a SQLCompleter object and populates it with the relevant
         completion suggestions in a background thread.
 
-        executor - SQLExecute object, used to extract the credentials to connect
-                   to the database.
+        executor - SQLExecute object, whose session pool is used to borrow a
+                   session for the refresh.
         callbacks - A function or a list of functions to call after the thread
                     has completed the refresh. The newly created completion
                     object will be passed in as an argument to each callback.
         completer_options - dict of options to pass to SQLCompleter.
+        progressive - also call the callbacks with a completer of the keywords
+                      and special commands first, and then of the current
+                      schema alone, while all the schemas are fetched. In
+                      lazy mode, the current schema isn't fetched either.
+        from_cache - first call the callbacks with a completer of the
+                     metadata cached on disk, read in the background thread;
+                     if there is one, the refresh isn't progressive.
 
         """
         completer_options = completer_options or {}
 
         if self.is_refreshing():
             self._restart_refresh.set()
+            progress = self.progress
+            if progress is not None:
+                progress.cancel()
             return [(None, None, None, 'Auto-completion refresh restarted.')]
         else:
+            with self._update_lock:
+                self._refreshing = True
             self._completer_thread = threading.Thread(
-                target=self._bg_refresh,
-                args=(executor, callbacks, completer_options),
+                target=self._refresh_then_update,
+                args=(executor, callbacks, completer_options, progressive,
+                      from_cache),
                 name='completion_refresh')
             self._completer_thread.setDaemon(True)
             self._completer_thread.start()
             return [(None, None, None,
                      'Auto-completion refresh started in the background.')]
 
+    def update(self, executor, changes, callbacks, completer_options=None):
+        """Apply *changes*, the ObjectChanges of DDL statements, to the
+        completions in a background thread: the objects created or altered
+        are fetched again, and those dropped are removed.
+
+        The changes requested while an update runs are applied together once
+        it is done. Those requested while a refresh runs, which may have
+        fetched the objects before they changed, are applied once it is
+        published. Without completions to update yet, a refresh is started
+        instead.
+        """
+        with self._update_lock:
+            if self._published is None and not self._refreshing:
+                refresh = True
+            else:
+                refresh = False
+                self._changes.extend(changes)
+                self._update_args = (executor, callbacks, completer_options)
+                if self._refreshing:
+                    return [(None, None, None, 'Auto-completion update '
+                             'queued until the refresh is done.')]
+                self._start_update()
+        if refresh:
+            return self.refresh(executor, callbacks, completer_options)
+        return [(None, None, None,
+                 'Auto-completion update started in the background.')]
+
+    def _start_update(self):
+        """Start the update thread, if there are changes for it and it
+        isn't running. Must be called with the update lock held."""
+        if self._changes and self._update_thread is None:
+            self._update_thread = threading.Thread(
+                target=self._bg_update, args=self._update_args,
+                name='completion_update')
+            self._update_thread.setDaemon(True)
+            self._update_thread.start()
+
     def is_refreshing(self):
         return self._completer_thread and self._completer_thread.is_alive()
 
-    def _bg_refresh(self, sqlexecute, callbacks, completer_options):
-        completer = SQLCompleter(**completer_options)
-
-        # Create a new pgexecute method to popoulate the completions.
-        e = sqlexecute
-        executor = SQLExecute(e.dbname, e.user, e.password, e.host)
+    def metadata_cache(self, sqlexecute):
+        """Return the MetadataCache of the user and database of
+        *sqlexecute*, or None if the metadata isn't cached."""
+        if not self.cache_dir:
+            return None
+        return MetadataCache.for_session(self.cache_dir, sqlexecute.user,
+                                         sqlexecute.host)
+
+    def cached_completer(self, cache, dbname, completer_options=None):
+        """Return a SQLCompleter populated with the metadata of *cache*, a
+        loaded MetadataCache, without querying the database."""
+        completer = SQLCompleter(**(completer_options or {}))
+        metadata = CachedMetadata(cache, dbname=dbname)
+        for refresher in self._refreshers(completer).values():
+            refresher(completer, metadata)
+        return completer
+
+    def _refresh_then_update(self, *args):
+        """Refresh, and then apply the changes requested meanwhile."""
+        try:
+            self._bg_refresh(*args)
+        finally:
+            with self._update_lock:
+                self._refreshing = False
+                if self._published is not None:
+                    self._start_update()
+
+    def _bg_refresh(self, sqlexecute, callbacks, completer_options,
+                    progressive=False, from_cache=False):
+        cache = self.metadata_cache(sqlexecute)
+        cached = cache is not None and cache.load()
 
         # If callbacks is a single function then push it into a list.
         if callable(callbacks):
             callbacks = [callbacks]
 
+        def publish(completer):
+            completer.build_indexes(self._published)
+            self._published = completer
+            for callback in callbacks:
+                callback(completer)
+
+        if from_cache and cached:
+            # Complete with the cached metadata while it is refreshed.
+            publish(self.cached_completer(cache, sqlexecute.dbname,
+                                          completer_options))
+            progressive = False
+
+        start = time.time()
         while True:
-            for refresher in self.refreshers.values():
-                refresher(completer, executor)
-                if self._restart_refresh.is_set():
-                    self._restart_refresh.clear()
-                    break
-            else:
-                # Break out of while loop if the for loop finishes natually
-                # without hitting the break statement.
+            # A restart requested from here on cancels this attempt.
+            progress = self.progress = RefreshProgress(self.on_progress)
+            self._restart_refresh.clear()
+            try:
+                completer = self._attempt(sqlexecute, cache, publish,
+                                          completer_options, progressive)
+            except RefreshCancelled:
+                _logger.debug('Completion refresh restarted after %0.03fs.',
+                              progress.elapsed)
+                continue
+            if not self._restart_refresh.is_set():
                 break
+        progress.set_stage(None)
+        PERF.record('refresh', time.time() - start, progress.rows)
+        _logger.debug('Fetched the completions in %0.03fs: %s.',
+                      time.time() - start, progress)
 
-            # Start over the refresh from the beginning if the for loop hit the
-            # break statement.
-            continue
+        if cache is not None:
+            cache.save()
+        publish(completer)
 
-        for callback in callbacks:
-            callback(completer)
+    def _bg_update(self, sqlexecute, callbacks, completer_options):
+        if callable(callbacks):
+            callbacks = [callbacks]
+
+        while True:
+            with self._update_lock:
+                changes, self._changes = self._changes, []
+                if not changes:
+                    self._update_thread = None
+                    return
+            start = time.time()
+            previous = self._published
+            try:
+                with sqlexecute.borrow() as session:
+                    completer = update_completer(previous, changes, session)
+            except Exception:
+                _logger.error('Could not update the completions, refreshing '
+                              'them instead.', exc_info=True)
+                self.refresh(sqlexecute, callbacks, completer_options)
+                continue
+            if self._refreshing or self._published is not previous:
+                # The refresh started meanwhile has the changes too.
+                continue
+            completer.build_indexes()
+            self._published = completer
+            PERF.record('update', time.time() - start)
+            _logger.debug('Updated %d completions in %0.03fs.', len(changes),
+                          time.time() - start)
+            for callback in callbacks:
+                callback(completer)
+
+    def _attempt(self, sqlexecute, cache, publish, completer_options,
+                 progressive):
+        """Return a new completer populated by the refreshers, raising
+        RefreshCancelled if the refresh is cancelled meanwhile."""
+        publish_early = None
+        if progressive:
+            publish_early = partial(self._publish_early, sqlexecute, publish,
+                                    completer_options)
+
+        # Borrow sessions from the pool to populate the completions, rather
+        # than logging in again.
+        if self.parallelism > 1:
+            with ThreadPoolExecutor(self.parallelism) as pool:
+                executor = MetadataFetch(sqlexecute, self.progress, pool)
+                return self._populate(executor, cache, publish_early,
+                                      completer_options)
+        with sqlexecute.borrow() as session:
+            executor = MetadataFetch(session, self.progress)
+            return self._populate(executor, cache, publish_early,
+                                  completer_options)
+
+    def _populate(self, executor, cache, publish_early, completer_options):
+        """Run the refreshers with *executor*, a MetadataFetch.
+
+        *publish_early* is called once the queries of all the schemas are
+        started, if they run in the background."""
+        progress = executor.progress
+        completer = SQLCompleter(**completer_options)
+        # With a cache, only the objects changed since it was saved are
+        # fetched.
+        metadata = (executor if cache is None
+                    else CachedMetadata(cache, executor))
+        refreshers = self._refreshers(completer)
+        for name in refreshers:
+            for query in self.refresher_queries.get(name, ()):
+                prefetch(metadata, query)
+        if publish_early is not None:
+            publish_early(progress)
+
+        progress.set_stage('all schemas')
+        progress.add_units(len(refreshers))
+        for name, refresher in refreshers.items():
+            progress.check()
+            with PERF.timer('refresher ' + name):
+                refresher(completer, metadata)
+            progress.unit_done()
+        return completer
+
+    def _publish_early(self, sqlexecute, publish, completer_options,
+                       progress):
+        """Publish a completer of what needs no queries, and then another
+        one with the current schema, fetched on a session of its own."""
+        offline = [refresher for name, refresher in self.refreshers.items()
+                   if not self.refresher_queries.get(name)]
+
+        progress.set_stage('keywords')
+        completer = SQLCompleter(**completer_options)
+        for refresher in offline:
+            refresher(completer, sqlexecute)
+        publish(completer)
+        if completer.lazy_tables:
+            return
+
+        progress.set_stage('current schema')
+        completer = SQLCompleter(**completer_options)
+        with sqlexecute.borrow() as session:
+            executor = MetadataFetch(session, progress)
+            for refresher in offline + [refresh_current_schema]:
+                refresher(completer, executor)
+        progress.check()
+        publish(completer)
+
+    def _refreshers(self, completer):
+        """Return the refreshers that populate *completer*."""
+        if not completer.lazy_tables:
+            return self.refreshers
+        return OrderedDict((name, refresher)
+                           for name, refresher in self.refreshers.items()
+                           if name not in self.lazy_refreshers)
 
 
-def refresher(name, refreshers=CompletionRefresher.refreshers):
+def refresher(name, queries=(), refreshers=CompletionRefresher.refreshers):
     """Decorator to add the decorated function to the dictionary of
     refreshers. Any function decorated with a @refresher will be executed as
-    part of the completion refresh routine."""
+    part of the completion refresh routine.
+
+    *queries* are the names of the SQLExecute methods the refresher calls
+    without arguments, which a parallel refresh starts ahead of time."""
     def wrapper(wrapped):
         refreshers[name] = wrapped
+        CompletionRefresher.refresher_queries[name] = queries
         return wrapped
     return wrapper
 
 
-@refresher('databases')
+@refresher('databases', queries=('databases',))
 def refresh_databases(completer, executor):
     completer.extend_database_names(executor.databases())
 
@@ -95,30 +352,188 @@ def refresh_schemata(completer, executor):
     completer.extend_schemata(completer.databases)
 
 
-@refresher('tables')
+def _by_owner(rows):
+    """Partition the rows of a data dictionary query of all owners, whose
+    first column is the owner.
+
+    >>> _by_owner([('HR', 'EMP'), ('SYS', 'DUAL'), ('HR', 'DEPT')])
+    {'HR': [('EMP',), ('DEPT',)], 'SYS': [('DUAL',)]}
+    """
+    owners = {}
+    for row in rows:
+        owners.setdefault(row[0], []).append(tuple(row[1:]))
+    return owners
+
+
+def _add_relations(completer, schema, relations, views):
+    """Add the tables and views *relations* of *schema* to *completer*, the
+    names of the views among them being *views*, and return the kind of
+    each relation by name."""
+    kinds = dict((relation[0], 'views' if relation[0] in views else 'tables')
+                 for relation in relations)
+    for kind in ('tables', 'views'):
+        completer.extend_relations(
+            [relation for relation in relations
+             if kinds[relation[0]] == kind], kind=kind, schema=schema)
+    return kinds
+
+
+def _add_columns(completer, schema, columns, kinds):
+    """Add the (relation, column) *columns* of *schema* to the tables or
+    views they belong to, by the *kinds* of _add_relations."""
+    by_kind = {'tables': [], 'views': []}
+    for column in columns:
+        kind = kinds.get(column[0])
+        if kind is not None:
+            by_kind[kind].append(column)
+    for kind, kind_columns in by_kind.items():
+        if kind_columns:
+            completer.extend_columns(kind_columns, kind=kind, schema=schema)
+
+
+@refresher('tables', queries=('all_tables', 'all_views', 'all_table_columns'))
 def refresh_tables(completer, executor):
+    # One query per kind of object for all the schemas, rather than one per
+    # schema, partitioned here. The tables query lists the views too, which
+    # the views query tells apart.
+    tables = _by_owner(executor.all_tables())
+    views = _by_owner(executor.all_views())
+    kinds = {}
     for schema in completer.databases:
-        tables = executor.tables(schema)
-        completer.extend_relations(tables, kind='tables', schema=schema)
-        columns = executor.table_columns(schema)
-        completer.extend_columns(columns, kind='tables', schema=schema)
-
-
-@refresher('users')
+        kinds[schema] = _add_relations(
+            completer, schema, tables.get(schema, []),
+            set(view[0] for view in views.get(schema, [])))
+    # The columns are many more: they are added as they are streamed, a run
+    # of rows of the same owner at a time, rather than partitioned first.
+    for owner, rows in groupby(executor.all_table_columns(), itemgetter(0)):
+        if owner in kinds:
+            _add_columns(completer, owner, (row[1:] for row in rows),
+                         kinds[owner])
+
+
+@refresher('users', queries=('users',))
 def refresh_users(completer, executor):
     completer.extend_users(executor.users())
 
-# todo separate views from tables
-# @refresher('views')
-# def refresh_views(completer, executor):
-#     completer.extend_relations(executor.views(), kind='views')
-#     completer.extend_columns(executor.view_columns(), kind='views')
-
 
-@refresher('functions')
+@refresher('functions', queries=('all_functions',))
 def refresh_functions(completer, executor):
+    functions = _by_owner(executor.all_functions())
     for schema in completer.databases:
-        completer.extend_functions(executor.functions(schema), schema)
+        completer.extend_functions(functions.get(schema, []), schema)
+
+
+@refresher('synonyms', refreshers=CompletionRefresher.schema_refreshers)
+def refresh_synonyms(executor, schema):
+    """Map the synonyms of *schema* to the (owner, name) of their target."""
+    return dict((intern(name), (owner and intern(owner), intern(target)))
+                for name, owner, target in executor.synonyms(schema))
+
+
+@refresher('packages', refreshers=CompletionRefresher.schema_refreshers)
+def refresh_packages(executor, schema):
+    """Return the Relations of the packages of *schema*, the columns of
+    which are their procedures and functions."""
+    packages = Relations()
+    seen = set()
+    for package, member in executor.package_members(schema):
+        if package not in packages:
+            packages.add(package, star=False)
+        # Overloads are listed once each.
+        if (package, member) not in seen:
+            seen.add((package, member))
+            packages.add_column(package, member)
+    return packages
+
+
+@refresher('signatures', refreshers=CompletionRefresher.schema_refreshers)
+def refresh_signatures(executor, schema):
+    """Map the (package, member) of *schema* to its signatures, one for each
+    overload."""
+    signatures = {}
+    overloads = groupby(executor.package_arguments(schema),
+                        key=lambda row: row[:3])
+    for (package, member, _), arguments in overloads:
+        signature = _signature(arguments)
+        key = (intern(package), intern(member))
+        if key in signatures:
+            signature = '{0} | {1}'.format(signatures[key], signature)
+        signatures[key] = intern(signature)
+    return signatures
+
+
+def _signature(arguments):
+    """Return the signature of a procedure or function from the rows of
+    its arguments.
+
+    >>> _signature([('P', 'F', None, None, 'OUT', 'NUMBER'),
+    ...             ('P', 'F', None, 'ID', 'IN', 'NUMBER'),
+    ...             ('P', 'F', None, 'NAME', 'IN/OUT', 'VARCHAR2')])
+    '(ID NUMBER, NAME IN/OUT VARCHAR2) RETURN NUMBER'
+    """
+    names = []
+    returns = ''
+    for _, _, _, name, in_out, data_type in arguments:
+        if name is None:
+            # The return value of a function, or the row of a procedure
+            # without arguments.
+            if data_type:
+                returns = ' RETURN {0}'.format(data_type)
+        elif in_out == 'IN':
+            names.append('{0} {1}'.format(name, data_type))
+        else:
+            names.append('{0} {1} {2}'.format(name, in_out, data_type))
+    return '({0}){1}'.format(', '.join(names), returns)
+
+
+@refresher('sequences', refreshers=CompletionRefresher.schema_refreshers)
+def refresh_sequences(executor, schema):
+    return frozenset(intern(row[0]) for row in executor.sequences(schema))
+
+
+def refresh_current_schema(completer, executor):
+    """Populate the completions of the current schema alone, with the queries
+    of that schema only."""
+    schema = executor.dbname.upper()
+    completer.set_dbname(schema)
+    completer.extend_database_names([schema])
+    completer.extend_schemata([schema])
+    kinds = _add_relations(completer, schema, executor.tables(schema),
+                           set(executor.views(schema)))
+    _add_columns(completer, schema, executor.table_columns(schema), kinds)
+    completer.extend_functions(
+        [(name,) for name in executor.functions(schema)], schema)
+
+
+def update_completer(completer, changes, executor):
+    """Return a copy of *completer* with the ObjectChanges *changes*,
+    fetching the columns of the tables and views created or altered."""
+    dbname = completer.dbname
+    completer = completer.copy(set(change.schema or dbname
+                                   for change in changes))
+    for change in changes:
+        schema = change.schema or dbname
+        # A rename doesn't tell a table from a view.
+        for kind in (RELATION_KINDS if change.kind in RELATION_KINDS
+                     else (change.kind,)):
+            completer.remove_object(kind, schema, change.name)
+        if change.dropped:
+            continue
+        if schema not in completer.dbmetadata[change.kind]:
+            completer.extend_database_names([schema])
+            completer.extend_schemata([schema])
+        if change.kind == 'functions':
+            completer.extend_functions([(change.name,)], schema)
+            continue
+        columns = executor.relation_columns(schema, change.name)
+        if not columns:
+            # The statement didn't leave a table or view of that name.
+            continue
+        completer.extend_relations([(change.name,)], kind=change.kind,
+                                   schema=schema)
+        completer.extend_columns([(change.name, column) for column in columns],
+                                 kind=change.kind, schema=schema)
+    return completer
 
 
 @refresher('special_commands')
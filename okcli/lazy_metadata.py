@@ -0,0 +1,199 @@
+"""Fetch table and column names when completions need them.
+
+For catalogs too large to load up front, the lazy completion mode leaves the
+tables out of the completion refresh. Instead, the tables that start with the
+word being typed are fetched with a prefix query capped at `row_limit` rows,
+and the columns of a table the first time it appears in a statement.
+
+The objects that no refresh loads, such as synonyms, packages and sequences,
+are always fetched this way, a schema at a time: the `loaders` of each kind
+of object are the lazy refreshers of the CompletionRefresher.
+
+Lookups never wait for the database: they return what is cached, and queue
+the missing names to be fetched by a background session. Once they arrive,
+*on_fetched* is called so that the completions can be computed again. The
+names are kept in a bounded LRU cache, for `ttl` seconds each.
+"""
+from __future__ import unicode_literals
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue  # noqa
+
+from .perfstats import PERF
+
+_logger = logging.getLogger(__name__)
+
+
+class LRUCache(object):
+    """A mapping of at most *max_entries* entries, each kept *ttl* seconds,
+    dropping the least recently used entries first.
+
+    >>> cache = LRUCache(max_entries=2, ttl=60)
+    >>> cache.put('a', 1)
+    >>> cache.put('b', 2)
+    >>> cache.get('a')
+    1
+    >>> cache.put('c', 3)
+    >>> cache.get('b') is None
+    True
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return the value of *key*, or None if it isn't cached."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class LazyMetadata(object):
+    """Table and column names of the database of *sqlexecute*, fetched on
+    demand on a session borrowed from its pool.
+
+    :param on_fetched: function called, from the background thread, when
+                       names that completions were missing have arrived.
+    :param loaders: dict of the functions returning the objects of each kind
+                    of a schema, called with a session and the schema.
+    :param lazy_tables: fetch the tables and their columns as they are
+                        needed, rather than with the completion refresh.
+    :param max_entries: number of prefixes and tables to keep.
+    :param ttl: seconds to keep the names of a prefix or table.
+    :param row_limit: most table names fetched for a prefix.
+    """
+
+    def __init__(self, sqlexecute, on_fetched=None, loaders=None,
+                 lazy_tables=True, max_entries=1000, ttl=300, row_limit=500):
+        self.sqlexecute = sqlexecute
+        self.on_fetched = on_fetched
+        self.loaders = loaders or {}
+        self.lazy_tables = lazy_tables
+        self.row_limit = row_limit
+        self._cache = LRUCache(max_entries, ttl)
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._requests = Queue()
+        self._worker = None
+        # Increased by clear, so that fetches started before are dropped.
+        self._generation = 0
+
+    def tables(self, schema, prefix):
+        """Return the cached names of the tables and views of *schema* that
+        start with *prefix*, or None until they are fetched."""
+        # The names of a shorter prefix will do, if none were left out.
+        for end in range(len(prefix), -1, -1):
+            names = self._cache.get(('tables', schema, prefix[:end]))
+            if names is not None and (end == len(prefix) or
+                                      len(names) < self.row_limit):
+                return [name for name in names if name.startswith(prefix)]
+        self._request(('tables', schema, prefix), lambda executor: list(
+            executor.tables_like(schema, prefix, self.row_limit)))
+        return None
+
+    def columns(self, schema, relation):
+        """Return the cached column names of the table or view *relation*,
+        after an asterisk, or None until they are fetched."""
+        names = self._cache.get(('columns', schema, relation))
+        if names is None:
+            self._request(('columns', schema, relation), lambda executor: list(
+                executor.relation_columns(schema, relation)))
+            return None
+        return ['*'] + names
+
+    def objects(self, kind, schema):
+        """Return the objects of *kind* of *schema*, as returned by their
+        loader, or None until they are fetched."""
+        key = (kind, schema)
+        objects = self._cache.get(key)
+        loader = self.loaders.get(kind)
+        if objects is None and loader is not None:
+            self._request(key, lambda executor: loader(executor, schema))
+        return objects
+
+    def forget(self, schema):
+        """Fetch the objects of all kinds of *schema* again when they are
+        needed, e.g. after DDL."""
+        for kind in self.loaders:
+            self._cache.pop((kind, schema))
+
+    def clear(self):
+        """Forget all the names, e.g. after DDL."""
+        with self._lock:
+            self._generation += 1
+        self._cache.clear()
+
+    def _request(self, key, fetch):
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._work,
+                                                name='lazy_metadata')
+                self._worker.daemon = True
+                self._worker.start()
+        self._requests.put((key, fetch, self._generation))
+
+    def _work(self):
+        while True:
+            key, fetch, generation = self._requests.get()
+            try:
+                self._fetch(key, fetch, generation)
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
+
+    def _fetch(self, key, fetch, generation):
+        start = time.time()
+        try:
+            with self.sqlexecute.borrow() as executor:
+                result = fetch(executor)
+        except Exception:
+            _logger.error('Could not fetch the %s of %r.', key[0], key[1:],
+                          exc_info=True)
+            # Don't ask again until the entry expires.
+            result = [] if key[0] in ('tables', 'columns') else {}
+        PERF.record('lazy ' + key[0], time.time() - start, len(result))
+        _logger.debug('Fetched %d %s of %r in %0.03fs.', len(result), key[0],
+                      key[1:], time.time() - start)
+        if generation != self._generation:
+            return
+        self._cache.put(key, result)
+        if self.on_fetched is not None:
+            self.on_fetched()
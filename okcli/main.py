@@ -5,11 +5,11 @@ import os
 import os.path
 import sys
 from sys import exit
-import threading
 import traceback
 from collections import namedtuple
 from datetime import datetime
 from io import open
+from itertools import chain
 from random import choice
 from time import time
 
@@ -30,6 +30,7 @@ from prompt_toolkit.layout.processors import (ConditionalProcessor,
 from prompt_toolkit.shortcuts import create_eventloop, create_prompt_layout
 
 from .__init__ import __version__
+from .async_completer import AsyncCompleter
 from .clibuffer import CLIBuffer
 from .clistyle import style_factory
 from .clitoolbar import create_toolbar_tokens_func
@@ -38,10 +39,15 @@ from .config import (read_config_files, str_to_bool,
                      write_default_config)
 from .encodingutils import utf8tounicode
 from .key_bindings import okcli_bindings
+from .lazy_metadata import LazyMetadata
 from .lexer import OracleLexer
+from .parallel import run_script
+from .perfstats import PERF
+from .packages.ddlchanges import RELATION_KINDS, ddl_changes
 from .packages.special.main import NO_QUERY
 from .sqlcompleter import SQLCompleter
 from .sqlexecute import SQLExecute
+from .streaming import FetchBudget, PagedCursor, fetch_chunks, format_stream
 
 click.disable_unicode_literals_warning = True
 try:
@@ -83,7 +89,7 @@ class OCli(object):
     def __init__(self, sqlexecute=None, prompt=None,
                  logfile=None, defaults_suffix=None, defaults_file=None,
                  login_path=None, auto_vertical_output=False, warn=None,
-                 okclirc="~/.okclirc"):
+                 okclirc="~/.okclirc", arraysize=None):
         self.sqlexecute = sqlexecute
         self.logfile = logfile
         self.defaults_suffix = defaults_suffix
@@ -103,9 +109,32 @@ class OCli(object):
         self.multi_line = c['main'].as_bool('multi_line')
         self.key_bindings = c['main']['key_bindings']
         special.set_timing_enabled(c['main'].as_bool('timing'))
+        self.log_timing = c['main'].as_bool('log_timing')
+        special.set_fetch_memory_target(c['main'].as_int('fetch_memory_target'))
+        special.set_arraysize(arraysize or c['main']['arraysize'])
+        special.set_load_options(c['main'].as_int('load_batch_size'),
+                                 c['main'].as_int('load_commit_interval'))
         self.formatter = TabularOutputFormatter(
             format_name=c['main']['table_format'])
         self.syntax_style = c['main']['syntax_style']
+        self.stream_chunk_size = c['main'].as_int('stream_chunk_size')
+        self.show_partial_results = c['main'].as_bool('show_partial_results')
+        self.large_result_guard = c['main']['large_result_guard']
+        self.large_result_rows = c['main'].as_int('large_result_rows')
+        self.large_result_bytes = c['main'].as_int('large_result_bytes')
+        self.fetch_row_limit = c['main'].as_int('fetch_row_limit')
+        self.fetch_byte_limit = c['main'].as_int('fetch_byte_limit')
+        self.page_rows = c['main'].as_int('page_rows')
+        # The cursor and headers of the result that \more continues.
+        self.open_result = None
+        # The cursor and FetchBudget of the last result format_output
+        # fetched, which tell how many of its rows were shown.
+        self.last_fetch = None
+        self.pool_options = {
+            'pool_min': c['main'].as_int('pool_min'),
+            'pool_max': c['main'].as_int('pool_max'),
+            'pool_increment': c['main'].as_int('pool_increment'),
+            'stmtcachesize': c['main'].as_int('statement_cache_size')}
         self.cli_style = c['colors']
         self.wider_completion_menu = c['main'].as_bool('wider_completion_menu')
         c_ddl_warning = c['main'].as_bool('ddl_warning')
@@ -129,7 +158,18 @@ class OCli(object):
                           err=True, fg='red')
                 self.logfile = False
 
-        self.completion_refresher = CompletionRefresher()
+        # Fetch table and column names as completions need them, instead of
+        # all of them at each refresh. The cache would hold them all.
+        self.lazy_completion = c['main'].as_bool('lazy_completion')
+        self.lazy_metadata = None
+        # The ObjectChanges of the scripts run by the current statement, or
+        # None if they need a refresh of all the completions.
+        self.script_changes = []
+        self.completion_refresher = CompletionRefresher(
+            cache_dir=(None if self.lazy_completion
+                       else c['main']['metadata_cache_dir'] or None),
+            parallelism=c['main'].as_int('refresh_parallelism'),
+            on_progress=self._on_refresh_progress)
 
         self.logger = logging.getLogger(__name__)
         self.initialize_logging()
@@ -143,10 +183,17 @@ class OCli(object):
 
         # Initialize completer.
         self.smart_completion = c['main'].as_bool('smart_completion')
+        self.max_completions = c['main'].as_int('max_completions') or None
         self.completer = SQLCompleter(
             self.smart_completion,
-            supported_formats=self.formatter.supported_formats)
-        self._completer_lock = threading.Lock()
+            supported_formats=self.formatter.supported_formats,
+            max_completions=self.max_completions)
+        # Completions are computed in a worker thread, with a snapshot of the
+        # completer that a refresh replaces rather than changes.
+        self.async_completer = AsyncCompleter(
+            self.completer,
+            delay=c['main'].as_int('completion_delay') / 1000.0,
+            smart_completion=self.smart_completion)
 
         # Register custom special commands.
         self.register_special_commands()
@@ -164,10 +211,29 @@ class OCli(object):
             self.change_table_format, 'format', '\\T [format]',
             'Change the format used to output results (html, csv etc.).',
             aliases=('\\T',), case_sensitive=True)
-        special.register_special_command(self.execute_from_file, '@', 'a [filename]',
+        special.register_special_command(self.execute_from_file, '@', '@ [-j jobs] filename',
                                          'Execute commands from file.', aliases=['\\.', 'source'])
         special.register_special_command(self.change_prompt_format, 'prompt',
                                          '\\R', 'Change prompt format.', aliases=('\\R',), case_sensitive=True)
+        special.register_special_command(self.fetch_more, '\\more', '\\more',
+                                         'Fetch the next page of the last result.',
+                                         case_sensitive=True)
+        special.register_special_command(self.set_page_rows, '\\paging',
+                                         '\\paging [rows|off]',
+                                         'Show only the first rows of results, see \\more.',
+                                         case_sensitive=True)
+        special.register_special_command(self.show_statement_cache, '\\stmtcache',
+                                         '\\stmtcache [size]',
+                                         'Show statement cache hit rates or resize the cache.',
+                                         case_sensitive=True)
+        special.register_special_command(self.show_memory_info, '\\meminfo',
+                                         '\\meminfo',
+                                         'Show the memory used by the completion metadata.',
+                                         arg_type=NO_QUERY, case_sensitive=True)
+        special.register_special_command(self.show_perf, '\\perf',
+                                         '\\perf [reset | dump filename]',
+                                         'Show the latency of completions and completion refreshes.',
+                                         case_sensitive=True)
 
     def change_table_format(self, arg, **_):
         try:
@@ -201,6 +267,14 @@ class OCli(object):
             yield (None, None, None, 'Schema updated to {}'.format(arg))
 
     def execute_from_file(self, arg, **_):
+        jobs = 1
+        if arg.startswith('-j'):
+            option, _, arg = arg[2:].strip().partition(' ')
+            try:
+                jobs = int(option)
+            except ValueError:
+                return [(None, None, None, 'Invalid number of jobs: %s' % option)]
+            arg = arg.strip()
         if not arg:
             message = 'Missing required argument, filename.'
             return [(None, None, None, message)]
@@ -215,6 +289,15 @@ class OCli(object):
             message = 'Command execution stopped.'
             return [(None, None, None, message)]
 
+        # The completions are updated once the script has run.
+        changes = completion_changes(query)
+        if changes is None or self.script_changes is None:
+            self.script_changes = None
+        else:
+            self.script_changes.extend(changes)
+
+        if jobs > 1:
+            return [run_script(self.sqlexecute, query, jobs)[1]]
         return self.sqlexecute.run(query)
 
     def change_prompt_format(self, arg, **_):
@@ -228,6 +311,69 @@ class OCli(object):
         self.prompt_format = self.get_prompt(arg)
         return [(None, None, None, "Changed prompt format to %s" % arg)]
 
+    def show_statement_cache(self, arg, **_):
+        """
+        Show the hit rate of the statement cache, and the parse statistics
+        of the session when the user can read them.
+        """
+        if arg:
+            try:
+                size = int(arg)
+            except ValueError:
+                return [(None, None, None, 'Invalid statement cache size: %s' % arg)]
+            self.sqlexecute.set_statement_cache_size(size)
+            return [(None, None, None, 'Statement cache size set to %d.' % size)]
+
+        stats = self.sqlexecute.statement_cache
+        rows = [('cache size', stats.size),
+                ('cache hits', stats.hits),
+                ('cache misses', stats.misses),
+                ('hit rate', '{:.1%}'.format(stats.hit_rate))]
+        session_stats = self.sqlexecute.session_parse_stats()
+        if session_stats:
+            rows.extend(('session ' + name, value) for name, value in session_stats)
+        return [(None, rows, ['Statistic', 'Value'], '')]
+
+    def show_memory_info(self):
+        """
+        Show an estimate of the memory used by the completion metadata, and
+        the peak memory use of the process.
+        """
+        rows = self.completer.memory_info()
+        try:
+            import resource
+        except ImportError:  # Not available on Windows.
+            pass
+        else:
+            # In kilobytes on Linux.
+            rows.append(('process peak RSS', None, resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss * 1024))
+        return [(None, rows, ['Structure', 'Entries', 'Bytes'], '')]
+
+    def show_perf(self, arg, **_):
+        """
+        Show the latency histograms of completions and completion refreshes,
+        reset them, or save them to a JSON file.
+        """
+        command, _, path = (arg or '').strip().partition(' ')
+        if command == 'reset':
+            PERF.reset()
+            return [(None, None, None, 'Performance statistics reset.')]
+        if command == 'dump':
+            path = path.strip()
+            if not path:
+                return [(None, None, None, 'Missing required argument, filename.')]
+            try:
+                PERF.dump(os.path.expanduser(path))
+            except IOError as e:
+                return [(None, None, None, str(e))]
+            return [(None, None, None, 'Performance statistics saved to %s.' % path)]
+        if command:
+            return [(None, None, None, 'Invalid argument: %s' % command)]
+        headers = ['Operation', 'Count', 'Mean ms', 'p50 ms', 'p95 ms', 'Max ms', 'Rows']
+        status = 'Since %s.' % datetime.fromtimestamp(PERF.start).strftime('%Y-%m-%d %H:%M:%S')
+        return [(None, PERF.rows(), headers, status)]
+
     def initialize_logging(self):
 
         log_file = self.config['main']['log_file']
@@ -314,12 +460,14 @@ class OCli(object):
         try:
             from cx_Oracle import DatabaseError
             try:
-                sqlexecute = SQLExecute(database, user, passwd, host)
+                sqlexecute = SQLExecute(database, user, passwd, host,
+                                        **self.pool_options)
             except DatabaseError as e:
                 if ('invalid username/password' in str(e)):
                     passwd = click.prompt('Password', hide_input=True,
                                           show_default=False, type=str)
-                    sqlexecute = SQLExecute(database, user, passwd, host)
+                    sqlexecute = SQLExecute(database, user, passwd, host,
+                                            **self.pool_options)
                 else:
                     raise
         except Exception as e:  # Connecting to a database could fail.
@@ -366,7 +514,8 @@ class OCli(object):
         self.configure_pager()
 
         if self.smart_completion:
-            self.refresh_completions()
+            # Start with the metadata cached by the last session, if any.
+            self.refresh_completions(reset=True)
 
         key_binding_manager = okcli_bindings()
 
@@ -422,6 +571,10 @@ class OCli(object):
                     self.logfile.write('\n')
 
                 successful = False
+                max_rows = self.check_result_size(document.text)
+                if max_rows is False:
+                    self.echo("Aborted!", err=True, fg='red')
+                    return
                 start = time()
                 res = sqlexecute.run(document.text)
                 successful = True
@@ -430,36 +583,39 @@ class OCli(object):
                     logger.debug("headers: %r", headers)
                     logger.debug("rows: %r", cur)
                     logger.debug("status: %r", status)
-                    threshold = 1000
-                    if (is_select(status) and
-                            cur and cur.rowcount > threshold):
-                        self.echo('The result set has more than {} rows.'.format(
-                            threshold), fg='red')
-                        if not click.confirm('Do you want to continue?'):
-                            self.echo("Aborted!", err=True, fg='red')
-                            break
 
                     if self.auto_vertical_output:
                         max_width = self.cli.output.get_size().columns
                     else:
                         max_width = None
 
+                    timing = sqlexecute.timing
                     formatted = self.format_output(
                         title, cur, headers, special.is_expanded_output(),
-                        max_width)
+                        max_width, max_rows, page=True, timing=timing)
 
-                    if cur is not None:
-                        status = self.sqlexecute.get_status(cur)
-                    t = time() - start
                     try:
                         if result_count > 0:
                             self.echo('')
+                        output_start = time()
                         try:
-                            self.output('\n'.join(formatted), status)
+                            self.output(formatted)
                         except KeyboardInterrupt:
-                            pass
+                            self.echo_cancelled()
+                        timing.writing += time() - output_start
+                        if cur is not None:
+                            # Lists, e.g. the report of a script, keep their
+                            # own status.
+                            status = self.fetch_status(cur) or status
+                        self.output_status(status)
+                        t = time() - start
                         if special.is_timing_enabled():
                             self.echo('Time: %0.03fs' % t)
+                            if special.is_timing_detailed():
+                                for line in timing.report():
+                                    self.echo('  ' + line)
+                        if self.log_timing:
+                            timing.log()
                     except KeyboardInterrupt:
                         pass
 
@@ -470,21 +626,10 @@ class OCli(object):
             except EOFError as e:
                 raise e
             except KeyboardInterrupt:
-                # get last connection id
-                connection_id_to_kill = sqlexecute.connection_id
-                logger.debug("connection id to kill: %r", connection_id_to_kill)
-                # Restart connection to the database
-                sqlexecute.connect()
-                try:
-                    for title, cur, headers, status in sqlexecute.run('kill %s' % connection_id_to_kill):
-                        status_str = str(status).lower()
-                        if status_str.find('ok') > -1:
-                            logger.debug("cancelled query, connection id: %r, sql: %r",
-                                         connection_id_to_kill, document.text)
-                            self.echo("cancelled query", err=True, fg='red')
-                except Exception as e:
-                    self.echo('Encountered error while cancelling query: {}'.format(e),
-                              err=True, fg='red')
+                # The statement was cancelled on the server, the session and
+                # its transaction are still usable.
+                logger.debug("cancelled query, sql: %r", document.text)
+                self.echo_cancelled()
             except NotImplementedError:
                 self.echo('Not Yet Implemented.', fg="yellow")
             except Exception as e:
@@ -512,9 +657,7 @@ class OCli(object):
                 self.echo(str(e), err=True, fg='red')
             else:
                 # Refresh the table names and column names if necessary.
-                if need_completion_refresh(document.text):
-                    self.refresh_completions(
-                        reset=need_completion_reset(document.text))
+                self.update_completions(document.text)
             finally:
                 if self.logfile is False:
                     self.echo("Warning: This query was not logged.",
@@ -522,7 +665,9 @@ class OCli(object):
             query = Query(document.text, successful, mutating)
             self.query_history.append(query)
 
-        get_toolbar_tokens = create_toolbar_tokens_func(self.completion_refresher.is_refreshing)
+        get_toolbar_tokens = create_toolbar_tokens_func(
+            self.completion_refresher.is_refreshing,
+            lambda: self.completion_refresher.progress)
 
         layout = create_prompt_layout(
             lexer=OracleLexer,
@@ -537,25 +682,25 @@ class OCli(object):
             )],
             reserve_space_for_menu=self.get_reserved_space()
         )
-        with self._completer_lock:
-            buf = CLIBuffer(always_multiline=self.multi_line, completer=self.completer,
-                            history=FileHistory(os.path.expanduser(os.environ.get('okcli_HISTFILE', '~/.okcli-history'))),
-                            complete_while_typing=Always(), accept_action=AcceptAction.RETURN_DOCUMENT)
+        buf = CLIBuffer(always_multiline=self.multi_line, completer=self.async_completer,
+                        history=FileHistory(os.path.expanduser(os.environ.get('okcli_HISTFILE', '~/.okcli-history'))),
+                        complete_while_typing=Always(), accept_action=AcceptAction.RETURN_DOCUMENT)
+        self.async_completer.watch(buf)
 
-            if self.key_bindings == 'vi':
-                editing_mode = EditingMode.VI
-            else:
-                editing_mode = EditingMode.EMACS
-
-            application = Application(style=style_factory(self.syntax_style, self.cli_style),
-                                      layout=layout, buffer=buf,
-                                      key_bindings_registry=key_binding_manager.registry,
-                                      on_exit=AbortAction.RAISE_EXCEPTION,
-                                      on_abort=AbortAction.RETRY,
-                                      editing_mode=editing_mode,
-                                      ignore_case=True)
-            self.cli = CommandLineInterface(application=application,
-                                            eventloop=create_eventloop())
+        if self.key_bindings == 'vi':
+            editing_mode = EditingMode.VI
+        else:
+            editing_mode = EditingMode.EMACS
+
+        application = Application(style=style_factory(self.syntax_style, self.cli_style),
+                                  layout=layout, buffer=buf,
+                                  key_bindings_registry=key_binding_manager.registry,
+                                  on_exit=AbortAction.RAISE_EXCEPTION,
+                                  on_abort=AbortAction.RETRY,
+                                  editing_mode=editing_mode,
+                                  ignore_case=True)
+        self.cli = CommandLineInterface(application=application,
+                                        eventloop=create_eventloop())
 
         try:
             while True:
@@ -580,47 +725,83 @@ class OCli(object):
         self.log_output(s)
         click.secho(s, **kwargs)
 
-    def output_fits_on_screen(self, output, status=None):
-        """Check if the given output fits on the screen."""
-        size = self.cli.output.get_size()
-
+    def get_output_margin(self):
+        """Get the number of lines that are not available for output."""
         margin = self.get_reserved_space() + self.get_prompt(self.prompt_format).count('\n') + 1
         if special.is_timing_enabled():
             margin += 1
-        if status:
-            margin += 1 + status.count('\n')
+            if special.is_timing_detailed():
+                margin += 5
+        # The status line.
+        margin += 1
+        return margin
 
-        for i, line in enumerate(output.splitlines(), 1):
-            if len(line) > size.columns or i > (size.rows - margin):
-                return False
+    def output(self, output):
+        """Output lines to stdout or a pager command.
 
-        return True
+        *output* is an iterable of lines. It is consumed lazily so that each
+        line is written as soon as it is formatted; lines are only held back
+        until it is known whether they fit on the screen.
 
-    def output(self, output, status=None):
-        """Output text to stdout or a pager command.
+        The output will be logged in the audit log, if enabled. The output
+        will be written to the tee file, if enabled. The output will be
+        written to the output file, if enabled.
 
-        The status text is not outputted to pager or files.
+        """
+        lines = self._log_lines(output)
+        buf = []
+        use_pager = self.explicit_pager
+
+        if not use_pager and special.is_pager_enabled():
+            size = self.cli.output.get_size()
+            max_lines = size.rows - self.get_output_margin()
+            try:
+                for line in lines:
+                    buf.append(line)
+                    if len(line) > size.columns or len(buf) > max_lines:
+                        use_pager = True
+                        break
+            except KeyboardInterrupt:
+                # Show the rows fetched before the query was cancelled.
+                if self.show_partial_results:
+                    for line in buf:
+                        click.secho(line)
+                raise
+
+        if use_pager:
+            click.echo_via_pager(line + '\n' for line in chain(buf, lines))
+        else:
+            for line in chain(buf, lines):
+                click.secho(line)
 
-        The message will be logged in the audit log, if enabled. The
-        message will be written to the tee file, if enabled. The
-        message will be written to the output file, if enabled.
+    def echo_cancelled(self):
+        """Tell the user that the query was cancelled, and how long the
+        cancel took if timing is enabled."""
+        self.echo('cancelled query', err=True, fg='red')
+        cancel_time = self.sqlexecute.cancel_time
+        if cancel_time is not None and special.is_timing_enabled():
+            self.echo('Cancel time: %0.03fs' % cancel_time)
 
-        """
-        if output:
-            self.log_output(output)
-            special.write_tee(output)
-            special.write_once(output)
-
-            if (self.explicit_pager or
-                    (special.is_pager_enabled() and not self.output_fits_on_screen(output, status))):
-                click.echo_via_pager(output)
-            else:
-                click.secho(output)
+    def output_status(self, status):
+        """Output the status text to stdout.
 
+        The status text is not outputted to pager or files.
+
+        """
         if status:
             self.log_output(status)
             click.secho(status)
 
+    def _log_lines(self, lines):
+        try:
+            for line in lines:
+                self.log_output(line)
+                special.write_tee(line + '\n')
+                special.write_once(line)
+                yield line
+        finally:
+            special.close_once()
+
     def configure_pager(self):
         # Provide sane defaults for less if they are empty.
         if not os.environ.get('LESS'):
@@ -636,41 +817,120 @@ class OCli(object):
         if cnf['skip-pager']:
             special.disable_pager()
 
+    def _completer_options(self):
+        options = {
+            'smart_completion': self.smart_completion,
+            'supported_formats': self.formatter.supported_formats,
+            'max_completions': self.max_completions}
+        if self.lazy_metadata is not None:
+            options['lazy_metadata'] = self.lazy_metadata
+        return options
+
     def refresh_completions(self, reset=False):
+        if self.lazy_metadata is None:
+            # Synonyms, packages and sequences, and in lazy mode the tables,
+            # are fetched on first use.
+            self.lazy_metadata = LazyMetadata(
+                self.sqlexecute, self._on_lazy_metadata_fetched,
+                loaders=CompletionRefresher.schema_refreshers,
+                lazy_tables=self.lazy_completion)
+        else:
+            # The objects may have changed.
+            self.lazy_metadata.clear()
+        completer_options = self._completer_options()
+        empty = False
         if reset:
-            with self._completer_lock:
-                self.completer.reset_completions()
+            # After 'use', the metadata of all the schemas is already loaded:
+            # only the current schema changes. Otherwise, start from an empty
+            # completer rather than emptying the one that completions may be
+            # using, and let the refresh read the metadata cached on disk.
+            empty = not any(self.completer.dbmetadata.values())
+            completer = (SQLCompleter(**completer_options) if empty
+                         else self.completer.copy())
+            completer.set_dbname(self.sqlexecute.dbname or '')
+            self._swap_completer_objects(completer)
+        # Without cached metadata, the current schema is completed before
+        # all the others are fetched.
         self.completion_refresher.refresh(
-            self.sqlexecute, self._on_completions_refreshed,
-            {'smart_completion': self.smart_completion,
-             'supported_formats': self.formatter.supported_formats})
+            self.sqlexecute, self._on_completions_refreshed, completer_options,
+            progressive=empty, from_cache=empty)
 
         return [(None, None, None,
                  'Auto-completion refresh started in the background.')]
 
+    def update_completions(self, text):
+        """Update the completions after *text* and the scripts it sourced
+        ran, in one go: only the objects their DDL changed are fetched again,
+        unless all the completions have to be refreshed."""
+        changes, self.script_changes = self.script_changes, []
+        if need_completion_refresh(text):
+            if need_completion_reset(text):
+                return self.refresh_completions(reset=True)
+            text_changes = completion_changes(text)
+            if changes is not None and text_changes is not None:
+                changes = changes + text_changes
+            else:
+                changes = None
+        if changes is None:
+            return self.refresh_completions()
+        lazy_metadata = self.lazy_metadata
+        if lazy_metadata is not None:
+            # The objects fetched on first use are fetched again when needed.
+            for change in changes:
+                if change.kind in lazy_metadata.loaders:
+                    lazy_metadata.forget(
+                        (change.schema or self.sqlexecute.dbname).upper())
+                elif (change.kind in RELATION_KINDS and
+                      lazy_metadata.lazy_tables):
+                    lazy_metadata.clear()
+            changes = [change for change in changes
+                       if change.kind not in lazy_metadata.loaders and not
+                       (change.kind in RELATION_KINDS and
+                        lazy_metadata.lazy_tables)]
+        if changes:
+            return self.completion_refresher.update(
+                self.sqlexecute, changes, self._on_completions_refreshed,
+                self._completer_options())
+
     def _on_completions_refreshed(self, new_completer):
         self._swap_completer_objects(new_completer)
 
         if self.cli:
-            # After refreshing, redraw the CLI to clear the statusbar
+            # After refreshing, redraw the CLI to update the statusbar
             # "Refreshing completions..." indicator
             self.cli.request_redraw()
 
+    def _on_refresh_progress(self, progress):
+        if self.cli:
+            # Show the progress in the statusbar.
+            self.cli.request_redraw()
+
+    def _on_lazy_metadata_fetched(self):
+        if self.cli:
+            # Complete again with the names that were missing.
+            self.cli.eventloop.call_from_executor(self._complete_again)
+
+    def _complete_again(self):
+        buf = self.cli.current_buffer
+        state = buf.complete_state
+        if state is not None and state.complete_index is not None:
+            # Don't move the selection in the completion menu.
+            return
+        buf.complete_state = None
+        self.cli.start_completion()
+
     def _swap_completer_objects(self, new_completer):
         """Swap the completer object in cli with the newly created completer.
+
+        The new completer must not be changed afterwards: completions in
+        progress keep using the one they started with.
         """
-        with self._completer_lock:
-            self.completer = new_completer
-            # When okcli is first launched we call refresh_completions before
-            # instantiating the cli object. So it is necessary to check if cli
-            # exists before trying the replace the completer object in cli.
-            if self.cli:
-                self.cli.current_buffer.completer = new_completer
+        self.completer = new_completer
+        self.async_completer.completer = new_completer
 
     def get_completions(self, text, cursor_positition):
-        with self._completer_lock:
-            return self.completer.get_completions(
-                Document(text=text, cursor_position=cursor_positition), None)
+        return self.completer.get_completions(
+            Document(text=text, cursor_position=cursor_positition), None)
 
     def get_prompt(self, string):
         sqlexecute = self.sqlexecute
@@ -689,36 +949,164 @@ class OCli(object):
         string = string.replace('\\s', now.strftime('%S'))
         return string
 
-    def run_query(self, query, new_line=True):
-        """Runs *query*."""
-        results = self.sqlexecute.run(query)
+    def run_query(self, query, jobs=1):
+        """Runs *query*, the statements of which run in parallel on *jobs*
+        sessions if *jobs* is more than one.
+
+        Returns the number of statements that failed or were skipped, which
+        is only counted when they run in parallel.
+        """
+        failed = 0
+        if jobs > 1:
+            failed, report = run_script(self.sqlexecute, query, jobs)
+            results = [report]
+        else:
+            results = self.sqlexecute.run(query)
         for result in results:
             title, cur, headers, status = result
             output = self.format_output(title, cur, headers)
             for line in output:
-                click.echo(line, nl=new_line)
+                click.echo(line)
+        if jobs > 1:
+            click.echo(report[3])
+        return failed
 
     def format_output(self, title, cur, headers, expanded=False,
-                      max_width=None):
+                      max_width=None, max_rows=None, page=False, timing=None):
+        """Format a result, returning an iterator over the output lines.
+
+        Rows are fetched from *cur* and formatted a chunk at a time, as the
+        returned iterator is consumed. Fetching stops at *max_rows* rows, or
+        at the fetch_row_limit and fetch_byte_limit of the config.
+
+        With *page*, only page_rows rows are fetched and the cursor is kept
+        open for `\\more`. The fetch and format times are added to *timing*,
+        a `StatementTiming`, if given.
+        """
         expanded = expanded or self.formatter.format_name == 'vertical'
         output = []
 
         if title:  # Only print the title if it's not None.
-            output.append(title)
+            output.extend(title.splitlines())
 
-        if cur:
-            rows = list(cur)
-            formatted = self.formatter.format_output(
-                rows, headers, format_name='vertical' if expanded else None)
+        if page:
+            self.open_result = None
+        self.last_fetch = None
 
-            if (not expanded and max_width and rows and
-                    content_exceeds_width(rows[0], max_width) and headers):
-                formatted = self.formatter.format_output(
-                    rows, headers, format_name='vertical')
+        if cur:
+            paged = page and self.page_rows > 0 and hasattr(cur, 'fetchmany')
+            if paged:
+                if not isinstance(cur, PagedCursor):
+                    # Don't fetch much more than a page per round trip.
+                    cur.arraysize = min(cur.arraysize, self.page_rows + 1)
+                    cur = PagedCursor(cur)
+                max_rows = min(max_rows or self.page_rows, self.page_rows)
+
+            size = self.stream_chunk_size
+            if max_rows:
+                # One more row than needed tells if there are more rows.
+                size = min(size, max_rows + 1)
+            budget = FetchBudget(max_rows or self.fetch_row_limit,
+                                 self.fetch_byte_limit)
+            self.last_fetch = (cur, budget)
+            call = self.sqlexecute.call_cancellable
+            if timing:
+                call = timing.fetch_call(call, getattr(cur, 'arraysize', None))
+            chunks = budget.limit(fetch_chunks(cur, size, call))
+            sample = next(chunks, [])
+
+            if (not expanded and max_width and sample and
+                    content_exceeds_width(sample[0], max_width) and headers):
+                expanded = True
+
+            formatted = format_stream(
+                self.formatter, chain([sample], chunks), headers,
+                format_name='vertical' if expanded else None)
+            if paged:
+                formatted = chain(formatted,
+                                  self.end_of_page(budget, cur, headers))
+            else:
+                formatted = chain(formatted, budget.notice())
+            if timing:
+                formatted = timing.timed(formatted, 'formatting')
+            return chain(output, formatted)
+
+        return iter(output)
+
+    def fetch_status(self, cur):
+        """Return the status of the result of *cur*, once format_output
+        has fetched it: the rows shown if the fetch was stopped, as the row
+        count of the cursor also counts the rows fetched but left out."""
+        if self.last_fetch is not None:
+            shown, budget = self.last_fetch
+            if budget.exceeded:
+                # A paged cursor counts the rows of all the pages.
+                rows = (shown.rowcount if isinstance(shown, PagedCursor)
+                        else budget.rows)
+                return '{0} row{1} shown, fetch stopped: {2}.'.format(
+                    rows, '' if rows == 1 else 's', budget.exceeded)
+        return self.sqlexecute.get_status(cur)
+
+    def end_of_page(self, budget, cur, headers):
+        """Keep the paged cursor *cur* open for `\\more` if there are rows
+        left, yielding a line saying so."""
+        if budget.exceeded:
+            cur.keep(budget.remainder)
+            self.open_result = (cur, headers)
+            yield ('Fetch stopped after {0} rows, type \\more for the next '
+                   'page.'.format(cur.rowcount))
+
+    def fetch_more(self, **_):
+        """Continue the last paged result."""
+        if self.open_result is None:
+            return [(None, None, None, 'No more rows.')]
+        cur, headers = self.open_result
+        return [(None, cur, headers, '')]
+
+    def set_page_rows(self, arg, **_):
+        if arg:
+            try:
+                self.page_rows = 0 if arg.lower() == 'off' else int(arg)
+            except ValueError:
+                return [(None, None, None, 'Invalid page size: %s' % arg)]
+        if self.page_rows > 0:
+            message = 'Results are fetched %d rows at a time.' % self.page_rows
+        else:
+            message = 'Paging is off.'
+        return [(None, None, None, message)]
 
-            output.append(formatted)
+    def check_result_size(self, text):
+        """Estimate the size of the results of the queries in *text* from
+        their execution plans, before running them.
 
-        return output
+        Returns False if a result is over the large_result thresholds and the
+        user doesn't want to continue, the number of rows to fetch if the
+        results must be limited, or None.
+        """
+        if self.large_result_guard not in ('warn', 'limit'):
+            return None
+        for sql in sqlparse.split(text):
+            if not query_starts_with(sql, ('select', 'with')):
+                continue
+            estimate = self.sqlexecute.estimate(sql.rstrip(';'))
+            if estimate is None:
+                continue
+            rows, size = estimate
+            if rows <= self.large_result_rows and size <= self.large_result_bytes:
+                continue
+            message = ('The result set is estimated at {0} rows '
+                       '({1:.1f} MB).'.format(rows, size / 1024.0 / 1024))
+            if self.large_result_guard == 'limit':
+                max_rows = self.large_result_rows
+                if size:
+                    max_rows = max(1, min(max_rows, self.large_result_bytes * rows // size))
+                self.echo('{0} Fetching the first {1} rows.'.format(
+                    message, max_rows), fg='red')
+                return max_rows
+            self.echo(message, fg='red')
+            if not sys.stdin.isatty() or not click.confirm('Do you want to continue?'):
+                return False
+        return None
 
     def get_reserved_space(self):
         """Get the number of lines to reserve for the completion menu."""
@@ -755,15 +1143,21 @@ class OCli(object):
               help='Warn before running a destructive query.')
 @click.option('--login-path', type=str,
               help='Read this path from the login file.')
+@click.option('--arraysize', type=str,
+              help='Rows fetched per round trip, or "auto" to size it from the row width.')
+@click.option('--bind', 'binds', multiple=True, metavar='NAME=VALUE',
+              help='Set a bind variable, can be repeated.')
 @click.option('-e', '--execute', type=str,
               help='Execute command and quit.')
 @click.option('-@', '--filename', type=str,
               help='Execute commands in a file.')
+@click.option('-j', '--jobs', type=click.IntRange(min=1), default=1,
+              help='Run the independent statements of --filename in parallel on this many sessions.')
 @click.argument('sqlplus', default='', nargs=1)
 def cli(sqlplus, user, host, password, database,
         version, prompt, logfile, login_path,
         auto_vertical_output, table, csv,
-        warn, execute, filename, okclirc):
+        warn, execute, filename, okclirc, arraysize, binds, jobs):
     """An Oracle-DB terminal client with auto-completion and syntax highlighting.
 
     \b
@@ -773,6 +1167,8 @@ def cli(sqlplus, user, host, password, database,
       - okcli user/password@tns_name -D schema
       - okcli user/password@tns_name -e "query"
       - okcli user@tns_name -@ query_file.sql
+      - okcli user@tns_name -@ maintenance.sql --jobs 4
+      - okcli user@tns_name -e "select * from emp where id = :id" --bind id=7
     """
 
     if version:
@@ -785,7 +1181,20 @@ def cli(sqlplus, user, host, password, database,
     okcli = OCli(prompt=prompt, logfile=logfile,
                     login_path=login_path,
                     auto_vertical_output=auto_vertical_output, warn=warn,
-                    okclirc=okclirc)
+                    okclirc=okclirc, arraysize=arraysize)
+
+    # Each job borrows a session of the pool, which has the one of the
+    # prompt too.
+    max_jobs = max(1, okcli.pool_options['pool_max'] - 1)
+    if jobs > max_jobs:
+        raise click.BadParameter(
+            'at most %d, one less than pool_max.' % max_jobs,
+            param_hint="'--jobs'")
+
+    for bind in binds:
+        name, _, value = bind.partition('=')
+        special.bindvariables.set(name.strip().lstrip(':'),
+                                  special.parse_value(value))
 
     okcli.connect(database, user, password, host)
 
@@ -813,7 +1222,8 @@ def cli(sqlplus, user, host, password, database,
         try:
             with open(os.path.expanduser(filename), encoding='utf-8') as f:
                 query = f.read()
-            okcli.run_query(query)
+            if okcli.run_query(query, jobs):
+                exit(1)
         except IOError as e:
             click.secho(str(e), err=True, fg='red')
 
@@ -832,15 +1242,12 @@ def cli(sqlplus, user, host, password, database,
                 confirm_ddl_query(stdin_text) is False):
             exit(0)
         try:
-            new_line = True
-
             if csv:
                 okcli.formatter.format_name = 'csv'
-                new_line = False
             elif not table:
                 okcli.formatter.format_name = 'tsv'
 
-            okcli.run_query(stdin_text, new_line=new_line)
+            okcli.run_query(stdin_text)
             exit(0)
         except Exception as e:
             click.secho(str(e), err=True, fg='red')
@@ -862,12 +1269,31 @@ def need_completion_refresh(queries):
         try:
             first_token = query.split()[0]
             if first_token.lower() in ('alter', 'create', 'use', '\\r',
-                                       '\\u', 'connect', 'drop'):
+                                       '\\u', 'connect', 'drop', 'rename'):
                 return True
         except Exception:
             return False
 
 
+def completion_changes(queries):
+    """Return the ObjectChanges of the completions made by *queries*, or
+    None if all of them need a refresh.
+
+    >>> completion_changes('drop table emp; use hr') is None
+    True
+    """
+    changes = []
+    for query in sqlparse.split(queries):
+        words = query.split()
+        if words and words[0].lower() in ('use', '\\r', '\\u', 'connect'):
+            return None
+        query_changes = ddl_changes(query)
+        if query_changes is None:
+            return None
+        changes.extend(query_changes)
+    return changes
+
+
 def need_completion_reset(queries):
     """Determines if the statement is a database switch such as 'use' or '\\u'.
     When a database is changed the existing completions must be reset before we
@@ -892,13 +1318,6 @@ def is_mutating(status):
     return status.split(None, 1)[0].lower() in mutating
 
 
-def is_select(status):
-    """Returns true if the first word in status is 'select'."""
-    if not status:
-        return False
-    return status.split(None, 1)[0].lower() == 'select'
-
-
 def query_starts_with(query, prefixes):
     """Check if the query starts with any item from *prefixes*."""
     prefixes = [prefix.lower() for prefix in prefixes]
@@ -0,0 +1,261 @@
+"""Keep the completion metadata between sessions.
+
+The tables, columns and functions of all the schemas are saved to a file per
+user and database. At the next start, completions are loaded from the file at
+once, and the refresh only fetches the objects whose ``LAST_DDL_TIME`` is
+after the server time at which the metadata was last fetched (its
+watermark).
+
+Dropped objects don't show up as changes: the schemas whose number of objects
+isn't what the changes account for are fetched again, and if too many objects
+changed, everything is fetched again in full.
+"""
+from __future__ import unicode_literals
+
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import tempfile
+
+from .metadata_fetch import prefetch
+
+_logger = logging.getLogger(__name__)
+
+RELATION_TYPES = ('TABLE', 'VIEW')
+
+# The SQLExecute queries answered from the cache.
+CACHED_QUERIES = ('databases', 'all_tables', 'all_views', 'all_table_columns',
+                  'all_functions')
+
+
+class MetadataCache(object):
+    """The completion metadata of a user on a database, saved in *path*.
+
+    ``schemas`` maps each owner to a dict with its ``tables`` (a dict of
+    table and view names to their column names), its ``views`` (the names of
+    the views among them) and its ``functions``, up to date with the server
+    time ``watermark``.
+    """
+
+    VERSION = 3
+
+    # Above this many changed objects or stale schemas, everything is
+    # fetched again in full.
+    max_changes = 100
+    max_stale_schemas = 10
+
+    def __init__(self, path):
+        self.path = path
+        self.watermark = None
+        self.users = []
+        self.schemas = {}
+
+    @classmethod
+    def for_session(cls, directory, user, host):
+        """Return the cache of *user* on the database *host*, in
+        *directory*.
+
+        >>> os.path.basename(MetadataCache.for_session('~', 'Scott', 'xe').path)
+        'scott@xe-2c3a62f8.json'
+        """
+        key = '{0}@{1}'.format(user, host).lower()
+        name = re.sub(r'[^\w.@-]+', '_', key)[:64]
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:8]
+        return cls(os.path.join(os.path.expanduser(directory),
+                                '{0}-{1}.json'.format(name, digest)))
+
+    @property
+    def databases(self):
+        """The owners of tables or views."""
+        return sorted(owner for owner, entry in self.schemas.items()
+                      if entry['tables'])
+
+    def load(self):
+        """Read the cache file; return whether there was a usable one."""
+        try:
+            with io.open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            _logger.debug('No metadata cache in %r.', self.path, exc_info=True)
+            return False
+        if not isinstance(data, dict) or data.get('version') != self.VERSION:
+            _logger.info('Ignoring the metadata cache %r.', self.path)
+            return False
+        self.watermark = data['watermark']
+        self.users = data['users']
+        self.schemas = data['schemas']
+        return True
+
+    def save(self):
+        """Write the cache file, replacing it at once."""
+        directory = os.path.dirname(self.path)
+        data = {'version': self.VERSION, 'watermark': self.watermark,
+                'users': self.users, 'schemas': self.schemas}
+        temp = None
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory, 0o700)
+            fd, temp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with io.open(fd, 'w', encoding='utf-8') as f:
+                f.write(json.dumps(data, ensure_ascii=False))
+            os.replace(temp, self.path)
+        except (IOError, OSError):
+            _logger.error('Could not save the metadata cache %r.', self.path,
+                          exc_info=True)
+            if temp is not None and os.path.exists(temp):
+                os.remove(temp)
+
+    def sync(self, executor):
+        """Bring the metadata up to date with *executor*."""
+        if self.watermark is not None and self._apply_changes(executor):
+            return
+        _logger.debug('Fetching the metadata in full.')
+        for query in ('server_time',) + CACHED_QUERIES[1:]:
+            prefetch(executor, query)
+        watermark = executor.server_time()
+        schemas = {}
+        for owner, name in executor.all_tables():
+            _schema(schemas, owner)['tables'][name] = []
+        for owner, name in executor.all_views():
+            _schema(schemas, owner)['views'].append(name)
+        for owner, relname, column in executor.all_table_columns():
+            tables = _schema(schemas, owner)['tables']
+            if relname in tables:
+                tables[relname].append(column)
+        for owner, name in executor.all_functions():
+            _schema(schemas, owner)['functions'].append(name)
+        self.watermark, self.schemas = watermark, schemas
+
+    def _apply_changes(self, executor):
+        """Fetch the objects changed since the watermark; return False if
+        everything must be fetched in full instead."""
+        prefetch(executor, 'server_time')
+        prefetch(executor, 'changed_objects', self.watermark)
+        prefetch(executor, 'object_counts')
+        watermark = executor.server_time()
+        changes = executor.changed_objects(self.watermark)
+        if len(changes) > self.max_changes:
+            return False
+        counts = executor.object_counts()
+
+        added = dict.fromkeys(counts, 0)
+        for owner, name, object_type in changes:
+            entry = self.schemas.get(owner, _entry())
+            if name not in (entry['tables'] if object_type in RELATION_TYPES
+                            else entry['functions']):
+                added[owner] = added.get(owner, 0) + 1
+        stale = [owner for owner, count in counts.items()
+                 if owner not in self.schemas or
+                 count != _object_count(self.schemas[owner]) + added[owner]]
+        if len(stale) > self.max_stale_schemas:
+            return False
+        _logger.debug('%d objects changed since %s, %d schemas are stale.',
+                      len(changes), self.watermark, len(stale))
+
+        for owner in set(self.schemas) - set(counts):
+            del self.schemas[owner]
+        for owner in stale:
+            for query in ('tables', 'views', 'table_columns', 'functions'):
+                prefetch(executor, query, owner)
+        for owner, name, object_type in changes:
+            if object_type in RELATION_TYPES and owner not in stale:
+                prefetch(executor, 'relation_columns', owner, name)
+        for owner in stale:
+            self.schemas[owner] = _fetch_schema(executor, owner)
+        for owner, name, object_type in changes:
+            if owner in stale or owner not in self.schemas:
+                continue
+            entry = self.schemas[owner]
+            if object_type in RELATION_TYPES:
+                entry['tables'][name] = executor.relation_columns(owner, name)
+                if name in entry['views']:
+                    entry['views'].remove(name)
+                if object_type == 'VIEW':
+                    entry['views'].append(name)
+            elif name not in entry['functions']:
+                entry['functions'].append(name)
+        self.watermark = watermark
+        return True
+
+
+def _entry():
+    return {'tables': {}, 'views': [], 'functions': []}
+
+
+def _schema(schemas, owner):
+    return schemas.setdefault(owner, _entry())
+
+
+def _object_count(entry):
+    return len(entry['tables']) + len(entry['functions'])
+
+
+def _fetch_schema(executor, owner):
+    """Fetch the metadata of the schema *owner* alone."""
+    tables = dict((row[0], []) for row in executor.tables(owner))
+    for relname, column in executor.table_columns(owner):
+        if relname in tables:
+            tables[relname].append(column)
+    return {'tables': tables, 'views': list(executor.views(owner)),
+            'functions': list(executor.functions(owner))}
+
+
+class CachedMetadata(object):
+    """Answer the data dictionary queries of the completion refreshers from
+    *cache*, after bringing it up to date with *executor* once.
+
+    Without an executor, only the cached metadata is used, with *dbname* as
+    the current schema.
+    """
+
+    def __init__(self, cache, executor=None, dbname=None):
+        self.cache = cache
+        self.executor = executor
+        self.dbname = executor.dbname if executor is not None else dbname
+        self._synced = False
+
+    def prefetch(self, name, *args):
+        # The cached queries are run by sync instead.
+        if self.executor is not None and name not in CACHED_QUERIES:
+            prefetch(self.executor, name, *args)
+
+    def databases(self):
+        return self._synced_cache().databases
+
+    def users(self):
+        if self.executor is not None:
+            users = self.executor.users()
+            # The users are None if they could not be fetched.
+            if users is not None:
+                self.cache.users = users
+        return list(self.cache.users)
+
+    def all_tables(self):
+        return [(owner, name)
+                for owner, entry in self._synced_cache().schemas.items()
+                for name in entry['tables']]
+
+    def all_views(self):
+        return [(owner, name)
+                for owner, entry in self._synced_cache().schemas.items()
+                for name in entry['views']]
+
+    def all_table_columns(self):
+        return ((owner, name, column)
+                for owner, entry in self._synced_cache().schemas.items()
+                for name, columns in entry['tables'].items()
+                for column in columns)
+
+    def all_functions(self):
+        return [(owner, name)
+                for owner, entry in self._synced_cache().schemas.items()
+                for name in entry['functions']]
+
+    def _synced_cache(self):
+        if self.executor is not None and not self._synced:
+            self.cache.sync(self.executor)
+            self._synced = True
+        return self.cache
@@ -0,0 +1,152 @@
+"""Run the data dictionary queries of a completion refresh.
+
+Each query is a unit of the RefreshProgress of the refresh, and stops when
+the refresh is cancelled. In a parallel refresh, each query runs on its own
+session borrowed from the session pool, so the round trips of the refresh
+overlap instead of adding up. The refreshers still populate the SQLCompleter
+one after another, from the results.
+"""
+from __future__ import unicode_literals
+
+import logging
+import queue
+import time
+import types
+
+from .perfstats import PERF
+
+_logger = logging.getLogger(__name__)
+
+
+def prefetch(executor, name, *args):
+    """Start the query method *name* of *executor* with *args* ahead of its
+    call, if *executor* can run queries in the background."""
+    start = getattr(executor, 'prefetch', None)
+    if start is not None:
+        start(name, *args)
+
+
+class MetadataFetch(object):
+    """Stand-in for SQLExecute whose queries report to *progress*.
+
+    Without a *pool*, queries run when called, on *sqlexecute*. With a pool
+    of threads, they run in the pool, each on a session borrowed from
+    *sqlexecute*: a query started with `prefetch` runs in the background,
+    and calling its method then waits for the result. The result of each
+    call is kept, so a new MetadataFetch is needed to fetch again.
+
+    The rows of a query that streams them are yielded as they are fetched,
+    and can be iterated once: without a pool, on *sqlexecute*, and with a
+    pool, in batches handed over by the thread that fetches them.
+    """
+
+    def __init__(self, sqlexecute, progress, pool=None):
+        self.sqlexecute = sqlexecute
+        self.dbname = sqlexecute.dbname
+        self.progress = progress
+        self._pool = pool
+        self._fetches = {}
+        self._results = {}
+
+    def prefetch(self, name, *args):
+        if self._pool is not None:
+            self._fetch_queue(name, args)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def call(*args):
+            if self._pool is None:
+                self.progress.add_units()
+                return self._run(self.sqlexecute, name, args)
+            key = (name, args)
+            if key not in self._results:
+                self._results[key] = _received(self._fetch_queue(name, args))
+            return self._results[key]
+        return call
+
+    def _fetch_queue(self, name, args):
+        key = (name, args)
+        results = self._fetches.get(key)
+        if results is None:
+            self.progress.add_units()
+            results = queue.Queue()
+            self._pool.submit(self._fetch, results, name, args)
+            self._fetches[key] = results
+        return results
+
+    def _fetch(self, results, name, args):
+        """Put the result of a query run in the pool in *results*; the rows
+        of a streamed query are put in batches, as they are fetched, so
+        that they are processed meanwhile."""
+        try:
+            self.progress.check()
+            with self.sqlexecute.borrow() as session:
+                result = self._run(session, name, args)
+                if not isinstance(result, types.GeneratorType):
+                    results.put((_RESULT, result))
+                    return
+                batch = []
+                for row in result:
+                    batch.append(row)
+                    if len(batch) == self.progress.batch:
+                        results.put((_ROWS, batch))
+                        batch = []
+                results.put((_ROWS, batch))
+                results.put((_END, None))
+        except BaseException as error:
+            results.put((_ERROR, error))
+
+    def _run(self, session, name, args):
+        _logger.debug('Fetching %s%r.', name, args)
+        start = time.time()
+        with self.progress.running(session):
+            result = getattr(session, name)(*args)
+            if isinstance(result, types.GeneratorType):
+                return self._stream(session, name, start, result)
+        rows = 0
+        if isinstance(result, list):
+            rows = len(result)
+            self.progress.add_rows(rows)
+        self._done(name, start, rows)
+        return result
+
+    def _stream(self, session, name, start, rows):
+        """Yield *rows*, streamed from *session*, which must not be given
+        back before they are consumed."""
+        count = 0
+        with self.progress.running(session):
+            for row in self.progress.track(rows):
+                yield row
+                count += 1
+        self._done(name, start, count)
+
+    def _done(self, name, start, rows):
+        PERF.record('query ' + name, time.time() - start, rows)
+        self.progress.unit_done()
+
+
+# The kinds of the items of the queue of a query run in the pool.
+_RESULT, _ROWS, _END, _ERROR = range(4)
+
+
+def _received(results):
+    """Return the result of a query run in the pool, from its queue."""
+    kind, value = results.get()
+    if kind == _ERROR:
+        raise value
+    if kind == _RESULT:
+        return value
+    return _received_rows(results, value)
+
+
+def _received_rows(results, batch):
+    while True:
+        for row in batch:
+            yield row
+        kind, batch = results.get()
+        if kind == _ERROR:
+            raise batch
+        if kind == _END:
+            return
@@ -0,0 +1,165 @@
+"""Compact storage of the completion metadata.
+
+Large dictionaries repeat the same column names over and over. Each name is
+stored once, interned, in the NameTable shared by all the completers of the
+process, and the columns of a table are an array of the 4-byte ids of their
+names rather than a list of strings.
+
+The id of a name never changes, so the tables of a schema can be compared
+with those of the previous completer, whose metadata and indexes are then
+reused. Names are never removed: the table grows with the distinct names
+seen by the process, not with the number of refreshes.
+"""
+from __future__ import unicode_literals
+
+import sys
+import threading
+from array import array
+from sys import intern
+
+from .prefixindex import PrefixIndex
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+
+class NameTable(object):
+    """Names, each stored once and identified by an integer id.
+
+    >>> names = NameTable()
+    >>> names.ids(['ID', 'NAME', 'ID'])
+    array('I', [0, 1, 0])
+    >>> names.names([1, 0])
+    ['NAME', 'ID']
+    """
+
+    def __init__(self):
+        self._names = []
+        self._ids = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._names)
+
+    def id(self, name):
+        """Return the id of *name*, adding it if it's new."""
+        i = self._ids.get(name)
+        if i is None:
+            # A refresh adds names while completions look them up.
+            with self._lock:
+                i = self._ids.get(name)
+                if i is None:
+                    name = intern(name)
+                    i = len(self._names)
+                    self._names.append(name)
+                    self._ids[name] = i
+        return i
+
+    def ids(self, names):
+        return array('I', [self.id(name) for name in names])
+
+    def name(self, i):
+        return self._names[i]
+
+    def names(self, ids):
+        names = self._names
+        return [names[i] for i in ids]
+
+    def nbytes(self):
+        """Estimate the memory used by the table and its names."""
+        return (sys.getsizeof(self._names) + sys.getsizeof(self._ids) +
+                sum(sys.getsizeof(name) for name in self._names))
+
+
+NAMES = NameTable()
+
+
+class Relations(Mapping):
+    """The tables or views of a schema, mapping their names to the list of
+    their column names, which are stored as ids of *names*.
+
+    >>> tables = Relations()
+    >>> tables.add('EMP')
+    'EMP'
+    >>> tables.add_column('EMP', 'ID')
+    >>> tables['EMP']
+    ['*', 'ID']
+    """
+
+    def __init__(self, names=NAMES):
+        self.names = names
+        self._columns = {}
+
+    def add(self, name, star=True):
+        """Add the relation *name*, with no columns but an asterisk unless
+        *star* is false, and return the name as stored."""
+        name = intern(name)
+        self._columns[name] = array('I', [self.names.id('*')] if star else [])
+        return name
+
+    def remove(self, name):
+        self._columns.pop(name, None)
+
+    def copy(self):
+        """Return Relations with the same columns, which relations can be
+        added to or removed from without changing these."""
+        relations = Relations(self.names)
+        relations._columns = dict(self._columns)
+        return relations
+
+    def add_column(self, relname, column):
+        self._columns[relname].append(self.names.id(column))
+
+    def __getitem__(self, name):
+        return self.names.names(self._columns[name])
+
+    def __contains__(self, name):
+        return name in self._columns
+
+    def __iter__(self):
+        return iter(self._columns)
+
+    def __len__(self):
+        return len(self._columns)
+
+    def column_count(self):
+        star = self.names.id('*')
+        return sum(len(ids) - ids.count(star)
+                   for ids in self._columns.values())
+
+    def column_names(self):
+        """Return the set of the column names of all the relations."""
+        ids = set()
+        for columns in self._columns.values():
+            ids.update(columns)
+        return set(self.names.names(ids))
+
+    def same_as(self, other):
+        """Do *other* Relations have the same relations and columns?"""
+        return self.names is other.names and self._columns == other._columns
+
+    def nbytes(self):
+        """Estimate the memory used, not counting the names."""
+        return sys.getsizeof(self._columns) + sum(
+            sys.getsizeof(ids) for ids in self._columns.values())
+
+
+_shared_indexes = {}
+
+
+def shared_index(items):
+    """Return a sorted PrefixIndex of *items*, the same one for the same
+    items, which must therefore not be changed.
+
+    >>> shared_index(['SELECT', 'FROM']) is shared_index(['SELECT', 'FROM'])
+    True
+    """
+    key = tuple(items)
+    index = _shared_indexes.get(key)
+    if index is None:
+        index = PrefixIndex(key)
+        index.build()
+        _shared_indexes[key] = index
+    return index
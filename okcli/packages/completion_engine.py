@@ -2,11 +2,11 @@ from __future__ import print_function
 
 import sys
 
-import sqlparse
-from sqlparse.compat import text_type
-from sqlparse.sql import Comparison, Identifier, Where
 from six import string_types
-from .parseutils import extract_tables, find_prev_keyword, last_word
+from .parseutils import last_word
+from .sqlcontext import (WHERE_CLAUSE, extract_tables, find_prev_keyword,
+                         first_token, identifier_parent, in_where_clause,
+                         last_token, statement_bounds, token_before_last)
 from .special.main import parse_special_command
 
 
@@ -22,70 +22,37 @@ def suggest_type(full_text, text_before_cursor):
     word_before_cursor = last_word(text_before_cursor,
                                    include='many_punctuations')
 
-    identifier = None
-
-    # here should be removed once sqlparse has been fixed
-    try:
-        # If we've partially typed a word then word_before_cursor won't be an empty
-        # string. In that case we want to remove the partially typed string before
-        # sending it to the sqlparser. Otherwise the last token will always be the
-        # partially typed string which renders the smart completion useless because
-        # it will always return the list of keywords as completion.
-        if word_before_cursor:
-            if word_before_cursor.endswith(
-                    '(') or word_before_cursor.startswith('\\'):
-                parsed = sqlparse.parse(text_before_cursor)
-            else:
-                parsed = sqlparse.parse(
-                    text_before_cursor[:-len(word_before_cursor)])
+    parent = None
 
-                # word_before_cursor may include a schema qualification, like
-                # "schema_name.partial_name" or "schema_name.", so parse it
-                # separately
-                p = sqlparse.parse(word_before_cursor)[0]
+    # If we've partially typed a word then word_before_cursor won't be an empty
+    # string. In that case we want to remove the partially typed string before
+    # looking at the text. Otherwise the last token will always be the
+    # partially typed string which renders the smart completion useless because
+    # it will always return the list of keywords as completion.
+    if word_before_cursor.endswith('(') or word_before_cursor.startswith('\\'):
+        position = len(text_before_cursor)
+    else:
+        position = len(text_before_cursor) - len(word_before_cursor)
 
-                if p.tokens and isinstance(p.tokens[0], Identifier):
-                    identifier = p.tokens[0]
-        else:
-            parsed = sqlparse.parse(text_before_cursor)
-    except (TypeError, AttributeError):
-        return [{'type': 'keyword'}]
+        # word_before_cursor may include a schema qualification, like
+        # "schema_name.partial_name" or "schema_name.", so look at it
+        # separately
+        parent = identifier_parent(word_before_cursor)
 
-    if len(parsed) > 1:
-        # Multiple statements being edited -- isolate the current one by
-        # cumulatively summing statement lengths to find the one that bounds the
-        # current position
-        current_pos = len(text_before_cursor)
-        stmt_start, stmt_end = 0, 0
-
-        for statement in parsed:
-            stmt_len = len(text_type(statement))
-            stmt_start, stmt_end = stmt_end, stmt_end + stmt_len
-
-            if stmt_end >= current_pos:
-                text_before_cursor = full_text[stmt_start:current_pos]
-                full_text = full_text[stmt_start:]
-                break
-
-    elif parsed:
-        # A single statement
-        statement = parsed[0]
-    else:
-        # The empty string
-        statement = None
+    # Multiple statements may be edited -- isolate the current one.
+    start, end = statement_bounds(full_text, position)
+    text_before_cursor = text_before_cursor[start:]
+    full_text = full_text[start:end]
 
     # Check for special commands and handle those separately
-    if statement:
-        # Be careful here because trivial whitespace is parsed as a statement,
-        # but the statement won't have a first token
-        tok1 = statement.token_first()
-        if tok1 and tok1.value == '\\':
-            return suggest_special(text_before_cursor)
+    tok1 = first_token(text_before_cursor[:position - start])
+    if tok1 and tok1.value == '\\':
+        return suggest_special(text_before_cursor)
 
-    last_token = statement and statement.token_prev(len(statement.tokens))[1] or ''
+    token = last_token(text_before_cursor[:position - start]) or ''
 
-    return suggest_based_on_last_token(last_token, text_before_cursor,
-                                       full_text, identifier)
+    return suggest_based_on_last_token(token, text_before_cursor,
+                                       full_text, parent)
 
 
 def suggest_special(text):
@@ -115,25 +82,16 @@ def suggest_special(text):
     return [{'type': 'keyword'}, {'type': 'special'}]
 
 
-def suggest_based_on_last_token(token, text_before_cursor, full_text, identifier):
+def suggest_based_on_last_token(token, text_before_cursor, full_text, parent):
     if isinstance(token, string_types):
         token_v = token.lower()
-    elif isinstance(token, Comparison):
-        # If 'token' is a Comparison type such as
-        # 'select * FROM abc a JOIN def d ON a.id = d.'. Then calling
-        # token.value on the comparison type will only return the lhs of the
-        # comparison. In this case a.id. So we need to do token.tokens to get
-        # both sides of the comparison and pick the last token out of that
-        # list.
-        token_v = token.tokens[-1].value.lower()
-    elif isinstance(token, Where):
-        # sqlparse groups all tokens from the where clause into a single token
-        # list. This means that token.value may be something like
-        # 'where foo > 5 and '. We need to look "inside" token.tokens to handle
-        # suggestions in complicated where clauses correctly
+    elif token.type == WHERE_CLAUSE:
+        # The whole where clause may be something like 'where foo > 5 and '.
+        # Look inside it to handle suggestions in complicated where clauses
+        # correctly
         prev_keyword, text_before_cursor = find_prev_keyword(text_before_cursor)
         return suggest_based_on_last_token(prev_keyword, text_before_cursor,
-                                           full_text, identifier)
+                                           full_text, parent)
     else:
         token_v = token.value.lower()
 
@@ -142,9 +100,7 @@ def suggest_based_on_last_token(token, text_before_cursor, full_text, identifier
     if not token:
         return [{'type': 'keyword'}, {'type': 'special'}]
     elif token_v.endswith('('):
-        p = sqlparse.parse(text_before_cursor)[0]
-
-        if p.tokens and isinstance(p.tokens[-1], Where):
+        if in_where_clause(text_before_cursor):
             # Four possibilities:
             #  1 - Parenthesized clause like "WHERE foo AND ("
             #        Suggest columns/functions
@@ -157,37 +113,31 @@ def suggest_based_on_last_token(token, text_before_cursor, full_text, identifier
             #        really fancy, we could suggest only array-typed columns)
 
             column_suggestions = suggest_based_on_last_token('where',
-                                                             text_before_cursor, full_text, identifier)
+                                                             text_before_cursor, full_text, parent)
 
             # Check for a subquery expression (cases 3 & 4)
-            where = p.tokens[-1]
-            idx, prev_tok = where.token_prev(len(where.tokens) - 1)
-
-            if isinstance(prev_tok, Comparison):
-                # e.g. "SELECT foo FROM bar WHERE foo = ANY("
-                prev_tok = prev_tok.tokens[-1]
-
-            prev_tok = prev_tok.value.lower()
-            if prev_tok == 'exists':
+            prev_tok = token_before_last(text_before_cursor)
+            if prev_tok and prev_tok.value.lower() == 'exists':
                 return [{'type': 'keyword'}]
             else:
                 return column_suggestions
 
         # Get the token before the parens
-        idx, prev_tok = p.token_prev(len(p.tokens) - 1)
+        prev_tok = token_before_last(text_before_cursor)
+        first = first_token(text_before_cursor)
         if prev_tok and prev_tok.value and prev_tok.value.lower() == 'using':
             # tbl1 INNER JOIN tbl2 USING (col1, col2)
             tables = extract_tables(full_text)
 
             # suggest columns that are present in more than one table
             return [{'type': 'column', 'tables': tables, 'drop_unique': True}]
-        elif p.token_first().value.lower() == 'select':
+        elif first.value.lower() == 'select':
             # If the lparen is preceeded by a space chances are we're about to
             # do a sub-select.
             if last_word(text_before_cursor,
                          'all_punctuations').startswith('('):
                 return [{'type': 'keyword'}]
-        elif p.token_first().value.lower() == 'show':
+        elif first.value.lower() == 'show':
             return [{'type': 'show'}]
 
         # We're probably in a function argument list
@@ -197,11 +147,10 @@ def suggest_based_on_last_token(token, text_before_cursor, full_text, identifier
     elif token_v == 'as':
         # Don't suggest anything for an alias
         return []
-    elif token_v in ('show'):
+    elif token_v == 'show':
         return [{'type': 'show'}]
     elif token_v in ('to',):
-        p = sqlparse.parse(text_before_cursor)[0]
-        if p.token_first().value.lower() == 'change':
+        if first_token(text_before_cursor).value.lower() == 'change':
             return [{'type': 'change'}]
         else:
             return [{'type': 'user'}]
@@ -209,7 +158,7 @@ def suggest_based_on_last_token(token, text_before_cursor, full_text, identifier
         return [{'type': 'user'}]
     elif token_v in ('select', 'where', 'having'):
         # Check for a table alias or schema qualification
-        parent = (identifier and identifier.get_parent_name()) or []
+        parent = parent or []
 
         if parent:
             tables = extract_tables(full_text)
@@ -225,7 +174,7 @@ def suggest_based_on_last_token(token, text_before_cursor, full_text, identifier
     elif (token_v.endswith('join') and token.is_keyword) or (token_v in
                                                              ('copy', 'from', 'update', 'into', 'describe', 'truncate',
                                                               'desc', 'explain')):
-        schema = (identifier and identifier.get_parent_name()) or []
+        schema = parent or []
 
         # Suggest tables from either the currently-selected schema or the
         # public schema if no schema has been specified
@@ -243,14 +192,14 @@ def suggest_based_on_last_token(token, text_before_cursor, full_text, identifier
     elif token_v in ('table', 'view', 'function'):
         # E.g. 'DROP FUNCTION <funcname>', 'ALTER TABLE <tablname>'
         rel_type = token_v
-        schema = (identifier and identifier.get_parent_name()) or []
+        schema = parent or []
         if schema:
             return [{'type': rel_type, 'schema': schema}]
         else:
             return [{'type': 'schema'}, {'type': rel_type, 'schema': []}]
     elif token_v == 'on':
         tables = extract_tables(full_text)  # [(schema, table, alias), ...]
-        parent = (identifier and identifier.get_parent_name()) or []
+        parent = parent or []
         if parent:
             # "ON parent.<suggestion>"
             # parent can be either a schema name or table alias
@@ -282,7 +231,7 @@ def suggest_based_on_last_token(token, text_before_cursor, full_text, identifier
         prev_keyword, text_before_cursor = find_prev_keyword(text_before_cursor)
         if prev_keyword:
             return suggest_based_on_last_token(
-                prev_keyword, text_before_cursor, full_text, identifier)
+                prev_keyword, text_before_cursor, full_text, parent)
         else:
             return []
     else:
@@ -0,0 +1,125 @@
+"""Work out which completions the DDL statements of a query change.
+
+A completion refresh after DDL then only fetches the objects a statement
+created or altered, and removes those it dropped, instead of fetching all the
+metadata again.
+"""
+from __future__ import unicode_literals
+
+import re
+from collections import namedtuple
+
+import sqlparse
+from sqlparse.tokens import Comment
+
+NAME = r'(?:"[^"]+"|[\w$#]+)'
+
+# The DDL of an object: the verb, the kind of object and its name.
+DDL_REGEX = re.compile(
+    r'^\s*(?P<verb>create(?:\s+or\s+replace)?|alter|drop)\s+'
+    r'(?:(?:unique|bitmap|global|temporary|public|private|materialized|'
+    r'editionable|noneditionable|force|noforce)\s+)*'
+    r'(?P<kind>\w+)\s+(?:body\s+)?(?:if\s+(?:not\s+)?exists\s+)?'
+    r'(?:(?P<schema>{0})\.)?(?P<name>{0})(?P<rest>.*)'.format(NAME),
+    re.IGNORECASE | re.DOTALL)
+
+RENAME_REGEX = re.compile(
+    r'^\s*rename\s+(?P<name>{0})\s+to\s+(?P<new_name>{0})'.format(NAME),
+    re.IGNORECASE)
+
+ALTER_RENAME_REGEX = re.compile(
+    r'^\s*rename\s+to\s+(?P<new_name>{0})'.format(NAME), re.IGNORECASE)
+
+# The completion metadata of each kind of object.
+METADATA_KINDS = {'table': 'tables', 'view': 'views', 'function': 'functions',
+                  'procedure': 'functions', 'synonym': 'synonyms',
+                  'package': 'packages', 'sequence': 'sequences'}
+
+# The kinds of the metadata of tables and views, which share a namespace.
+RELATION_KINDS = ('tables', 'views')
+
+# The objects that aren't completed, whose DDL changes nothing.
+IGNORED_KINDS = set(['index', 'trigger', 'type', 'role', 'directory',
+                     'context', 'profile', 'cluster', 'library', 'database',
+                     'tablespace', 'session', 'system', 'audit', 'outline',
+                     'dimension', 'operator', 'indextype', 'java'])
+
+# An object to fetch again, or to remove if *dropped*. A None *schema* is the
+# current schema.
+ObjectChange = namedtuple('ObjectChange', 'kind schema name dropped')
+
+
+def ddl_changes(sql):
+    """Return the ObjectChanges of the completions made by the statements of
+    *sql*, or None if they can't be told apart from a change of all of them.
+
+    >>> ddl_changes('create table hr.emp (id int); drop view "MyView"')
+    [ObjectChange(kind='tables', schema='HR', name='EMP', dropped=False), \
+ObjectChange(kind='views', schema=None, name='MyView', dropped=True)]
+    >>> ddl_changes('alter table emp rename to staff')
+    [ObjectChange(kind='tables', schema=None, name='EMP', dropped=True), \
+ObjectChange(kind='tables', schema=None, name='STAFF', dropped=False)]
+    >>> ddl_changes('create index emp_ix on emp (id)')
+    []
+    >>> ddl_changes('drop user scott cascade') is None
+    True
+    """
+    changes = []
+    for statement in sqlparse.split(sql):
+        statement_changes = _statement_changes(_strip_comments(statement))
+        if statement_changes is None:
+            return None
+        changes.extend(statement_changes)
+    return changes
+
+
+def _statement_changes(sql):
+    match = RENAME_REGEX.match(sql)
+    if match:
+        return [ObjectChange('tables', None, _name(match.group('name')), True),
+                ObjectChange('tables', None, _name(match.group('new_name')),
+                             False)]
+
+    match = DDL_REGEX.match(sql)
+    if not match:
+        # Not DDL: nothing changes.
+        return [] if not _is_ddl(sql) else None
+    kind = match.group('kind').lower()
+    if kind in IGNORED_KINDS:
+        return []
+    if kind not in METADATA_KINDS:
+        return None
+
+    kind = METADATA_KINDS[kind]
+    schema = match.group('schema') and _name(match.group('schema'))
+    name = _name(match.group('name'))
+    if match.group('verb').lower() == 'drop':
+        return [ObjectChange(kind, schema, name, True)]
+    rename = ALTER_RENAME_REGEX.match(match.group('rest'))
+    if rename:
+        return [ObjectChange(kind, schema, name, True),
+                ObjectChange(kind, schema, _name(rename.group('new_name')),
+                             False)]
+    return [ObjectChange(kind, schema, name, False)]
+
+
+def _is_ddl(sql):
+    words = sql.split(None, 1)
+    return bool(words) and words[0].lower() in ('create', 'alter', 'drop',
+                                                'rename')
+
+
+def _name(name):
+    """Quoted names keep their case; the others are upper case.
+
+    >>> _name('emp'), _name('"My Table"')
+    ('EMP', 'My Table')
+    """
+    if name.startswith('"'):
+        return name.strip('"')
+    return name.upper()
+
+
+def _strip_comments(sql):
+    return ''.join(token.value for token in sqlparse.parse(sql)[0].flatten()
+                   if token.ttype not in Comment) if sql.strip() else sql
@@ -0,0 +1,200 @@
+"""Fuzzy matching of completion candidates.
+
+A candidate matches if it contains the characters of the text in order. The
+matches are ranked by the length of the match, then its start position, then
+the candidate itself; this is the ranking of a search for the regex
+``t.*?e.*?x.*?t``, computed here without regexes.
+"""
+from __future__ import unicode_literals
+
+import heapq
+import re
+import sys
+from collections import OrderedDict
+from itertools import chain
+
+_NONZERO = re.compile(b'[^\x00]')
+# The positions of the bits set in each byte value.
+_BYTE_BITS = [[bit for bit in range(8) if value & (1 << bit)]
+              for value in range(256)]
+# Maps the bytes of False and True to the binary digits '0' and '1'.
+_DIGITS = bytes.maketrans(b'\x00\x01', b'01')
+
+
+def fuzzy_score(text, name):
+    """Return the (length, start) of the leftmost match of *text* in *name*,
+    or None if it doesn't match.
+
+    >>> fuzzy_score('emp', 'hr_employees')
+    (3, 3)
+    >>> fuzzy_score('ey', 'employees')
+    (6, 0)
+    >>> fuzzy_score('ye', 'key') is None
+    True
+    """
+    if not text:
+        return 0, 0
+    start = name.find(text[0])
+    if start < 0:
+        return None
+    # The leftmost occurrence of the first character gives the leftmost
+    # match, and finding each next character as early as possible gives the
+    # shortest match from there.
+    end = start
+    for char in text[1:]:
+        end = name.find(char, end + 1)
+        if end < 0:
+            return None
+    return end - start + 1, start
+
+
+def fuzzy_matches(text, entries, limit=None, candidates=None, matched=None):
+    """Return the ranked (length, start, item) matches of *text*.
+
+    :param text: lower-cased text to match.
+    :param entries: list of (lower-cased item, item) pairs.
+    :param limit: only return the best *limit* matches.
+    :param candidates: indexes in *entries* to consider, defaults to all.
+    :param matched: list to append the indexes of all the matches to.
+    """
+    if candidates is None:
+        candidates = range(len(entries))
+    matches = []
+    append = matches.append
+    for i in candidates:
+        lower, item = entries[i]
+        score = fuzzy_score(text, lower)
+        if score is not None:
+            append((score[0], score[1], item))
+            if matched is not None:
+                matched.append(i)
+    if limit is not None:
+        return heapq.nsmallest(limit, matches)
+    matches.sort()
+    return matches
+
+
+class CharBitsets(object):
+    """For each character, the set of keys that contain it, as a bitset.
+
+    The bitsets of the characters of a text are intersected to find the keys
+    that could match it, with the bitsets of the keys that contain each
+    character as many times as the text repeats it, so that 'zzzz' only
+    leaves the keys with four z's. The bitsets of all the characters of the
+    keys are built by build(), the others the first time they are looked up.
+
+    The keys that matched the last *max_texts* texts are remembered too: the
+    keys that match a text also match the texts it is a subsequence of, so
+    that as a text is typed, each lookup only scores the matches of the one
+    before.
+
+    >>> bitsets = CharBitsets(['emp', 'dept', 'job'])
+    >>> list(bitsets.candidates('pe'))
+    [0, 1]
+    >>> bitsets.remember('pe', [])
+    >>> list(bitsets.candidates('pet'))
+    []
+    """
+
+    # The number of candidates worth scoring without filtering them further.
+    few = 10000
+
+    def __init__(self, keys, max_texts=16):
+        self.keys = keys
+        self.max_texts = max_texts
+        self._bits = {}
+        self._built = False
+        self._matched = OrderedDict()
+
+    def bits(self, char, count=1):
+        """Return the bitset of the keys that contain *char* at least *count*
+        times."""
+        bits = self._bits.get((char, count))
+        if bits is None:
+            if count == 1:
+                if self._built:
+                    # The characters of the keys all have their bitsets.
+                    return 0
+                bits = self._flagged([char in key for key in self.keys])
+            else:
+                bits = self._bitset(self._indexes(self.bits(char)),
+                                    lambda key: key.count(char) >= count)
+            self._bits[(char, count)] = bits
+        return bits
+
+    def build(self):
+        """Build the bitsets of all the characters of the keys now, rather
+        than on the first lookups that need them."""
+        for char in set(''.join(self.keys)):
+            self.bits(char)
+        self._built = True
+
+    def remember(self, text, indexes):
+        """Remember that the keys at *indexes* are all the matches of
+        *text*."""
+        self._matched[text] = self._bitset(indexes)
+        self._matched.move_to_end(text)
+        while len(self._matched) > self.max_texts:
+            self._matched.popitem(last=False)
+
+    def matched(self, text):
+        """Return the bitset of the keys that can match *text* according to
+        the remembered texts, or None if none of them is a subsequence of
+        it."""
+        bits = None
+        for known, known_bits in list(self._matched.items()):
+            if fuzzy_score(known, text) is not None:
+                bits = known_bits if bits is None else bits & known_bits
+        return bits
+
+    def candidates(self, text):
+        """Yield the indexes of the keys that contain all the characters of
+        *text*, repeated as often, and match the texts it extends."""
+        if not text:
+            for i in range(len(self.keys)):
+                yield i
+            return
+        bits = self.matched(text)
+        if bits is None:
+            bits = -1
+        chars = sorted(set(text))
+        for char in chars:
+            bits &= self.bits(char)
+            if not bits:
+                return
+        for char in chars:
+            count = text.count(char)
+            # Scoring a few candidates is cheaper than building a bitset.
+            if count > 1 and ((char, count) in self._bits or
+                              bin(bits).count('1') > self.few):
+                bits &= self.bits(char, count)
+            if not bits:
+                return
+        for i in self._indexes(bits):
+            yield i
+
+    def nbytes(self):
+        """Estimate the memory used by the bitsets."""
+        return sum(sys.getsizeof(bits) for bits in
+                   chain(self._bits.values(), self._matched.values()))
+
+    def _bitset(self, indexes, test=None):
+        data = bytearray((len(self.keys) + 7) // 8)
+        keys = self.keys
+        for i in indexes:
+            if test is None or test(keys[i]):
+                data[i >> 3] |= 1 << (i & 7)
+        return int.from_bytes(bytes(data), 'little')
+
+    @staticmethod
+    def _flagged(flags):
+        # The flag of the first key is the last binary digit, bit 0.
+        digits = bytes(flags).translate(_DIGITS)[::-1]
+        return int(digits, 2) if digits else 0
+
+    def _indexes(self, bits):
+        data = bits.to_bytes((len(self.keys) + 7) // 8, 'little')
+        for match in _NONZERO.finditer(data):
+            offset = match.start()
+            for bit in _BYTE_BITS[data[offset]]:
+                yield (offset << 3) + bit
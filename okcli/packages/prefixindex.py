@@ -0,0 +1,160 @@
+from __future__ import unicode_literals
+
+import sys
+from bisect import bisect_left, bisect_right
+
+from .fuzzymatch import CharBitsets, fuzzy_matches
+
+
+class PrefixIndex(object):
+    """A set of completion candidates, kept sorted by their lower-cased text.
+
+    Looking up the candidates that start with a prefix is a binary search
+    instead of a scan of the whole set. The sorted entries are built on the
+    first lookup after the set changes, so adding many candidates in a row
+    sorts them once, or by build(), which also builds the character bitsets
+    of the fuzzy lookups.
+
+    >>> index = PrefixIndex(['EMPLOYEES', 'emp_history', 'DEPARTMENTS'])
+    >>> sorted(index.prefixed('emp'))
+    ['EMPLOYEES', 'emp_history']
+    >>> index.fuzzy('dpt')
+    [(6, 0, 'DEPARTMENTS')]
+    """
+
+    def __init__(self, items=()):
+        self._items = set(items)
+        self._invalidate()
+
+    def _invalidate(self):
+        self._entries = None
+        self._keys = None
+        self._sorted_items = None
+        self._bitsets = None
+        self._joined = None
+        self._offsets = None
+
+    def add(self, item):
+        if item not in self._items:
+            self._items.add(item)
+            self._invalidate()
+
+    def update(self, items):
+        size = len(self._items)
+        self._items.update(items)
+        if len(self._items) != size:
+            self._invalidate()
+
+    def discard(self, item):
+        if item in self._items:
+            self._items.discard(item)
+            self._invalidate()
+
+    def __contains__(self, item):
+        return item in self._items
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def entries(self):
+        """Return the (lower-cased item, item) pairs, sorted."""
+        if self._entries is None:
+            # Interned, the lower-cased names are shared by all the indexes.
+            self._entries = sorted((sys.intern(item.lower()), item)
+                                   for item in self._items)
+            self._keys = [key for key, _ in self._entries]
+            self._sorted_items = [item for _, item in self._entries]
+        return self._entries
+
+    def build(self):
+        """Sort the entries and build the character bitsets and the joined
+        keys of fuzzy lookups now, rather than on the first lookups after the
+        set changes."""
+        self.entries()
+        if self._bitsets is None:
+            self._bitsets = CharBitsets(self._keys)
+        self._bitsets.build()
+        self._join()
+
+    def nbytes(self):
+        """Estimate the memory used by the index, not counting its
+        items."""
+        size = sys.getsizeof(self._items)
+        if self._entries is not None:
+            size += sum(sys.getsizeof(lst) for lst in (
+                self._entries, self._keys, self._sorted_items))
+            size += sum(sys.getsizeof(entry) for entry in self._entries)
+            size += sum(sys.getsizeof(key) for key, item in self._entries
+                        if key is not item)
+        if self._joined is not None:
+            size += sys.getsizeof(self._joined) + sys.getsizeof(self._offsets)
+        if self._bitsets is not None:
+            size += self._bitsets.nbytes()
+        return size
+
+    def prefixed(self, prefix):
+        """Return the items whose lower-cased text starts with *prefix*,
+        which must be lower case."""
+        self.entries()
+        start = bisect_left(self._keys, prefix)
+        if prefix:
+            # The first key after all the keys that start with prefix.
+            end = bisect_left(self._keys, prefix[:-1] + chr(ord(prefix[-1]) + 1),
+                              start)
+        else:
+            end = len(self._keys)
+        return self._sorted_items[start:end]
+
+    def fuzzy(self, text, limit=None):
+        """Return the ranked (length, start, item) fuzzy matches of *text*,
+        which must be lower case; only the best *limit* if given."""
+        entries = self.entries()
+        if self._bitsets is None:
+            self._bitsets = CharBitsets(self._keys)
+        if limit is not None and text:
+            # Matches at the start of an item rank first, and may be enough.
+            prefixed = self.prefixed(text)
+            if len(prefixed) >= limit:
+                return [(len(text), 0, item)
+                        for item in sorted(prefixed)[:limit]]
+            # Then the matches as short as the text, which are only found in
+            # the items that contain the text; unless the matches of a text
+            # it extends leave few candidates anyway.
+            if self._bitsets.matched(text) is None:
+                shortest = [match for match in fuzzy_matches(
+                    text, entries, candidates=self.containing(text))
+                    if match[0] == len(text)]
+                if len(shortest) >= limit:
+                    return shortest[:limit]
+        matched = []
+        matches = fuzzy_matches(text, entries, limit,
+                                self._bitsets.candidates(text), matched)
+        if text:
+            self._bitsets.remember(text, matched)
+        return matches
+
+    def _join(self):
+        if self._joined is None:
+            keys = self.entries() and self._keys
+            self._joined = '\n'.join(keys)
+            self._offsets = []
+            offset = 0
+            for key in keys:
+                self._offsets.append(offset)
+                offset += len(key) + 1
+
+    def containing(self, text):
+        """Yield the indexes of the entries whose lower-cased text contains
+        *text*, which must be lower case."""
+        self._join()
+        joined, offsets = self._joined, self._offsets
+        position = joined.find(text)
+        while position >= 0:
+            i = bisect_right(offsets, position) - 1
+            yield i
+            if i + 1 >= len(offsets):
+                break
+            position = joined.find(text, offsets[i + 1])
@@ -1,3 +1,5 @@
+from .bindvariables import *
 from .dbcommands import *
 from .iocommands import *
+from .loader import *
 from .main import *
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import logging
+import re
+from collections import OrderedDict
+
+import sqlparse
+from sqlparse.tokens import Name
+
+from .main import PARSED_QUERY, special_command
+
+log = logging.getLogger(__name__)
+
+# The types a variable can be declared with, and the Python type of their
+# values.
+DECLARATION_REGEX = re.compile(
+    r'^(?P<type>number|binary_float|binary_double|n?char|n?varchar2|n?clob|'
+    r'refcursor)\s*(?:\([^)]*\))?$', re.IGNORECASE)
+NUMBER_TYPES = ('number', 'binary_float', 'binary_double')
+
+
+class BindVariables(object):
+
+    usage = '''
+Bind variables are passed to the statements that reference them
+as :name, instead of being pasted into the SQL text. The server
+can then reuse the parsed statement for every value.
+Examples:
+
+    # Set a bind variable.
+    > variable dept 20
+    > variable name 'Marketing'
+
+    # Use it.
+    > select * from departments where department_id = :dept
+
+    # PL/SQL blocks can change the value.
+    > begin :dept := :dept + 10; end;
+
+    # List all bind variables, or show one.
+    > variable
+    > variable dept
+
+    # Set a variable to NULL.
+    > variable dept NULL
+
+    # Declare a variable, NULL until a PL/SQL block sets it.
+    > variable total number
+    > variable name varchar2(30)
+'''
+
+    def __init__(self):
+        self.values = OrderedDict()
+        # The Python types of the declared variables.
+        self.types = {}
+
+    def list(self):
+        return list(self.values.items())
+
+    def get(self, name):
+        return self.values.get(name.lower())
+
+    def set(self, name, value):
+        self.values[name.lower()] = value
+
+    def declare(self, name, type_name):
+        """Declare the variable *name* of the SQL type *type_name*, NULL
+        until it is set."""
+        self.types[name.lower()] = (float if type_name.lower() in NUMBER_TYPES
+                                    else str)
+        self.set(name, None)
+
+    def parameters(self, cursor, sql):
+        """Return the bind parameters for executing *sql* on *cursor*.
+
+        Only the defined variables that *sql* references are bound. PL/SQL
+        blocks are bound with cursor variables, so that the values they
+        assign can be read back with `update`.
+        """
+        names = [name for name in bind_names(sql)
+                 if name.lower() in self.values]
+        if not names or _is_ddl(sql):
+            return {}
+
+        params = {}
+        plsql = _is_plsql(sql)
+        for name in names:
+            value = self.values[name.lower()]
+            if plsql:
+                var = cursor.var(type(value) if value is not None else
+                                 self.types.get(name.lower(), str))
+                var.setvalue(0, value)
+                value = var
+            params[name] = value
+        return params
+
+    def update(self, params):
+        """Store the values assigned to the cursor variables in *params*."""
+        for name, value in params.items():
+            if hasattr(value, 'getvalue'):
+                self.set(name, value.getvalue())
+
+
+def bind_names(sql):
+    """Return the names of the bind variables referenced in *sql*.
+
+    >>> bind_names("select * from t where a = :a and b = ':b' -- :c")
+    ['a']
+    >>> bind_names("begin :x := :X + :y; end;")
+    ['x', 'y']
+    """
+    names = []
+    seen = set()
+    for statement in sqlparse.parse(sql):
+        for token in statement.flatten():
+            if token.ttype not in Name.Placeholder:
+                continue
+            value = token.value
+            if not value.startswith(':') or value[1:].isdigit():
+                continue
+            if value[1:].lower() not in seen:
+                seen.add(value[1:].lower())
+                names.append(value[1:])
+    return names
+
+
+def _is_plsql(sql):
+    """Is *sql* an anonymous PL/SQL block?"""
+    return sql.lstrip().lower().startswith(('begin', 'declare'))
+
+
+def _is_ddl(sql):
+    """DDL statements can't have bind variables; references like :new in a
+    trigger body belong to the trigger."""
+    return sql.lstrip().lower().startswith(('create', 'alter', 'drop'))
+
+
+def parse_value(value):
+    """Convert the value typed by the user to a Python value.
+
+    >>> parse_value("'Marketing'")
+    'Marketing'
+    >>> parse_value('20')
+    20
+    >>> parse_value('2.5')
+    2.5
+    >>> parse_value('null') is None
+    True
+    """
+    value = value.strip()
+    if value.upper() == 'NULL':
+        return None
+    if len(value) > 1 and value[0] == value[-1] and value[0] in '\'"':
+        return value[1:-1]
+    for convert in (int, float):
+        try:
+            return convert(value)
+        except ValueError:
+            pass
+    return value
+
+
+@special_command('variable', 'variable [name [value | type]]',
+                 'List, show or set bind variables.',
+                 arg_type=PARSED_QUERY, case_sensitive=False, aliases=('var',))
+def set_variable(arg, **_):
+    headers = ['Name', 'Value']
+    if not arg:
+        rows = bindvariables.list()
+        if not rows:
+            return [(None, None, None,
+                     '\nNo bind variables defined.' + bindvariables.usage)]
+        return [(None, rows, headers, '')]
+
+    name, _, value = arg.partition(' ')
+    name = name.lstrip(':')
+    if not value.strip():
+        if name.lower() not in bindvariables.values:
+            return [(None, None, None, 'No bind variable: %s' % name)]
+        return [(None, [(name.lower(), bindvariables.get(name))], headers, '')]
+
+    declaration = DECLARATION_REGEX.match(value.strip())
+    if declaration:
+        if declaration.group('type').lower() == 'refcursor':
+            return [(None, None, None, 'REFCURSOR variables are not '
+                     'supported.' + bindvariables.usage)]
+        bindvariables.declare(name, declaration.group('type'))
+        return [(None, None, None, 'Variable %s declared.' % name.lower())]
+
+    bindvariables.set(name, parse_value(value))
+    return [(None, None, None, 'Variable %s set.' % name.lower())]
+
+
+bindvariables = BindVariables()
@@ -11,16 +11,35 @@ from .main import PARSED_QUERY, RAW_QUERY, special_command
 log = logging.getLogger(__name__)
 
 
-DATABASES_QUERY = '''select distinct(owner) from all_tables'''
-TABLES_QUERY = '''select distinct(table_name) from all_tab_cols where owner=upper(:1) '''
+DATABASES_QUERY = '''select owner from all_objects where object_type in ('TABLE','VIEW') group by owner'''
+TABLES_QUERY = '''select object_name from all_objects where owner=upper(:1) and object_type in ('TABLE','VIEW')'''
 VERSION_QUERY = '''select * from V$VERSION'''
 VERSION_COMMENT_QUERY = '''select * from V$VERSION'''
 USERS_QUERY = '''select username from all_users'''
 FUNCTIONS_QUERY = '''select object_name from ALL_OBJECTS where owner=:1 and object_type in ('FUNCTION','PROCEDURE')'''
-ALL_TABLE_COLUMNS_QUERY = '''select table_name, column_name from all_tab_cols where owner=:1'''
+ALL_TABLE_COLUMNS_QUERY = '''select table_name, column_name from all_tab_columns where owner=:1'''
+ALL_OWNERS_TABLES_QUERY = '''select owner, object_name from all_objects where object_type in ('TABLE','VIEW')'''
+ALL_OWNERS_COLUMNS_QUERY = '''select owner, table_name, column_name from all_tab_columns'''
+ALL_OWNERS_VIEWS_QUERY = '''select owner, view_name from all_views'''
+VIEWS_QUERY = '''select view_name from all_views where owner=:1'''
+ALL_OWNERS_FUNCTIONS_QUERY = '''select owner, object_name from all_objects where object_type in ('FUNCTION','PROCEDURE')'''
 COLUMNS_QUERY = '''select column_name, data_type, data_length, nullable from all_tab_cols where owner=:1 and table_name=:2 '''
+RELATION_COLUMNS_QUERY = '''select column_name from all_tab_columns where owner=:1 and table_name=:2'''
+TABLES_LIKE_QUERY = '''select object_name from all_objects where owner=:1 and object_type in ('TABLE','VIEW') and object_name like :2 escape '\\' and rownum <= :3'''
+SYNONYMS_QUERY = '''select synonym_name, table_owner, table_name from all_synonyms where owner=:1'''
+PACKAGE_MEMBERS_QUERY = '''select object_name, procedure_name from all_procedures where owner=:1 and object_type='PACKAGE' and procedure_name is not null order by object_name, subprogram_id'''
+PACKAGE_ARGUMENTS_QUERY = '''select package_name, object_name, overload, argument_name, in_out, data_type from all_arguments where owner=:1 and package_name is not null and data_level=0 order by package_name, object_name, overload, position'''
+SEQUENCES_QUERY = '''select sequence_name from all_sequences where sequence_owner=:1'''
+SERVER_TIME_QUERY = '''select to_char(sysdate, 'YYYY-MM-DD HH24:MI:SS') from dual'''
+OBJECT_COUNTS_QUERY = '''select owner, count(*) from all_objects where object_type in ('TABLE','VIEW','FUNCTION','PROCEDURE') group by owner'''
+CHANGED_OBJECTS_QUERY = '''select owner, object_name, object_type from all_objects where object_type in ('TABLE','VIEW','FUNCTION','PROCEDURE') and last_ddl_time >= to_date(:1, 'YYYY-MM-DD HH24:MI:SS')'''
 VIEW_SRC_QUERY = '''select text as VIEW_DEFINITION from all_views where owner=upper(:1) and view_name=:2'''
 CONNECTION_ID_QUERY = '''select sys_context('USERENV', 'SID') from dual'''
+SESSION_PARSE_STATS_QUERY = '''select sn.name, ms.value from v$mystat ms join v$statname sn on sn.statistic# = ms.statistic# where sn.name in ('execute count', 'parse count (total)', 'parse count (hard)', 'session cursor cache hits') order by sn.name'''
+EXPLAIN_PLAN_QUERY = '''explain plan set statement_id = '{statement_id}' for {sql}'''
+PLAN_ESTIMATE_QUERY = '''select cardinality, bytes from plan_table where statement_id = :1 and id = 0'''
+PLAN_SAVEPOINT_QUERY = '''savepoint okcli_estimate'''
+PLAN_ROLLBACK_QUERY = '''rollback to savepoint okcli_estimate'''
 CURRENT_SCHEMA_QUERY = '''select sys_context('USERENV', 'CURRENT_SCHEMA') from dual'''
 PRIMARY_KEY_QUERY = '''select  column_name as PRIMARY_KEY_COLUMNS from all_constraints ac inner join all_cons_columns acc on ac.table_name=acc.table_name and acc.constraint_name=ac.constraint_name where ac.table_name=:1 and ac.owner=:2 and ac.constraint_type='P' '''
 FOREIGN_KEY_QUERY = '''SELECT ACC2.COLUMN_NAME, concat(ACC.TABLE_NAME, concat('.', ACC.COLUMN_NAME )) as FOREIGN_KEY_CONSTRAINT
@@ -47,7 +66,9 @@ def _fetch_all(cursor, sql_query, params):
     Rows and headers.
     """
     log.debug(sql_query)
+    iocommands.size_cursor(cursor)
     cursor.execute(sql_query, params)
+    iocommands.size_fetch(cursor)
     rows = cursor.fetchall()
     status = ''
 
@@ -9,15 +9,26 @@ import click
 
 import sqlparse
 
+from .bindvariables import bindvariables
 from .favoritequeries import favoritequeries
 from .main import NO_QUERY, PARSED_QUERY, special_command
 from .utils import handle_cd_command
 
+_logger = logging.getLogger(__name__)
+
 TIMING_ENABLED = False
+TIMING_DETAILED = False
 use_expanded_output = False
 PAGER_ENABLED = True
 tee_file = None
-once_file = written_to_once_file = None
+once_file = once_output = written_to_once_file = None
+
+# Number of rows fetched per round trip, or 'auto' to size it from the width
+# of the rows so that each fetch uses about FETCH_MEMORY_TARGET bytes.
+ARRAYSIZE = 'auto'
+FETCH_MEMORY_TARGET = 4 * 1024 * 1024
+MIN_ARRAYSIZE = 100
+MAX_ARRAYSIZE = 10000
 
 
 def set_timing_enabled(val):
@@ -60,12 +71,19 @@ def disable_pager():
     return [(None, None, None, 'Pager disabled.')]
 
 
-@special_command('\\timing', '\\t', 'Toggle timing of commands.', arg_type=NO_QUERY, aliases=('\\t', ), case_sensitive=True)
-def toggle_timing():
-    global TIMING_ENABLED
-    TIMING_ENABLED = not TIMING_ENABLED
+@special_command('\\timing', '\\t[+]', 'Toggle timing of commands, \\t+ for a breakdown.',
+                 arg_type=PARSED_QUERY, aliases=('\\t', ), case_sensitive=True)
+def toggle_timing(verbose=False, **_):
+    global TIMING_ENABLED, TIMING_DETAILED
+    if verbose:
+        TIMING_ENABLED = TIMING_DETAILED = True
+    else:
+        TIMING_ENABLED = not TIMING_ENABLED
+        TIMING_DETAILED = False
     message = "Timing is "
     message += "on." if TIMING_ENABLED else "off."
+    if TIMING_DETAILED:
+        message = "Timing is on, with a breakdown of each statement."
     return [(None, None, None, message)]
 
 
@@ -73,6 +91,95 @@ def is_timing_enabled():
     return TIMING_ENABLED
 
 
+def set_timing_detailed(val):
+    global TIMING_DETAILED
+    TIMING_DETAILED = val
+
+
+def is_timing_detailed():
+    return TIMING_DETAILED
+
+
+def set_arraysize(val):
+    """Set the number of rows fetched per round trip.
+
+    :param val: a positive number of rows, or 'auto'.
+    :raises ValueError: if *val* is neither.
+    """
+    global ARRAYSIZE
+    if str(val).strip().lower() == 'auto':
+        ARRAYSIZE = 'auto'
+        return
+    arraysize = int(val)
+    if arraysize < 1:
+        raise ValueError('arraysize must be a positive number of rows.')
+    ARRAYSIZE = arraysize
+
+
+def get_arraysize():
+    return ARRAYSIZE
+
+
+def set_fetch_memory_target(val):
+    global FETCH_MEMORY_TARGET
+    FETCH_MEMORY_TARGET = int(val)
+
+
+@special_command('\\fetchsize', '\\fetchsize [rows|auto]',
+                 'Show or set the number of rows fetched per round trip.',
+                 arg_type=PARSED_QUERY, case_sensitive=True)
+def fetchsize(arg, **_):
+    if arg:
+        try:
+            set_arraysize(arg)
+        except ValueError:
+            return [(None, None, None,
+                     'Invalid fetch size: %s. Use a number of rows or auto.' % arg)]
+    if ARRAYSIZE == 'auto':
+        message = 'Fetch size is auto (about %d bytes per round trip).' % (
+            FETCH_MEMORY_TARGET)
+    else:
+        message = 'Fetch size is %d rows.' % ARRAYSIZE
+    return [(None, None, None, message)]
+
+
+def auto_arraysize(description, memory_target=None):
+    """Return the number of rows of the given width that fit in
+    *memory_target* bytes.
+
+    >>> auto_arraysize([('ID', None, 39, 22, 38, 0, 0)], 39000)
+    1000
+    >>> auto_arraysize([('DOC', None, 4000, 4000, 0, 0, 1)] * 10, 4000)
+    100
+    """
+    if memory_target is None:
+        memory_target = FETCH_MEMORY_TARGET
+    row_width = sum(max(d[3] or 0, d[2] or 0, 1) for d in description or ())
+    arraysize = memory_target // max(row_width, 1)
+    return max(MIN_ARRAYSIZE, min(MAX_ARRAYSIZE, arraysize))
+
+
+def size_cursor(cursor):
+    """Set the fetch array size of *cursor* before a query is executed on
+    it, unless it is sized by `size_fetch` in auto mode."""
+    if ARRAYSIZE == 'auto':
+        return
+    cursor.arraysize = ARRAYSIZE
+    if hasattr(cursor, 'prefetchrows'):
+        cursor.prefetchrows = ARRAYSIZE
+
+
+def size_fetch(cursor):
+    """In auto mode, set the fetch array size of *cursor* once its query is
+    executed, before its rows are fetched, from the width of the rows in
+    `cursor.description`."""
+    if ARRAYSIZE != 'auto' or not cursor.description:
+        return
+    arraysize = auto_arraysize(cursor.description)
+    _logger.debug('Fetch arraysize %d for the row width.', arraysize)
+    cursor.arraysize = arraysize
+
+
 def set_expanded_output(val):
     global use_expanded_output
     use_expanded_output = val
@@ -82,9 +189,6 @@ def is_expanded_output():
     return use_expanded_output
 
 
-_logger = logging.getLogger(__name__)
-
-
 def editor_command(command):
     """
     Is this an external editor command?
@@ -159,7 +263,11 @@ def execute_favorite_query(cur, arg, **_):
         for sql in sqlparse.split(query):
             sql = sql.rstrip(';')
             title = '> %s' % (sql)
-            cur.execute(sql)
+            size_cursor(cur)
+            params = bindvariables.parameters(cur, sql)
+            cur.execute(sql, params)
+            size_fetch(cur)
+            bindvariables.update(params)
             if cur.description:
                 headers = [x[0] for x in cur.description]
                 yield (title, cur, headers, None)
@@ -296,32 +404,46 @@ def write_tee(output):
                  'Append next result to an output file (overwrite using -o).',
                  aliases=('\\o', ))
 def set_once(arg, **_):
-    global once_file
+    global once_file, written_to_once_file
 
     once_file = parseargfile(arg)
+    written_to_once_file = False
 
     return [(None, None, None, "")]
 
 
 def write_once(output):
-    global once_file, written_to_once_file
-    if output and once_file:
+    """Write the line *output* to the once file, which is opened at the
+    first line of a result and closed by `close_once` at its end."""
+    global once_file, once_output, written_to_once_file
+    if not once_file:
+        return
+    if once_output is None:
+        # The next results of the statement are appended to the first one.
+        mode = 'a' if written_to_once_file else once_file['mode']
         try:
-            f = open(**once_file)
+            once_output = open(once_file['file'], mode)
         except (IOError, OSError) as e:
             once_file = None
             raise OSError("Cannot write to file '{}': {}".format(
                 e.filename, e.strerror))
+    once_output.write(output)
+    once_output.write(u"\n")
+    written_to_once_file = True
+
 
-        with f:
-            f.write(output)
-            f.write(u"\n")
-        written_to_once_file = True
+def close_once():
+    """Close the once file at the end of a result."""
+    global once_output
+    if once_output is not None:
+        once_output.close()
+        once_output = None
 
 
 def unset_once_if_written():
     """Unset the once file, if it has been written to."""
     global once_file
+    close_once()
     if written_to_once_file:
         once_file = None
 
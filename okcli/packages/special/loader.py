@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import csv
+import io
+import json
+import logging
+import os
+import re
+import shlex
+import time
+from itertools import chain, islice
+
+import click
+
+from .main import PARSED_QUERY, special_command
+
+log = logging.getLogger(__name__)
+
+# Rows sent to the database per round trip, and rows inserted between
+# commits.
+LOAD_BATCH_SIZE = 10000
+LOAD_COMMIT_INTERVAL = 100000
+
+FORMATS = ('csv', 'tsv', 'json')
+
+# The id of the transaction open in the session, or null.
+TRANSACTION_QUERY = 'select dbms_transaction.local_transaction_id from dual'
+
+LOAD_REGEX = re.compile(
+    r'^(?P<options>.*?)\s*(?P<filename>"[^"]+"|\'[^\']+\'|\S+)\s+into\s+'
+    r'(?P<table>[\w.$#"]+)\s*(?:\((?P<columns>[^)]*)\))?\s*$',
+    re.IGNORECASE | re.DOTALL)
+
+
+def set_load_options(batch_size=None, commit_interval=None):
+    """Set the default batch size and commit interval of `\\load`."""
+    global LOAD_BATCH_SIZE, LOAD_COMMIT_INTERVAL
+    if batch_size is not None:
+        LOAD_BATCH_SIZE = _positive(batch_size, 'batch size')
+    if commit_interval is not None:
+        LOAD_COMMIT_INTERVAL = _positive(commit_interval, 'commit interval')
+
+
+def _positive(value, name):
+    value = int(value)
+    if value < 1:
+        raise ValueError('The %s must be a positive number of rows.' % name)
+    return value
+
+
+def parse_load_command(arg):
+    """Parse the arguments of `\\load` into a dict.
+
+    >>> options = parse_load_command('-b 500 data.csv into hr.emp (id, name)')
+    >>> options['filename'], options['table'], options['columns']
+    ('data.csv', 'hr.emp', ['id', 'name'])
+    >>> options['batch_size'], options['format'], options['header']
+    (500, 'csv', None)
+    """
+    match = LOAD_REGEX.match(arg)
+    if not match:
+        raise ValueError('Usage: \\load [-b rows] [-c rows] [-f csv|tsv|json] '
+                         '[-h yes|no] file into table [(column, ...)]')
+
+    options = {'batch_size': LOAD_BATCH_SIZE,
+               'commit_interval': LOAD_COMMIT_INTERVAL,
+               'format': None, 'header': None}
+    flags = iter(shlex.split(match.group('options')))
+    for flag in flags:
+        value = next(flags, None)
+        if value is None:
+            raise ValueError('Missing value for option %s.' % flag)
+        if flag == '-b':
+            options['batch_size'] = _positive(value, 'batch size')
+        elif flag == '-c':
+            options['commit_interval'] = _positive(value, 'commit interval')
+        elif flag == '-f':
+            options['format'] = value.lower()
+        elif flag == '-h':
+            if value.lower() not in ('yes', 'no'):
+                raise ValueError('The header option is yes or no.')
+            options['header'] = value.lower() == 'yes'
+        else:
+            raise ValueError('Unknown option %s.' % flag)
+
+    filename = os.path.expanduser(match.group('filename').strip('\'"'))
+    options['format'] = options['format'] or _guess_format(filename)
+    if options['format'] not in FORMATS:
+        raise ValueError('Unknown format %s, use one of: %s.' % (
+            options['format'], ', '.join(FORMATS)))
+
+    columns = match.group('columns')
+    if options['header'] is False and not columns:
+        raise ValueError('Give the columns of a file without a header line.')
+    options.update(
+        filename=filename, table=match.group('table'),
+        columns=[c.strip() for c in columns.split(',')] if columns else None)
+    return options
+
+
+def _guess_format(filename):
+    extension = os.path.splitext(filename)[1].lower().lstrip('.')
+    if extension in ('jsonl', 'ndjson', 'json'):
+        return 'json'
+    if extension in ('tsv', 'tab'):
+        return 'tsv'
+    return 'csv'
+
+
+def read_rows(f, fmt, columns=None, header=None):
+    """Return the column names and an iterator over the rows of *f*.
+
+    The rows are lists of values in column order, or `Rejected` when a line
+    can't be read. Delimited files take their column names from the header
+    line unless *columns* is given; JSON lines take them from the keys of the
+    first record.
+
+    When *columns* is given, *header* says whether delimited files have a
+    header line to skip. If it is None, the first line is skipped if it
+    names the columns.
+    """
+    if fmt == 'json':
+        return _read_json(f, columns)
+
+    reader = csv.reader(f, delimiter='\t' if fmt == 'tsv' else ',')
+    first = []
+    if columns is None:
+        columns = next(reader, [])
+    elif header is not False:
+        first = [next(reader, [])]
+        if header or _is_header(first[0], columns):
+            first = []
+
+    def rows():
+        for line in chain(first, reader):
+            if not line:
+                continue
+            if len(line) != len(columns):
+                yield Rejected(line, 'Expected %d values, found %d.' % (
+                    len(columns), len(line)))
+            else:
+                yield [value if value != '' else None for value in line]
+    return columns, rows()
+
+
+def _is_header(line, columns):
+    """Does the delimited *line* name the *columns*?
+
+    >>> _is_header(['ID', ' "Name"'], ['id', 'name'])
+    True
+    >>> _is_header(['1', 'a'], ['id', 'name'])
+    False
+    """
+    return ([value.strip().strip('"').lower() for value in line] ==
+            [column.strip('"').lower() for column in columns])
+
+
+def _read_json(f, columns):
+    lines = (line for line in f if line.strip())
+    first = next(lines, None)
+    records = []
+    if first is not None:
+        records.append(first)
+        if columns is None:
+            try:
+                columns = list(json.loads(first))
+            except (ValueError, TypeError):
+                columns = []
+    columns = columns or []
+
+    def rows():
+        for line in chain(records, lines):
+            try:
+                record = json.loads(line)
+                values = [record.get(column) for column in columns]
+            except (ValueError, AttributeError) as e:
+                yield Rejected([line.rstrip('\n')], 'Invalid JSON record: %s' % e)
+                continue
+            nested = [column for column, value in zip(columns, values)
+                      if isinstance(value, (dict, list))]
+            if nested:
+                yield Rejected([line.rstrip('\n')],
+                               'Not a scalar value: %s' % ', '.join(nested))
+            else:
+                yield values
+    return columns, rows()
+
+
+class Rejected(object):
+    """A row that was not loaded, and why."""
+
+    def __init__(self, values, reason):
+        self.values = values
+        self.reason = reason
+
+
+def insert_statement(table, columns):
+    """
+    >>> insert_statement('emp', ['id', 'name'])
+    'insert into emp (id, name) values (:1, :2)'
+    """
+    return 'insert into {0} ({1}) values ({2})'.format(
+        table, ', '.join(columns),
+        ', '.join(':%d' % (i + 1) for i in range(len(columns))))
+
+
+class Loader(object):
+    """Insert rows in batches with `executemany`, committing every
+    *commit_interval* rows and writing the rejected rows to
+    *rejected_file*."""
+
+    def __init__(self, cursor, sql, batch_size, commit_interval,
+                 rejected_file, progress=None):
+        self.cursor = cursor
+        self.sql = sql
+        self.batch_size = batch_size
+        self.commit_interval = commit_interval
+        self.rejected_file = rejected_file
+        self.progress = progress
+        self.loaded = self.rejected = self.committed = 0
+        self._rejected_writer = None
+
+    def load(self, rows):
+        start = time.time()
+        uncommitted = 0
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                break
+            good = []
+            for row in batch:
+                if isinstance(row, Rejected):
+                    self.reject(row.values, row.reason)
+                else:
+                    good.append(row)
+            inserted = self.insert(good)
+            self.loaded += inserted
+            uncommitted += inserted
+            if uncommitted >= self.commit_interval:
+                self.commit()
+                uncommitted = 0
+            if self.progress:
+                self.progress(self.loaded, self.rejected, time.time() - start)
+        self.commit()
+        return time.time() - start
+
+    def insert(self, rows):
+        if not rows:
+            return 0
+        try:
+            self.cursor.executemany(self.sql, rows, batcherrors=True)
+        except TypeError as e:
+            # The values of a column don't all have the type of its value
+            # in the first row, as in JSON records: insert the rows one at a
+            # time to reject only the ones that can't be bound.
+            if len(rows) == 1:
+                self.reject(rows[0], 'Cannot bind the values: %s' % e)
+                return 0
+            return sum(self.insert([row]) for row in rows)
+        errors = self.cursor.getbatcherrors()
+        for error in errors:
+            self.reject(rows[error.offset], error.message)
+        return len(rows) - len(errors)
+
+    def commit(self):
+        self.cursor.connection.commit()
+        self.committed = self.loaded
+
+    def reject(self, values, reason):
+        self.rejected += 1
+        if self._rejected_writer is None:
+            f = io.open(self.rejected_file, 'w', encoding='utf-8', newline='')
+            self._rejected_file = f
+            self._rejected_writer = csv.writer(f)
+        self._rejected_writer.writerow(
+            ['' if v is None else v for v in values] + [reason.strip()])
+
+    def close(self):
+        if self._rejected_writer is not None:
+            self._rejected_file.close()
+
+
+def transaction_pending(cursor):
+    """Is a transaction open in the session of *cursor*?"""
+    cursor.execute(TRANSACTION_QUERY)
+    row = cursor.fetchone()
+    return bool(row and row[0])
+
+
+def _echo_progress(loaded, rejected, elapsed):
+    click.echo('\r{0} rows loaded, {1} rejected ({2:.0f} rows/s)'.format(
+        loaded, rejected, loaded / max(elapsed, 1e-6)), nl=False, err=True)
+
+
+@special_command('\\load', '\\load [-b rows] [-c rows] [-f csv|tsv|json] [-h yes|no] file into table [(column, ...)]',
+                 'Bulk load a CSV, TSV or JSON lines file into a table.',
+                 arg_type=PARSED_QUERY, case_sensitive=True)
+def load_file(cur, arg, **_):
+    try:
+        options = parse_load_command(arg)
+    except ValueError as e:
+        return [(None, None, None, str(e))]
+
+    if transaction_pending(cur):
+        return [(None, None, None,
+                 '\\load commits as it loads: commit or roll back the '
+                 'pending transaction first.')]
+
+    filename = options['filename']
+    rejected_file = filename + '.rejected'
+    try:
+        f = io.open(filename, encoding='utf-8', newline='')
+    except (IOError, OSError) as e:
+        return [(None, None, None, 'Cannot read file %s: %s' % (filename, e.strerror))]
+
+    with f:
+        columns, rows = read_rows(f, options['format'], options['columns'],
+                                  options['header'])
+        if not columns:
+            return [(None, None, None, 'No columns to load from %s.' % filename)]
+        sql = insert_statement(options['table'], columns)
+        log.debug('Loading %s with sql: %r', filename, sql)
+        loader = Loader(cur, sql, options['batch_size'],
+                        options['commit_interval'], rejected_file,
+                        progress=_echo_progress)
+        try:
+            elapsed = loader.load(rows)
+        except KeyboardInterrupt:
+            return [(None, None, None,
+                     'Load cancelled after %d rows, %d committed.' % (
+                         loader.loaded, loader.committed))]
+        finally:
+            loader.close()
+            click.echo(err=True)
+
+    status = 'Loaded %d rows into %s in %.1fs (%.0f rows/s).' % (
+        loader.loaded, options['table'], elapsed,
+        loader.loaded / max(elapsed, 1e-6))
+    if loader.rejected:
+        status += ' %d rows rejected, see %s.' % (loader.rejected, rejected_file)
+    return [(None, None, None, status)]
@@ -0,0 +1,925 @@
+# -*- coding: utf-8 -*-
+"""Work out what completion needs to know about the SQL around the cursor.
+
+sqlparse builds a tree of a statement before anything can be asked about it,
+which takes longer than a keystroke on long statements. Completion only needs
+a few facts: the statement the cursor is in, the last token before the cursor
+and whether it is in a WHERE clause, and the tables that the statement uses.
+They are found here by scanning a flat list of tokens, back from the cursor or
+forward from the start of the statement, and taking the tokens together the
+way sqlparse would group them.
+
+The tokens of the whole buffer are kept from one keystroke to the next, and
+only the text around an edit is tokenized again.
+"""
+from __future__ import unicode_literals
+
+import re
+import threading
+from bisect import bisect_left
+from collections import namedtuple
+from functools import lru_cache
+
+from sqlparse import keywords as sqlparse_keywords
+from sqlparse import tokens as ttypes
+
+# Completion analyses the text around the cursor several times per keystroke;
+# the analyses of the most recently seen texts are kept.
+PARSE_CACHE_SIZE = 256
+
+# Token types.
+KEYWORD = 'keyword'
+DML = 'dml'
+DDL = 'ddl'
+ORDER = 'order'
+CTE = 'cte'
+NAME = 'name'
+BUILTIN = 'builtin'
+PLACEHOLDER = 'placeholder'
+SYMBOL = 'symbol'
+STRING = 'string'
+NUMBER = 'number'
+PUNCTUATION = 'punctuation'
+COMPARISON = 'comparison'
+OPERATOR = 'operator'
+WILDCARD = 'wildcard'
+ASSIGNMENT = 'assignment'
+COMMENT = 'comment'
+MULTILINE_COMMENT = 'multiline comment'
+WHITESPACE = 'whitespace'
+ERROR = 'error'
+# Tokens that stand for several tokens grouped together.
+GROUP = 'group'
+WHERE_CLAUSE = 'where clause'
+IDENTIFIER = 'identifier'
+PARENTHESIS = 'parenthesis'
+
+KEYWORD_TYPES = frozenset((KEYWORD, DML, DDL, ORDER, CTE))
+# The tokens that sqlparse groups into identifiers.
+NAME_TYPES = frozenset((NAME, BUILTIN, PLACEHOLDER, SYMBOL))
+# The tokens that can be an item of a comma separated list; sqlparse only
+# takes plain keywords, not DML, DDL or ORDER ones.
+LIST_ITEM_TYPES = frozenset(
+    (KEYWORD, NAME, PLACEHOLDER, SYMBOL, STRING, NUMBER, WILDCARD))
+
+TABLE_PREFIXES = ('COPY', 'FROM', 'INTO', 'UPDATE', 'TABLE', 'JOIN')
+SUBSELECT_KEYWORDS = ('SELECT', 'INSERT', 'UPDATE', 'CREATE', 'DELETE')
+# The keywords that end a WHERE clause.
+WHERE_CLOSE = ('ORDER', 'GROUP', 'LIMIT', 'UNION', 'UNION ALL', 'EXCEPT',
+               'HAVING', 'RETURNING', 'INTO')
+LOGICAL_OPERATORS = ('AND', 'OR', 'NOT', 'BETWEEN')
+
+
+class Token(namedtuple('Token', 'type value')):
+    __slots__ = ()
+
+    @property
+    def is_keyword(self):
+        return self.type in KEYWORD_TYPES
+
+    @property
+    def normalized(self):
+        return self.value.upper() if self.type in KEYWORD_TYPES else self.value
+
+
+def _keyword_types():
+    types = {ttypes.Keyword.DML: DML, ttypes.Keyword.DDL: DDL,
+             ttypes.Keyword.Order: ORDER, ttypes.Keyword.CTE: CTE,
+             ttypes.Name.Builtin: BUILTIN}
+    words = {}
+    # sqlparse looks words up in the last of these tables first.
+    for table in (sqlparse_keywords.KEYWORDS,
+                  sqlparse_keywords.KEYWORDS_PLPGSQL,
+                  sqlparse_keywords.KEYWORDS_ORACLE,
+                  sqlparse_keywords.KEYWORDS_COMMON):
+        for word, ttype in table.items():
+            words[word] = types.get(
+                ttype, KEYWORD if ttype in ttypes.Keyword else NAME)
+    return words
+
+
+_WORD_TYPES = _keyword_types()
+
+# The rules of the sqlparse lexer, in the same order, except that strings
+# are quoted the Oracle way: a quote is escaped by doubling it, and q'[...]'
+# strings are allowed. Words are looked up in _WORD_TYPES.
+_TOKEN_RULES = (
+    (COMMENT, r'(?:--|\# ).*?(?:\r\n|\r|\n|$)'),
+    (MULTILINE_COMMENT, r'/\*[\s\S]*?\*/'),
+    (WHITESPACE, r'\s+'),
+    (ASSIGNMENT, r':='),
+    (PUNCTUATION, r'::'),
+    (WILDCARD, r'\*'),
+    (NAME, r'`(?:``|[^`])*`|´(?:´´|[^´])*´'),
+    (PLACEHOLDER, r'\?|%(?:\(\w+\))?s|(?<!\w)[$:?]\w+'),
+    (KEYWORD, r'(?:CASE|IN|VALUES|USING)\b'),
+    (NAME, r'(?:@|\#\#|\#)[A-ZÀ-Ü]\w+|[A-ZÀ-Ü]\w*(?=\s*\.)'
+           r'|(?<=\.)[A-ZÀ-Ü]\w*|[A-ZÀ-Ü]\w*(?=\()'),
+    (NUMBER, r'-?0x[\dA-F]+|-?\d*(?:\.\d+)?E-?\d+|-?(?:\d+(?:\.\d*)|\.\d+)'
+             r'|-?\d+(?![_A-ZÀ-Ü])'),
+    (STRING, r"N?Q'(?:\[[\s\S]*?\]|\{[\s\S]*?\}|\([\s\S]*?\)|<[\s\S]*?>"
+             r"|(?P<delimiter>\S)[\s\S]*?(?P=delimiter))'|N?'(?:''|[^'])*'"),
+    (SYMBOL, r'""|".*?[^\\]"'),
+    (NAME, r'(?<![\w\])])\[[^\]]+\]'),
+    (KEYWORD, r'(?:(?:LEFT\s+|RIGHT\s+|FULL\s+)?(?:INNER\s+|OUTER\s+|STRAIGHT\s+)?'
+              r'|(?:CROSS\s+|NATURAL\s+)?)?JOIN\b|END(?:\s+IF|\s+LOOP|\s+WHILE)?\b'
+              r'|NOT\s+NULL\b|UNION\s+ALL\b'),
+    (DDL, r'CREATE(?:\s+OR\s+REPLACE)?\b'),
+    (BUILTIN, r'DOUBLE\s+PRECISION\b'),
+    (None, r'[0-9_A-ZÀ-Ü][_$#\w]*'),
+    (PUNCTUATION, r'[;:()\[\],.]'),
+    (COMPARISON, r'[<>=~!]+'),
+    (OPERATOR, r'[+/@#%^&|`?^-]+'),
+    (ERROR, r'[\s\S]'),
+)
+
+_TOKEN_REGEX = re.compile(
+    '|'.join('(?P<t%d>%s)' % (i, rule) for i, (_, rule) in enumerate(_TOKEN_RULES)),
+    re.IGNORECASE | re.UNICODE)
+_RULE_TYPES = dict(('t%d' % i, type) for i, (type, _) in enumerate(_TOKEN_RULES))
+
+
+def _token(match):
+    value = match.group()
+    type = _RULE_TYPES[match.lastgroup]
+    if type is None:
+        type = _WORD_TYPES.get(value.upper(), NAME)
+    return Token(type, value)
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def tokenize(text):
+    """Return the tokens of *text*, as a tuple.
+
+    >>> [token.type for token in tokenize("select e.* from hr.emp e")][:6]
+    ['dml', 'whitespace', 'name', 'punctuation', 'wildcard', 'whitespace']
+    >>> tokenize("q'[it's]' left outer join")[::2]
+    (Token(type='string', value="q'[it's]'"), Token(type='keyword', value='left outer join'))
+    """
+    return tuple(_token(match) for match in _TOKEN_REGEX.finditer(text))
+
+
+def _opens_text(tokens, i):
+    """Could the token at i be tokenized differently if text was added
+    anywhere after it? That is the case for the start of a quoted string,
+    name or comment that isn't closed."""
+    token = tokens[i]
+    if token.type == ERROR or token.value == '[' or (
+            token.type == OPERATOR and '`' in token.value):
+        return True
+    if i + 1 < len(tokens):
+        following = tokens[i + 1].value
+        if token.type == OPERATOR and token.value.endswith('/'):
+            return following.startswith('*')
+        if token.type == NAME and token.value.lower() in ('q', 'nq'):
+            return following.startswith("'")
+    return False
+
+
+def _common_prefix(a, b):
+    """Return the length of the longest common prefix of *a* and *b*."""
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[low:middle] == b[low:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def _common_suffix(a, b, limit):
+    """Return the length of the longest common suffix of *a* and *b*, up to
+    *limit*."""
+    low, high = 0, limit
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[len(a) - middle:len(a) - low] == b[len(b) - middle:len(b) - low]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+class TokenBuffer(object):
+    """The tokens of a text that is edited a little at a time.
+
+    When the text changes, it is tokenized again from a few tokens before the
+    first change, until the new tokens line up with the old ones after the
+    last change.
+
+    >>> buffer = TokenBuffer()
+    >>> tokens, starts = buffer.update('select * from emp; select 1 from dual')
+    >>> tokens, starts = buffer.update('select * from employees; select 1 from dual')
+    >>> tokens[6], starts[-1]
+    (Token(type='name', value='employees'), 39)
+    """
+
+    # The rules of the lexer look at most this many tokens ahead, as in
+    # 'left outer join' or 'create or replace'.
+    LOOKBACK = 6
+
+    def __init__(self):
+        self.text = ''
+        self.tokens = []
+        self.starts = []
+        # The indexes of the tokens that _opens_text.
+        self._openers = []
+        self._lock = threading.Lock()
+
+    def update(self, text):
+        """Return the tokens of *text*, and the offsets where they start."""
+        with self._lock:
+            if text != self.text:
+                self._retokenize(text)
+            return self.tokens, self.starts
+
+    def _retokenize(self, text):
+        old, tokens, starts = self.text, self.tokens, self.starts
+        prefix = _common_prefix(old, text)
+        changed = bisect_left(starts, prefix)
+        first = max(changed - 1 - self.LOOKBACK, 0)
+        if self._openers and self._openers[0] < changed:
+            first = min(first, max(self._openers[0] - 1, 0))
+
+        suffix = _common_suffix(old, text, min(len(old), len(text)) - prefix)
+        delta = len(text) - len(old)
+        # The new tokens that start after this offset can be the same as the
+        # old ones.
+        unchanged = len(text) - suffix
+        new_tokens, new_starts = tokens[:first], starts[:first]
+        resume = len(tokens)
+        j = 0
+        for match in _TOKEN_REGEX.finditer(text, starts[first] if tokens else 0):
+            start = match.start()
+            if start > unchanged:
+                j = bisect_left(starts, start - delta, j)
+                if j < len(starts) and starts[j] == start - delta:
+                    resume = j
+                    break
+            new_tokens.append(_token(match))
+            new_starts.append(start)
+        added = len(new_tokens)
+        new_tokens.extend(tokens[resume:])
+        new_starts.extend(start + delta for start in starts[resume:])
+
+        # Whether a token opens text depends on the token after it.
+        checked = max(first - 1, 0)
+        openers = [i for i in self._openers if i < checked]
+        openers.extend(i for i in range(checked, added)
+                       if _opens_text(new_tokens, i))
+        openers.extend(i + added - resume for i in self._openers if i >= resume)
+        self.text, self.tokens, self.starts = text, new_tokens, new_starts
+        self._openers = openers
+
+
+def _next(tokens, i, end=None):
+    """Return the index of the first token from i on that isn't whitespace,
+    or None."""
+    end = len(tokens) if end is None else end
+    while i < end:
+        if tokens[i].type != WHITESPACE:
+            return i
+        i += 1
+    return None
+
+
+def _prev(tokens, i):
+    """Return the index of the last token before i that isn't whitespace, or
+    None."""
+    i -= 1
+    while i >= 0:
+        if tokens[i].type != WHITESPACE:
+            return i
+        i -= 1
+    return None
+
+
+def _closing(tokens, i, end):
+    """Return the index of the parenthesis that closes the one at i, or
+    None."""
+    depth = 0
+    for j in range(i, end):
+        value = tokens[j].value
+        if value == '(':
+            depth += 1
+        elif value == ')':
+            depth -= 1
+            if not depth:
+                return j
+    return None
+
+
+def _opening(tokens, i):
+    """Return the index of the parenthesis that the one at i closes, or
+    None."""
+    depth = 0
+    for j in range(i, -1, -1):
+        value = tokens[j].value
+        if value == ')':
+            depth += 1
+        elif value == '(':
+            depth -= 1
+            if not depth:
+                return j
+    return None
+
+
+def _is_keyword(token, *values):
+    return token.type == KEYWORD and token.value.upper() in values
+
+
+def _remove_quotes(value):
+    if value and value[0] in '"\'`' and value[0] == value[-1]:
+        return value[1:-1]
+    return value
+
+
+def _text(tokens, start, end):
+    return ''.join(token.value for token in tokens[start:end])
+
+
+def _terminator_end(tokens, i):
+    """Return the index of the first token after the semicolon at i that
+    starts the next statement: like sqlparse, the whitespace and comment on
+    the line of the semicolon go with the statement it ends."""
+    i += 1
+    while i < len(tokens) and (
+            tokens[i].type == COMMENT or (tokens[i].type == WHITESPACE and
+                                          tokens[i].value[0] not in '\r\n')):
+        i += 1
+    return i
+
+
+def _first_statement(tokens):
+    for i, token in enumerate(tokens):
+        if token.value == ';':
+            return tokens[:_terminator_end(tokens, i)]
+    return tokens
+
+
+_buffer = TokenBuffer()
+
+
+def statement_bounds(text, position):
+    """Return the offsets in *text* at which the statement that the text
+    before *position* ends in starts and ends.
+
+    Statements end at every semicolon, also in PL/SQL blocks, so that the
+    statements of a block are completed one at a time.
+
+    >>> statement_bounds('select 1; select 2 from dual; sel', 33)
+    (30, 33)
+    >>> statement_bounds('select 1; select 2 from dual; sel', 15)
+    (10, 29)
+    >>> statement_bounds("select ';' from dual", 10)
+    (0, 20)
+    """
+    tokens, starts = _buffer.update(text)
+    i = bisect_left(starts, position) - 1
+    semicolon = _semicolon_before(tokens, i)
+    start = 0
+    if semicolon is not None:
+        start = _terminator_end(tokens, semicolon)
+        if start == len(tokens) or starts[start] >= position:
+            # Still in the statement that the semicolon ends.
+            end = semicolon
+            previous = _semicolon_before(tokens, semicolon - 1)
+            start = 0 if previous is None else _terminator_end(tokens, previous)
+            return (starts[start] if start < len(tokens) else len(text),
+                    starts[end] + 1)
+    end = start
+    while end < len(tokens) and tokens[end].value != ';':
+        end += 1
+    return (starts[start] if start < len(tokens) else len(text),
+            starts[end] + 1 if end < len(tokens) else len(text))
+
+
+def _semicolon_before(tokens, i):
+    """Return the index of the last semicolon at or before i, or None."""
+    while i >= 0:
+        if tokens[i].value == ';':
+            return i
+        i -= 1
+    return None
+
+
+def _name_chain(tokens, i, end, functions=True):
+    """Parse the dotted name that starts at i, like 'hr.emp', 'hr.' or 'e.*'.
+
+    Return the index of its last token and its tokens, with the function
+    calls in it as IDENTIFIER tokens; and whether it is just a function call,
+    and if so whether there is whitespace before its parenthesis.
+    """
+    parts = []
+    j = i
+    while True:
+        token = tokens[j]
+        last = j
+        if functions and token.type in (NAME, BUILTIN, PLACEHOLDER):
+            n = _next(tokens, j + 1, end)
+            close = (_closing(tokens, n, end)
+                     if n is not None and tokens[n].value == '(' else None)
+            if close is not None:
+                parts.append(Token(IDENTIFIER, _remove_quotes(token.value)))
+                last = close
+                if j == i:
+                    return last, parts, (n > j + 1,)
+            else:
+                parts.append(token)
+        else:
+            parts.append(token)
+        n = _next(tokens, last + 1, end)
+        if n is None or tokens[n].value != '.':
+            return last, parts, None
+        parts.extend(tokens[last + 1:n + 1])
+        j = _next(tokens, n + 1, end)
+        if j is None or tokens[j].type not in (NAME_TYPES | {WILDCARD}):
+            return n, parts, None
+        parts.extend(tokens[n + 1:j])
+
+
+def _first_name(parts, reverse=False, keywords=False):
+    types = (NAME, WILDCARD, SYMBOL, KEYWORD) if keywords else (
+        NAME, WILDCARD, SYMBOL)
+    for part in reversed(parts) if reverse else parts:
+        if part.type in types:
+            return _remove_quotes(part.value)
+        if part.type == IDENTIFIER:
+            return part.value
+    return None
+
+
+def _identifier_names(parts):
+    """Return the parent name, the real name and the alias of the identifier
+    made of *parts*, as sqlparse finds them."""
+    dot = next((i for i, part in enumerate(parts)
+                if part.type == PUNCTUATION and part.value == '.'), None)
+    parent = None
+    if dot is not None:
+        before = _prev(parts, dot)
+        if before is not None:
+            parent = _remove_quotes(parts[before].value)
+    real = _first_name(parts[dot:] if dot else parts)
+    as_ = next((i for i, part in enumerate(parts) if _is_keyword(part, 'AS')),
+               None)
+    if as_ is not None:
+        alias = _first_name(parts[as_ + 1:], keywords=True)
+    elif len(parts) > 2 and any(part.type == WHITESPACE for part in parts):
+        alias = _first_name(parts, reverse=True)
+    else:
+        alias = None
+    return parent, real, alias
+
+
+def _alias(tokens, i, end, functions):
+    """Parse the identifier at i that is an alias; return the index of its
+    last token and an IDENTIFIER token with its name, or None."""
+    if tokens[i].type not in NAME_TYPES:
+        return None
+    last, parts, function = _name_chain(tokens, i, end, functions)
+    if function:
+        return None
+    _, real, alias = _identifier_names(parts)
+    return last, Token(IDENTIFIER, alias or real)
+
+
+def _reference(tokens, i, end, functions):
+    """Parse the table reference that starts at i: a name, a function call or
+    anything with an alias.
+
+    Return the index of its last token, its tokens and, for a function call
+    without an alias, whether there is whitespace before its parenthesis; or
+    None.
+    """
+    token = tokens[i]
+    function = None
+    if token.type in NAME_TYPES:
+        last, parts, function = _name_chain(tokens, i, end, functions)
+    elif token.type == NUMBER:
+        last, parts = i, [token]
+    elif token.value == '(':
+        last = _closing(tokens, i, end)
+        if last is None:
+            return None
+        parts = [Token(PARENTHESIS, _text(tokens, i, last + 1))]
+    else:
+        return None
+
+    n = _next(tokens, last + 1, end)
+    if n is not None and tokens[n].is_keyword and tokens[n].value.upper() == 'AS':
+        m = _next(tokens, n + 1, end)
+        if m is not None and tokens[m].type not in (DML, DDL):
+            alias = _alias(tokens, m, end, functions)
+            if alias is None:
+                close = (_closing(tokens, m, end)
+                         if tokens[m].value == '(' else None)
+                alias = (m, tokens[m]) if close is None else (
+                    close, Token(PARENTHESIS, _text(tokens, m, close + 1)))
+            return alias[0], parts + list(tokens[last + 1:m]) + [alias[1]], None
+    elif n is not None:
+        alias = _alias(tokens, n, end, functions)
+        if alias is not None:
+            return alias[0], parts + list(tokens[last + 1:n]) + [alias[1]], None
+    if token.type in NAME_TYPES:
+        return last, parts, function
+    return None
+
+
+def _with_comments(tokens, last, end, parts):
+    """Add the comments after a reference to it, as sqlparse does when there
+    is more after them; return the index of its last token."""
+    i = _next(tokens, last + 1, end)
+    if i is None or tokens[i].type not in (COMMENT, MULTILINE_COMMENT):
+        return last
+    while i < end and tokens[i].type in (COMMENT, MULTILINE_COMMENT,
+                                          WHITESPACE):
+        i += 1
+    if i == end:
+        return last
+    parts.extend(tokens[last + 1:i])
+    return i - 1
+
+
+def _is_subselect(tokens, start, end):
+    i = start
+    while i < end:
+        token = tokens[i]
+        if token.value == '(':
+            close = _closing(tokens, i, end)
+            if close is not None:
+                i = close
+        elif token.type == DML and token.value.upper() in SUBSELECT_KEYWORDS:
+            return True
+        i += 1
+    return False
+
+
+def _where_end(tokens, i, end):
+    """Return the index of the keyword that ends the WHERE clause at i."""
+    i += 1
+    while i < end:
+        token = tokens[i]
+        if token.value == '(':
+            close = _closing(tokens, i, end)
+            if close is not None:
+                i = close
+        elif _is_keyword(token, *WHERE_CLOSE):
+            return i
+        i += 1
+    return end
+
+
+def _list_item(tokens, i, end, functions):
+    """Parse the item of a comma separated list at i; return the index of
+    its last token and its reference, if it is one, or None if there is no
+    item at i."""
+    if i is None:
+        return None
+    reference = _reference(tokens, i, end, functions)
+    if reference is not None:
+        reference = (_with_comments(tokens, reference[0], end, reference[1]),
+                     ) + reference[1:]
+        return reference[0], reference
+    token = tokens[i]
+    if token.type in LIST_ITEM_TYPES and not _is_keyword(token, 'WHERE'):
+        return i, None
+    return None
+
+
+def _references(tokens, i, end, functions, reference):
+    """Yield the tables of the reference at i, and of the references that
+    follow it in a comma separated list; return the index of the last token
+    of the list."""
+    items = [reference]
+    last = reference[0]
+    while True:
+        n = _next(tokens, last + 1, end)
+        if n is None or tokens[n].value != ',':
+            break
+        item = _list_item(tokens, _next(tokens, n + 1, end), end, functions)
+        if item is None:
+            break
+        last = item[0]
+        items.append(item[1])
+
+    for item in items:
+        if item is None:
+            continue
+        _, parts, function = item
+        if function is not None:
+            name = parts[0].value
+            if len(items) > 1:
+                yield None, name, name if function[0] else None
+            else:
+                yield None, name, name
+            continue
+        parent, real, alias = _identifier_names(parts)
+        if real:
+            yield parent, real, alias
+        elif len(items) == 1:
+            yield None, alias, alias
+    return last
+
+
+def _tables(tokens, start, end, stop_at_punctuation, functions,
+            where_clauses=True):
+    prefix_seen = False
+    i = start
+    while i < end:
+        token = tokens[i]
+        if token.type == WHITESPACE:
+            i += 1
+            continue
+        if where_clauses and _is_keyword(token, 'WHERE'):
+            where_end = _where_end(tokens, i, end)
+            if prefix_seen and _is_subselect(tokens, i, where_end):
+                for table in _tables(tokens, i, where_end, stop_at_punctuation,
+                                     functions, where_clauses=False):
+                    yield table
+            i = where_end
+            continue
+        if not prefix_seen:
+            if token.type in (KEYWORD, DML) and (
+                    token.value.upper() in TABLE_PREFIXES):
+                prefix_seen = True
+            elif token.value == '(':
+                i = _closing(tokens, i, end) or i
+            i += 1
+            continue
+
+        reference = _reference(tokens, i, end, functions)
+        if reference is not None:
+            reference = (_with_comments(tokens, reference[0], end,
+                                        reference[1]),) + reference[1:]
+            i = yield from _references(tokens, i, end, functions, reference)
+            i += 1
+            continue
+        if token.value == '(':
+            close = _closing(tokens, i, end)
+            if close is not None:
+                if _is_subselect(tokens, i + 1, close):
+                    for table in _tables(tokens, i + 1, close,
+                                         stop_at_punctuation, functions):
+                        yield table
+                i = close + 1
+                continue
+        if stop_at_punctuation and token.type == PUNCTUATION:
+            return
+        if token.type == KEYWORD and token.value.upper() != 'FROM' and (
+                not token.value.upper().endswith('JOIN')):
+            return
+        i += 1
+
+
+def extract_tables(sql):
+    """Extract the table names from an SQL statement.
+
+    Returns a list of (schema, table, alias) tuples
+
+    >>> extract_tables('select * from hr.emp e join dept on')
+    [('hr', 'emp', 'e'), (None, 'dept', None)]
+    """
+    return list(_extract_tables(sql))
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _extract_tables(sql):
+    tokens = _first_statement(tokenize(sql))
+    first = _next(tokens, 0)
+    if first is None:
+        return ()
+    # INSERT statements must stop looking for tables at the sign of first
+    # Punctuation. eg: INSERT INTO abc (col1, col2) VALUES (1, 2)
+    # abc is the table name, but if we don't stop at the first lparen, then
+    # we'll identify abc, col1 and col2 as table names.
+    insert_stmt = tokens[first].value.lower() == 'insert'
+    # Like sqlparse, don't take 'CREATE TABLE t (...)' for a call to t.
+    values = set(token.value for token in tokens)
+    functions = not ('CREATE' in values and 'TABLE' in values)
+    return tuple(_tables(tokens, 0, len(tokens), insert_stmt, functions))
+
+
+def _where_clause(tokens):
+    """Return the index of the WHERE keyword if *tokens* end in a WHERE
+    clause, or None."""
+    i = len(tokens) - 1
+    while i >= 0:
+        token = tokens[i]
+        if token.value == ')':
+            opening = _opening(tokens, i)
+            if opening is not None:
+                i = opening
+        elif _is_keyword(token, 'WHERE'):
+            return i
+        elif _is_keyword(token, *WHERE_CLOSE):
+            return None
+        i -= 1
+    return None
+
+
+def _item_start(tokens, i):
+    """Return the index of the first token of the group that ends with the
+    token at i: a parenthesis with the function name before it, or a dotted
+    name."""
+    token = tokens[i]
+    if token.value == ')':
+        opening = _opening(tokens, i)
+        if opening is None:
+            return i
+        before = _prev(tokens, opening)
+        if before is None or tokens[before].type not in (NAME, BUILTIN,
+                                                         PLACEHOLDER):
+            return opening
+        i = before
+    elif token.type not in NAME_TYPES | {WILDCARD} and token.value != '.':
+        return i
+    # Back over a dotted name.
+    start = i
+    while True:
+        before = _prev(tokens, start)
+        if tokens[start].value == '.':
+            if before is not None and tokens[before].type in NAME_TYPES:
+                start = before
+                continue
+            # A dot that doesn't follow a name isn't part of the name.
+            return start if start == i else _next(tokens, start + 1)
+        if before is None or tokens[before].value != '.':
+            return start
+        start = before
+
+
+def _item(tokens, i):
+    """Return the token, or the group of tokens, that ends at i."""
+    start = _item_start(tokens, i)
+    if start == i:
+        return tokens[i]
+    return Token(GROUP, _text(tokens, start, i + 1))
+
+
+def _valid_list_item(tokens, i):
+    token = tokens[i]
+    if token.value == ')':
+        start = _item_start(tokens, i)
+        return tokens[start].type in (NAME, BUILTIN, PLACEHOLDER)
+    return token.type in LIST_ITEM_TYPES or (
+        token.value == '.' and _item_start(tokens, i) != i)
+
+
+def _grouped_with_previous(tokens, i):
+    """Would sqlparse group the keyword or name that starts at i with the
+    tokens before it?"""
+    token = tokens[i]
+    before = _prev(tokens, i)
+    if before is None:
+        return False
+    previous = tokens[before]
+    if previous.type == PUNCTUATION and previous.value == ',':
+        item = _prev(tokens, before)
+        return (token.type in LIST_ITEM_TYPES and item is not None and
+                _valid_list_item(tokens, item))
+    if previous.is_keyword and previous.value.upper() == 'AS':
+        item = _prev(tokens, before)
+        return item is not None and token.type not in (DML, DDL) and (
+            not tokens[item].is_keyword or
+            tokens[item].value.upper() == 'NULL')
+    if token.type == ORDER:
+        return previous.type in NAME_TYPES | {NUMBER} or (
+            (previous.value == '.' or previous.type == WILDCARD) and
+            _item_start(tokens, before) != before)
+    if token.type in NAME_TYPES:
+        if previous.type == NUMBER or previous.type in NAME_TYPES:
+            return True
+        if previous.value == ')':
+            return _opening(tokens, before) is not None
+        if previous.type in (OPERATOR, WILDCARD):
+            operand = _prev(tokens, before)
+            return operand is not None and (
+                tokens[operand].type in (NAME_TYPES | {NUMBER, STRING}) or
+                tokens[operand].value == ')')
+    return False
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def last_token(sql):
+    """Return the last token of *sql* the way sqlparse groups it, or None.
+
+    If *sql* ends in a WHERE clause, it is a WHERE_CLAUSE token.
+
+    >>> last_token('select * from emp e where e.id = 1 and ')
+    Token(type='where clause', value='where e.id = 1 and ')
+    >>> last_token('select * from emp order by e.name desc')
+    Token(type='group', value='e.name desc')
+    """
+    tokens = _first_statement(tokenize(sql))
+    i = _prev(tokens, len(tokens))
+    if i is None:
+        return None
+    where = _where_clause(tokens)
+    if where is not None:
+        return Token(WHERE_CLAUSE, _text(tokens, where, len(tokens)))
+    start = _item_start(tokens, i)
+    if tokens[start].is_keyword or tokens[start].type in NAME_TYPES:
+        first = start
+        # A comma separated list is grouped back to its first item.
+        while _grouped_with_previous(tokens, first):
+            before = _prev(tokens, first)
+            comma = tokens[before].value == ','
+            first = _item_start(tokens, _prev(tokens, before) if comma
+                                else before)
+            if not comma:
+                break
+        if first != start:
+            return Token(GROUP, _text(tokens, first, i + 1))
+    return _item(tokens, i)
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def first_token(sql):
+    """Return the first token of *sql* that isn't whitespace, or None.
+
+    >>> first_token('  select 1 from dual')
+    Token(type='dml', value='select')
+    """
+    tokens = tokenize(sql)
+    i = _next(tokens, 0)
+    return None if i is None else tokens[i]
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def token_before_last(sql):
+    """Return the token, or group of tokens, before the last one of *sql*.
+
+    If *sql* ends in whitespace, that is the last token that isn't.
+
+    >>> token_before_last('select * from a join b using (')
+    Token(type='keyword', value='using')
+    """
+    tokens = _first_statement(tokenize(sql))
+    if not tokens:
+        return None
+    i = len(tokens) - 1
+    if tokens[i].type == WHITESPACE:
+        i = _prev(tokens, i)
+    else:
+        i = _prev(tokens, _item_start(tokens, i))
+    return None if i is None else _item(tokens, i)
+
+
+def in_where_clause(sql):
+    """Does *sql* end in a WHERE clause?"""
+    return _where_clause(_first_statement(tokenize(sql))) is not None
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def find_prev_keyword(sql):
+    """ Find the last sql keyword in an SQL statement
+
+    Returns the value of the last keyword, and the text of the query with
+    everything after the last keyword stripped
+
+    >>> find_prev_keyword('select a, b from emp where a = 1 and b')
+    (Token(type='keyword', value='where'), 'select a, b from emp where')
+    """
+    if not sql.strip():
+        return None, ''
+    tokens = _first_statement(tokenize(sql))
+    for i in range(len(tokens) - 1, -1, -1):
+        token = tokens[i]
+        if token.value == '(' or (token.is_keyword and (
+                token.value.upper() not in LOGICAL_OPERATORS)):
+            return token, _text(tokens, 0, i + 1)
+    return None, ''
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def identifier_parent(word):
+    """Return the schema or table that *word* is qualified with, or None.
+
+    >>> identifier_parent('hr.emp')
+    'hr'
+    >>> identifier_parent('"Sales".')
+    'Sales'
+    >>> identifier_parent('a.id=d.') is None
+    True
+    """
+    tokens = tokenize(word)
+    if not tokens or tokens[0].type not in NAME_TYPES:
+        return None
+    last, parts, function = _name_chain(tokens, 0, len(tokens))
+    n = last + 1
+    if n + 1 < len(tokens) and tokens[n].type in (COMPARISON, OPERATOR,
+                                                    WILDCARD):
+        following = tokens[n + 1]
+        if following.type in NAME_TYPES | {NUMBER, STRING} or (
+                following.value == '(' or (
+                    tokens[n].type == COMPARISON and
+                    _is_keyword(following, 'NULL'))):
+            return None
+    return _identifier_names(parts)[0]
+
+
+def clear_caches():
+    for cached in (tokenize, _extract_tables, last_token, first_token,
+                   token_before_last, find_prev_keyword, identifier_parent):
+        cached.cache_clear()
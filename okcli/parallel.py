@@ -0,0 +1,266 @@
+"""Run the statements of a script in parallel over pooled sessions.
+
+Statements run in file order unless they are independent: a statement waits
+for the earlier statements that create, alter or drop an object it uses (or
+that use an object it creates, alters or drops), and for every statement
+before a barrier line::
+
+    -- barrier
+
+Each statement runs in its own session, so each is committed when it
+succeeds. Statements that depend on a failed statement are skipped.
+"""
+from __future__ import unicode_literals
+
+import logging
+import re
+import threading
+from time import time
+
+import sqlparse
+from sqlparse.tokens import Comment, Name, String
+
+from .streaming import fetch_chunks
+
+_logger = logging.getLogger(__name__)
+
+BARRIER_REGEX = re.compile(r'^\s*--\s*barrier\s*$', re.IGNORECASE | re.MULTILINE)
+
+DEFINITION_REGEX = re.compile(
+    r'^\s*(?:create(?:\s+or\s+replace)?|alter|drop|truncate|rename)\s+'
+    r'(?:(?:unique|bitmap|global|temporary|public|materialized|editionable|'
+    r'noneditionable)\s+)*'
+    r'(?:table|view|index|sequence|synonym|procedure|function|package|type|'
+    r'trigger|user|role)\s+(?:body\s+)?(?:if\s+(?:not\s+)?exists\s+)?'
+    r'(?P<name>[\w$#."]+)', re.IGNORECASE)
+
+REPORT_HEADERS = ['#', 'Statement', 'Status', 'Time']
+
+
+class Statement(object):
+    """A statement of a script and, once it has run, its outcome."""
+
+    def __init__(self, number, sql):
+        self.number = number
+        self.sql = sql
+        self.defines = defined_names(sql)
+        self.uses = used_names(sql)
+        self.depends = set()
+        self.status = None
+        self.failed = False
+        self.elapsed = None
+
+    def conflicts(self, other):
+        """Must *other*, an earlier statement, run before this one?"""
+        return bool(self.defines & (other.uses | other.defines) or
+                    other.defines & self.uses)
+
+    def summary(self, width=60):
+        text = ' '.join(self.sql.split())
+        return text if len(text) <= width else text[:width - 3] + '...'
+
+
+def defined_names(sql):
+    """Return the names of the objects that *sql* creates, alters or drops.
+
+    >>> defined_names('create or replace view hr.v_emp as select * from emp')
+    {'V_EMP'}
+    >>> defined_names('grant select on emp to scott')
+    set()
+    """
+    match = DEFINITION_REGEX.match(_strip_comments(sql))
+    if not match:
+        return set()
+    return {_object_name(match.group('name'))}
+
+
+def used_names(sql):
+    """Return the names used in *sql*, upper cased.
+
+    >>> sorted(used_names("select name from hr.emp where x = 'dept'"))
+    ['EMP', 'HR', 'NAME', 'X']
+    """
+    names = set()
+    for token in sqlparse.parse(sql)[0].flatten() if sql.strip() else ():
+        if token.ttype in Name or (token.ttype in String.Symbol):
+            names.add(_object_name(token.value))
+    return names
+
+
+def _object_name(name):
+    return name.split('.')[-1].strip('"').upper()
+
+
+def _strip_comments(sql):
+    return ''.join(token.value for token in sqlparse.parse(sql)[0].flatten()
+                   if token.ttype not in Comment) if sql.strip() else sql
+
+
+def parse_script(text):
+    """Split *text* into statements and work out which statements must run
+    before which.
+
+    >>> statements = parse_script('create table t (a int); grant select on u '
+    ...                           'to x; insert into t values (1)')
+    >>> [sorted(s.depends) for s in statements]
+    [[], [], [1]]
+    """
+    statements = []
+    previous_segment = []
+    for segment in BARRIER_REGEX.split(text):
+        current = []
+        for sql in sqlparse.split(segment):
+            sql = sql.strip().rstrip(';').strip()
+            if not _strip_comments(sql).strip():
+                continue
+            statement = Statement(len(statements) + 1, sql)
+            statement.depends.update(s.number for s in previous_segment)
+            statement.depends.update(s.number for s in current
+                                     if statement.conflicts(s))
+            current.append(statement)
+            statements.append(statement)
+        if current:
+            previous_segment = current
+    return statements
+
+
+class ParallelRunner(object):
+    """Run statements on up to *jobs* sessions borrowed from *sqlexecute*."""
+
+    def __init__(self, sqlexecute, jobs):
+        self.sqlexecute = sqlexecute
+        self.jobs = jobs
+        self._condition = threading.Condition()
+        self._pending = []
+        self._done = set()
+        self._failed = set()
+        self._executors = []
+        self._stopped = False
+        self._error = None
+
+    def run(self, statements):
+        """Run *statements* and return them with their outcome, in order."""
+        self._pending = list(statements)
+        workers = [threading.Thread(target=self._work, name='script_job_%d' % n)
+                   for n in range(min(self.jobs, len(statements)))]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        try:
+            for worker in workers:
+                while worker.is_alive():
+                    # join with a timeout, so that SIGINT is handled promptly.
+                    worker.join(0.1)
+        except KeyboardInterrupt:
+            self.cancel()
+            raise
+        if self._error is not None:
+            # No job could borrow a session to run these.
+            for statement in self._pending:
+                statement.status = 'Error: %s' % str(self._error).strip()
+                statement.failed = True
+        return statements
+
+    def cancel(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+            executors = list(self._executors)
+        for executor in executors:
+            try:
+                executor.conn.cancel()
+            except Exception:
+                _logger.debug('Could not cancel a script job.', exc_info=True)
+
+    def _next_statement(self):
+        """Return the next statement ready to run, or None if there is none
+        yet. Must be called with the condition held."""
+        for statement in self._pending:
+            if statement.depends & self._failed:
+                self._pending.remove(statement)
+                statement.status = 'Skipped: depends on failed statement %d' % (
+                    min(statement.depends & self._failed))
+                self._finish(statement, failed=True)
+                return self._next_statement()
+            if statement.depends <= self._done:
+                self._pending.remove(statement)
+                return statement
+        return None
+
+    def _finish(self, statement, failed):
+        statement.failed = failed
+        self._done.add(statement.number)
+        if failed:
+            self._failed.add(statement.number)
+        self._condition.notify_all()
+
+    def _work(self):
+        # The session is borrowed before a statement is taken: a job that
+        # waits for a session of the pool then holds no statement that the
+        # jobs with a session could be waiting for.
+        try:
+            executor = self.sqlexecute.borrow()
+        except Exception as e:
+            _logger.debug('Could not borrow a session.', exc_info=True)
+            with self._condition:
+                self._error = e
+            return
+        try:
+            with self._condition:
+                self._executors.append(executor)
+            while True:
+                with self._condition:
+                    statement = None
+                    while statement is None:
+                        if self._stopped or not self._pending:
+                            return
+                        statement = self._next_statement()
+                        if statement is None and self._pending:
+                            self._condition.wait()
+                failed = self._execute(executor, statement)
+                with self._condition:
+                    self._finish(statement, failed)
+        finally:
+            executor.close()
+
+    def _execute(self, executor, statement):
+        start = time()
+        try:
+            statuses = []
+            for _, cur, headers, status in executor.run(statement.sql):
+                if cur is not None and headers:
+                    rows = sum(len(chunk) for chunk in fetch_chunks(cur))
+                    status = '%d row%s' % (rows, '' if rows == 1 else 's')
+                if status:
+                    statuses.append(status.strip())
+            executor.conn.commit()
+            statement.status = '; '.join(statuses) or 'OK'
+            return False
+        except Exception as e:
+            _logger.debug('Script statement %d failed.', statement.number,
+                          exc_info=True)
+            statement.status = 'Error: %s' % str(e).strip()
+            return True
+        finally:
+            statement.elapsed = time() - start
+
+
+def run_script(sqlexecute, text, jobs):
+    """Run the script *text* on *jobs* sessions, at most one less than the
+    sessions of the pool, returning the number of statements that failed or
+    were skipped, and the report as a result tuple: (title, rows, headers,
+    status)."""
+    statements = parse_script(text)
+    # The session of the prompt is one of the pool.
+    jobs = max(1, min(jobs, sqlexecute.pool_max - 1))
+    start = time()
+    ParallelRunner(sqlexecute, jobs).run(statements)
+    elapsed = time() - start
+
+    rows = [(s.number, s.summary(), s.status or 'Not run',
+             '%0.03fs' % s.elapsed if s.elapsed is not None else '')
+            for s in statements]
+    failed = sum(s.failed for s in statements)
+    status = '%d statements in %0.03fs with %d jobs, %d failed or skipped.' % (
+        len(statements), elapsed, jobs, failed)
+    return failed, (None, rows, REPORT_HEADERS, status)
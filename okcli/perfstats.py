@@ -0,0 +1,139 @@
+"""Latency of completions and completion refreshes, measured all the time.
+
+Each measured operation has a Histogram of its durations, with fixed bucket
+bounds so that recording is a bisect and a few additions. The histograms of
+the process are kept in `PERF`, shown by `\\perf` and saved as JSON by
+`\\perf dump <file>`, so that slowdowns can be found and reported with data.
+
+The names of the operations are:
+
+- ``completion``: SQLCompleter.get_completions, and
+  ``completion <type>`` for each type of suggestion it completes.
+- ``suggest_type``: the analysis of the text before the cursor.
+- ``completion abandoned``: completions given up because the text changed.
+- ``refresher <name>``: each refresher of a completion refresh, and
+  ``query <name>`` each data dictionary query, with the rows it returned.
+- ``lazy <kind>``: each fetch of objects loaded on first use.
+- ``refresh``: whole completion refreshes, and ``update``: updates after DDL.
+"""
+from __future__ import unicode_literals
+
+import json
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import time
+
+# The upper bounds of the buckets, in milliseconds.
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000,
+           float('inf'))
+
+
+class Histogram(object):
+    """The distribution of the durations of an operation, and the number of
+    rows it processed.
+
+    >>> histogram = Histogram()
+    >>> for ms in (3, 4, 4, 150):
+    ...     histogram.record(ms / 1000.0)
+    >>> histogram.count, histogram.percentile(50), histogram.percentile(95)
+    (4, 5, 200)
+    """
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+
+    def record(self, seconds, rows=0):
+        self.counts[bisect_left(BUCKETS, seconds * 1000)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.rows += rows
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, percent):
+        """Return the upper bound in milliseconds of the bucket of the
+        *percent* percentile, or the maximum for the last bucket."""
+        rank = self.count * percent / 100.0
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if count and seen >= rank:
+                return bound if bound != BUCKETS[-1] else self.max * 1000
+        return 0
+
+    def as_dict(self):
+        return {'count': self.count, 'total_s': round(self.total, 6),
+                'max_s': round(self.max, 6), 'rows': self.rows,
+                'buckets_ms': dict((str(bound), count) for bound, count
+                                   in zip(BUCKETS, self.counts) if count)}
+
+
+class PerfStats(object):
+    """The Histograms of the operations measured in the process, which any
+    thread records into."""
+
+    def __init__(self):
+        self.start = time()
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, rows=0):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.record(seconds, rows)
+
+    @contextmanager
+    def timer(self, name):
+        """Record the duration of the block as an operation *name*."""
+        start = time()
+        try:
+            yield
+        finally:
+            self.record(name, time() - start)
+
+    def get(self, name):
+        return self._histograms.get(name)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self.start = time()
+
+    def rows(self):
+        """Return (operation, count, mean ms, p50 ms, p95 ms, max ms, rows)
+        rows, sorted by operation.
+
+        >>> stats = PerfStats()
+        >>> stats.record('completion', 0.004)
+        >>> stats.rows()
+        [('completion', 1, 4.0, 5, 5, 4.0, 0)]
+        """
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+        return [(name, h.count, round(h.mean * 1000, 1), h.percentile(50),
+                 h.percentile(95), round(h.max * 1000, 1), h.rows)
+                for name, h in histograms]
+
+    def as_dict(self):
+        with self._lock:
+            return {'since': self.start, 'buckets_ms': [str(b) for b in BUCKETS],
+                    'operations': dict((name, h.as_dict()) for name, h
+                                       in self._histograms.items())}
+
+    def dump(self, path):
+        """Write the histograms to the file *path* as JSON."""
+        with open(path, 'w') as f:
+            json.dump(self.as_dict(), f, indent=2, sort_keys=True)
+
+
+PERF = PerfStats()
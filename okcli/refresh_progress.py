@@ -0,0 +1,151 @@
+"""Progress and cancellation of a completion refresh.
+
+The work of a refresh is split in small units, each data dictionary query
+and each refresher, which check for cancellation before they start. Rows are
+counted as they are streamed, checking for cancellation every `batch` rows,
+and the queries in progress are interrupted, so that a refresh that is no
+longer wanted stops at once.
+"""
+from __future__ import unicode_literals
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+_logger = logging.getLogger(__name__)
+
+
+class RefreshCancelled(Exception):
+    """The refresh was cancelled, to be started over."""
+
+
+class RefreshProgress(object):
+    """How far an attempt at a completion refresh got, updated by the
+    threads doing its work.
+
+    ``units_total`` grows as the refresh finds more work to do.
+
+    :param listener: function called with the progress when it changes, at
+                     most every `interval` seconds.
+    """
+
+    interval = 0.5
+
+    # Rows streamed between two checks for cancellation.
+    batch = 1000
+
+    def __init__(self, listener=None):
+        self.listener = listener
+        self.stage = None
+        self.units_done = 0
+        self.units_total = 0
+        self.rows = 0
+        self.start = time.time()
+        self._notified = 0
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        # The sessions running a query of the refresh.
+        self._sessions = set()
+
+    def __str__(self):
+        """
+        >>> progress = RefreshProgress()
+        >>> progress.set_stage('all schemas')
+        >>> progress.add_units(4)
+        >>> progress.unit_done()
+        >>> progress.add_rows(1500)
+        >>> str(progress)
+        'all schemas: 1/4, 1500 rows, 0s'
+        """
+        counts = '{0}/{1}, {2} rows, {3:.0f}s'.format(
+            self.units_done, self.units_total, self.rows, self.elapsed)
+        if self.stage:
+            return '{0}: {1}'.format(self.stage, counts)
+        return counts
+
+    @property
+    def elapsed(self):
+        return time.time() - self.start
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def set_stage(self, stage):
+        self.stage = stage
+        self._changed(force=True)
+
+    def add_units(self, count=1):
+        with self._lock:
+            self.units_total += count
+        self._changed()
+
+    def unit_done(self):
+        with self._lock:
+            self.units_done += 1
+        self._changed()
+
+    def add_rows(self, count):
+        with self._lock:
+            self.rows += count
+        self._changed()
+
+    def track(self, rows):
+        """Yield *rows*, counting them and stopping if the refresh is
+        cancelled."""
+        count = 0
+        for row in rows:
+            yield row
+            count += 1
+            if count == self.batch:
+                self.add_rows(count)
+                count = 0
+                self.check()
+        self.add_rows(count)
+
+    def check(self):
+        """Raise RefreshCancelled if the refresh was cancelled."""
+        if self.cancelled:
+            raise RefreshCancelled()
+
+    def cancel(self):
+        """Stop the refresh: its work raises RefreshCancelled at the next
+        check, and the queries in progress are interrupted."""
+        self._cancelled.set()
+        with self._lock:
+            sessions = list(self._sessions)
+        for session in sessions:
+            try:
+                session.conn.cancel()
+            except Exception:
+                _logger.debug('Could not interrupt a refresh query.',
+                              exc_info=True)
+
+    @contextmanager
+    def running(self, session):
+        """Interrupt the query run on *session* in the block if the refresh
+        is cancelled meanwhile."""
+        with self._lock:
+            self._sessions.add(session)
+        try:
+            self.check()
+            yield
+        except RefreshCancelled:
+            raise
+        except Exception:
+            # The error of the interrupted query.
+            if self.cancelled:
+                raise RefreshCancelled()
+            raise
+        finally:
+            with self._lock:
+                self._sessions.discard(session)
+
+    def _changed(self, force=False):
+        if self.listener is None:
+            return
+        now = time.time()
+        if force or now - self._notified >= self.interval:
+            self._notified = now
+            self.listener(self)
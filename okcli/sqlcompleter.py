@@ -1,15 +1,23 @@
 from __future__ import print_function, unicode_literals
 
+import copy
 import logging
+import sys
 from collections import Counter
-from re import compile, escape
+from re import compile
+from sys import intern
+from time import time
 
 from okcli.lexer import ORACLE_KEYWORDS
 from prompt_toolkit.completion import Completer, Completion
 
+from .packages.compactmetadata import NAMES, Relations, shared_index
 from .packages.completion_engine import suggest_type
+from .packages.fuzzymatch import fuzzy_matches
 from .packages.parseutils import last_word
+from .packages.prefixindex import PrefixIndex
 from .packages.special.favoritequeries import favoritequeries
+from .perfstats import PERF
 
 _logger = logging.getLogger(__name__)
 
@@ -72,9 +80,14 @@ class SQLCompleter(Completer):
 
     users = []
 
-    def __init__(self, smart_completion=True, supported_formats=()):
+    def __init__(self, smart_completion=True, supported_formats=(),
+                 max_completions=None, lazy_metadata=None):
         super(self.__class__, self).__init__()
         self.smart_completion = smart_completion
+        self.max_completions = max_completions
+        # The LazyMetadata of the objects loaded on first use: synonyms,
+        # packages and sequences, and in lazy mode tables and columns.
+        self.lazy_metadata = lazy_metadata
         self.reserved_words = set()
         for x in self.keywords:
             self.reserved_words.update(x.split())
@@ -86,6 +99,12 @@ class SQLCompleter(Completer):
         self.table_formats = supported_formats
         self.reset_completions()
 
+    @property
+    def lazy_tables(self):
+        """Are tables and columns fetched as they are needed rather than
+        by the refresh?"""
+        return self.lazy_metadata is not None and self.lazy_metadata.lazy_tables
+
     def escape_name(self, name):
         return name
 
@@ -107,26 +126,29 @@ class SQLCompleter(Completer):
     def extend_database_names(self, databases):
         _logger.info('extending databases'.format(databases))
         self.databases.extend(databases)
+        self._all_completions = None
 
     def extend_keywords(self, additional_keywords):
         self.keywords.extend(additional_keywords)
-        self.all_completions.update(additional_keywords)
+        # The keyword index may be shared with other completers.
+        self.keyword_index = PrefixIndex(self.keyword_index)
+        self.keyword_index.update(additional_keywords)
+        self._all_completions = None
 
     def extend_show_items(self, show_items):
         for show_item in show_items:
             self.show_items.extend(show_item)
-            self.all_completions.update(show_item)
+        self._all_completions = None
 
     def extend_change_items(self, change_items):
         for change_item in change_items:
             self.change_items.extend(change_item)
-            self.all_completions.update(change_item)
+        self._all_completions = None
 
     def extend_users(self, users):
         _logger.debug('extending users {}'.format(users))
-        for user in users:
-            self.users.extend(user)
-            self.all_completions.update(user)
+        self.users.extend(intern(user) for user in users)
+        self._all_completions = None
 
     def extend_schemata(self, schemas):
         _logger.debug('extending schema {}'.format(schemas))
@@ -137,9 +159,11 @@ class SQLCompleter(Completer):
         # dbmetadata.values() are the 'tables' and 'functions' dicts
         _logger.debug('extending schema  with {}'.format(schema))
         schema = schema.upper()
-        for metadata in self.dbmetadata.values():
-            metadata[schema] = {}
-        self.all_completions.update(schema)
+        for kind, metadata in self.dbmetadata.items():
+            metadata[schema] = {} if kind == 'functions' else Relations()
+        for indexes in self.object_indexes.values():
+            indexes[schema] = PrefixIndex()
+        self._all_completions = None
 
     def extend_relations(self, data, kind, schema):
         """Extend metadata for tables or views
@@ -161,8 +185,8 @@ class SQLCompleter(Completer):
             _logger.error('Error escaping data {}'.format(data), exc_info=True)
             data = []
 
-        # dbmetadata['tables'][$schema_name][$table_name] should be a list of
-        # column names. Default to an asterisk
+        # dbmetadata['tables'][$schema_name] are the Relations of the schema,
+        # whose columns default to an asterisk.
 
         # TODO
         # add schema to data instead of self.dbname
@@ -171,11 +195,12 @@ class SQLCompleter(Completer):
         for relname in data:
             name = relname[0]
             try:
-                metadata[schema][name] = ['*']
+                name = metadata[schema].add(name)
+                self.object_indexes[kind][schema].add(name)
             except KeyError:
                 _logger.error('%r %r listed in unrecognized schema %r',
                               kind, name, schema)
-            self.all_completions.add(name)
+        self._all_completions = None
 
     def extend_columns(self, column_data, kind, schema):
         """Extend column metadata
@@ -195,9 +220,10 @@ class SQLCompleter(Completer):
             column_data = []
         metadata = self.dbmetadata[kind]
 
+        relations = metadata[schema]
         for relname, column in column_data:
-            metadata[schema][relname].append(column)
-            self.all_completions.add(column)
+            relations.add_column(relname, column)
+        self._all_completions = None
 
     def extend_functions(self, func_data, schema):
         # 'func_data' is a generator object. It can throw an exception while
@@ -214,8 +240,49 @@ class SQLCompleter(Completer):
         metadata = self.dbmetadata['functions']
 
         for func in func_data:
-            metadata[schema][func[0]] = None
-            self.all_completions.add(func[0])
+            name = intern(func[0])
+            metadata[schema][name] = None
+            self.object_indexes['functions'][schema].add(name)
+        self._all_completions = None
+
+    def remove_object(self, kind, schema, name):
+        """Remove the table, view or function *name* of *schema*."""
+        schema = schema.upper()
+        objects = self.dbmetadata[kind].get(schema)
+        if objects is not None:
+            if kind == 'functions':
+                objects.pop(name, None)
+            else:
+                objects.remove(name)
+            self.object_indexes[kind][schema].discard(name)
+        self._all_completions = None
+
+    def copy(self, schemas=()):
+        """Return a completer with the same completions, the metadata of
+        *schemas* of which can be changed without changing this one's.
+
+        The other schemas are shared: a completer must not be changed once it
+        is in use, so the copy is how DDL updates the completions.
+        """
+        completer = copy.copy(self)
+        completer.databases = list(self.databases)
+        completer.dbmetadata = dict(
+            (kind, dict(metadata)) for kind, metadata in self.dbmetadata.items())
+        completer.object_indexes = dict(
+            (kind, dict(indexes))
+            for kind, indexes in self.object_indexes.items())
+        for schema in schemas:
+            schema = schema.upper()
+            for kind, metadata in completer.dbmetadata.items():
+                objects = metadata.get(schema)
+                if objects is None:
+                    continue
+                metadata[schema] = (dict(objects) if kind == 'functions'
+                                    else objects.copy())
+                indexes = completer.object_indexes[kind]
+                indexes[schema] = PrefixIndex(indexes[schema])
+        completer._all_completions = None
+        return completer
 
     def set_dbname(self, dbname):
         self.dbname = dbname.upper()
@@ -225,11 +292,86 @@ class SQLCompleter(Completer):
         self.users = []
         self.show_items = []
         self.dbname = ''
+        # The Relations of the tables and views of each schema, and the
+        # functions of each schema.
         self.dbmetadata = {'tables': {}, 'views': {}, 'functions': {}}
-        self.all_completions = set(self.keywords + self.functions)
+        # The names in dbmetadata, indexed for prefix lookups.
+        self.object_indexes = {'tables': {}, 'views': {}, 'functions': {}}
+        # Built once and shared by all the completers.
+        self.keyword_index = shared_index(self.keywords)
+        self.function_index = shared_index(self.functions)
+        self._all_completions = None
+
+    @property
+    def all_completions(self):
+        """The index of all the names, for completion without context. It
+        is built when first used, as smart completion doesn't need it."""
+        if self._all_completions is None:
+            names = set(self.keywords)
+            names.update(self.functions, self.show_items, self.change_items,
+                         self.users, self.databases)
+            for kind, schemas in self.dbmetadata.items():
+                names.update(schemas)
+                for objects in schemas.values():
+                    names.update(objects)
+                    if kind != 'functions':
+                        names.update(objects.column_names())
+            names.discard('*')
+            self._all_completions = PrefixIndex(names)
+        return self._all_completions
+
+    def build_indexes(self, previous=None):
+        """Sort the prefix indexes and build their character bitsets now,
+        rather than on the first completion after they change.
+
+        The schemas whose objects are the same in the *previous* completer
+        take its metadata and indexes instead, which are already sorted, and
+        the memory of this completer's copy is freed.
+        """
+        if previous is not None:
+            self._reuse(previous)
+        for schemas in self.object_indexes.values():
+            for index in schemas.values():
+                index.build()
+
+    def _reuse(self, previous):
+        for kind, schemas in self.dbmetadata.items():
+            for schema, objects in schemas.items():
+                old = previous.dbmetadata.get(kind, {}).get(schema)
+                if old is None or old is objects:
+                    continue
+                if (old == objects if kind == 'functions'
+                        else objects.same_as(old)):
+                    schemas[schema] = old
+                    self.object_indexes[kind][schema] = (
+                        previous.object_indexes[kind][schema])
+
+    def memory_info(self):
+        """Return (structure, entries, bytes) rows estimating the memory
+        used by the completion metadata."""
+        rows = []
+        for kind in ('tables', 'views'):
+            relations = list(self.dbmetadata[kind].values())
+            rows.append((kind, sum(len(r) for r in relations),
+                         sum(r.nbytes() for r in relations)))
+            rows.append((kind[:-1] + ' columns',
+                         sum(r.column_count() for r in relations), None))
+        functions = list(self.dbmetadata['functions'].values())
+        rows.append(('functions', sum(len(f) for f in functions),
+                     sum(sys.getsizeof(f) for f in functions)))
+        indexes = [index for schemas in self.object_indexes.values()
+                   for index in schemas.values()]
+        rows.append(('object indexes', sum(len(i) for i in indexes),
+                     sum(i.nbytes() for i in indexes)))
+        if self._all_completions is not None:
+            rows.append(('all completions', len(self._all_completions),
+                         self._all_completions.nbytes()))
+        rows.append(('names (shared)', len(NAMES), NAMES.nbytes()))
+        return rows
 
     @staticmethod
-    def find_matches(text, collection, start_only=False, fuzzy=True):
+    def find_matches(text, collection, start_only=False, fuzzy=True,
+                     limit=None):
         """Find completion matches for the given text.
 
         Given the user's input text and a collection of available
@@ -240,30 +382,49 @@ class SQLCompleter(Completer):
         completion only at the beginning. Otherwise, a completion is
         considered a match if the text appears anywhere within it.
 
+        If `collection` is a `PrefixIndex`, its lower-cased entries are used
+        and `start_only` matches are found with a binary search.
+
+        If `limit` is given, only the best fuzzy matches are returned.
+
         yields prompt_toolkit Completion instances for any matches found
         in the collection of available completions.
         """
         text = last_word(text, include='most_punctuations').lower()
 
-        completions = []
+        if isinstance(collection, PrefixIndex):
+            if start_only and not fuzzy:
+                return (Completion(item, -len(text))
+                        for item in sorted(collection.prefixed(text)))
+            if fuzzy:
+                return (Completion(z, -len(text))
+                        for x, y, z in collection.fuzzy(text, limit))
+            entries = collection.entries()
+        else:
+            entries = [(item.lower(), item) for item in collection]
 
         if fuzzy:
-            regex = '.*?'.join(map(escape, text))
-            pat = compile('(%s)' % regex)
-            for item in sorted(collection):
-                r = pat.search(item.lower())
-                if r:
-                    completions.append((len(r.group()), r.start(), item))
-        else:
-            match_end_limit = len(text) if start_only else None
-            for item in sorted(collection):
-                match_point = item.lower().find(text, 0, match_end_limit)
-                if match_point >= 0:
-                    completions.append((len(text), match_point, item))
+            return (Completion(z, -len(text))
+                    for x, y, z in fuzzy_matches(text, entries, limit))
+
+        completions = []
+        match_end_limit = len(text) if start_only else None
+        for lower, item in entries:
+            match_point = lower.find(text, 0, match_end_limit)
+            if match_point >= 0:
+                completions.append((len(text), match_point, item))
 
         return (Completion(z, -len(text)) for x, y, z in sorted(completions))
 
-    def get_completions(self, document, complete_event, smart_completion=None):
+    def get_completions(self, document, complete_event, smart_completion=None,
+                        cancelled=None):
+        """Return the completions at the cursor of *document*.
+
+        *cancelled* is a function that returns True once the completions are
+        no longer wanted; they are then abandoned between suggestion types,
+        and nothing is returned.
+        """
+        start = time()
         word_before_cursor = document.get_word_before_cursor(WORD=True)
         if smart_completion is None:
             smart_completion = self.smart_completion
@@ -275,11 +436,18 @@ class SQLCompleter(Completer):
                                      start_only=True, fuzzy=False)
 
         completions = []
+        suggest_start = time()
         suggestions = suggest_type(document.text, document.text_before_cursor)
+        PERF.record('suggest_type', time() - suggest_start)
 
         for suggestion in suggestions:
+            if cancelled is not None and cancelled():
+                _logger.debug('Completion cancelled.')
+                PERF.record('completion abandoned', time() - start)
+                return []
 
             _logger.debug('Suggestion type: %r', suggestion['type'])
+            suggestion_start = time()
 
             if suggestion['type'] == 'column':
                 tables = suggestion['tables']
@@ -294,14 +462,16 @@ class SQLCompleter(Completer):
                         if count > 1 and col != '*'
                     ]
 
-                cols = self.find_matches(word_before_cursor, scoped_cols)
+                cols = self.find_matches(word_before_cursor, scoped_cols,
+                                         limit=self.max_completions)
                 completions.extend(cols)
 
             elif suggestion['type'] == 'function':
                 # suggest user-defined functions using substring matching
                 funcs = self.populate_schema_objects(suggestion['schema'],
                                                      'functions')
-                user_funcs = self.find_matches(word_before_cursor, funcs)
+                user_funcs = self.find_matches(word_before_cursor, funcs,
+                                               limit=self.max_completions)
                 completions.extend(user_funcs)
 
                 # suggest hardcoded functions using startswith matching only if
@@ -310,21 +480,32 @@ class SQLCompleter(Completer):
                 # eg: SELECT * FROM users u WHERE u.
                 if not suggestion['schema']:
                     predefined_funcs = self.find_matches(word_before_cursor,
-                                                         self.functions,
+                                                         self.function_index,
                                                          start_only=True,
                                                          fuzzy=False)
                     completions.extend(predefined_funcs)
 
+                completions.extend(self.find_schema_objects(
+                    suggestion['schema'], word_before_cursor))
+
             elif suggestion['type'] == 'table':
                 tables = self.populate_schema_objects(suggestion['schema'],
                                                       'tables')
-                tables = self.find_matches(word_before_cursor, tables)
+                tables = self.find_matches(word_before_cursor, tables,
+                                           limit=self.max_completions)
                 completions.extend(tables)
+                synonyms = self.schema_objects('synonyms', suggestion['schema'])
+                completions.extend(self.find_matches(
+                    word_before_cursor, synonyms, limit=self.max_completions))
+                if self.lazy_tables:
+                    completions.extend(self.find_lazy_tables(
+                        suggestion['schema'], word_before_cursor))
 
             elif suggestion['type'] == 'view':
                 views = self.populate_schema_objects(suggestion['schema'],
                                                      'views')
-                views = self.find_matches(word_before_cursor, views)
+                views = self.find_matches(word_before_cursor, views,
+                                          limit=self.max_completions)
                 completions.extend(views)
 
             elif suggestion['type'] == 'alias':
@@ -337,7 +518,8 @@ class SQLCompleter(Completer):
                 completions.extend(dbs)
 
             elif suggestion['type'] == 'keyword':
-                keywords = self.find_matches(word_before_cursor, self.keywords,
+                keywords = self.find_matches(word_before_cursor,
+                                             self.keyword_index,
                                              start_only=True,
                                              fuzzy=False)
                 completions.extend(keywords)
@@ -378,11 +560,17 @@ class SQLCompleter(Completer):
                                             start_only=True, fuzzy=False)
                 completions.extend(formats)
 
+            PERF.record('completion ' + suggestion['type'],
+                        time() - suggestion_start)
+
+        PERF.record('completion', time() - start)
         return completions
 
-    def populate_scoped_cols(self, scoped_tbls):
+    def populate_scoped_cols(self, scoped_tbls, resolve_synonyms=True):
         """Find all columns in a set of scoped_tables
         :param scoped_tbls: list of (schema, table, alias) tuples
+        :param resolve_synonyms: look up the columns of the targets of the
+                                 synonyms among the tables
         :return: list of column names
         """
         columns = []
@@ -414,18 +602,87 @@ class SQLCompleter(Completer):
 
             try:
                 columns.extend(meta['views'][schema][relname])
+                continue
             except KeyError:
                 pass
 
+            # Unquoted names are stored in upper case.
+            if relname.islower():
+                relname = relname.upper()
+            target = (self.schema_objects('synonyms', schema).get(relname)
+                      if resolve_synonyms else None)
+            if target is not None:
+                columns.extend(self.populate_scoped_cols(
+                    [target + (None,)], resolve_synonyms=False))
+                continue
+
+            if self.lazy_tables:
+                columns.extend(self.lazy_metadata.columns(schema, relname) or
+                               [])
+
         return columns
 
+    def find_lazy_tables(self, schema, text):
+        """Return the completions of the tables of *schema* starting with the
+        last word of *text*, as far as lazy_metadata has fetched them."""
+        schema = (schema or self.dbname or '').upper()
+        word = last_word(text, include='most_punctuations')
+        if word.startswith('"'):
+            names = self.lazy_metadata.tables(schema, word[1:]) or []
+            names = ['"{0}"'.format(name) for name in names]
+        else:
+            names = self.lazy_metadata.tables(schema, word.upper()) or []
+        return [Completion(name, -len(word)) for name in sorted(names)]
+
+    def schema_objects(self, kind, schema):
+        """Return the objects of *kind* of *schema*, which lazy_metadata
+        loads on first use, or an empty mapping until it has."""
+        if self.lazy_metadata is None:
+            return {}
+        schema = (schema or self.dbname).upper()
+        if schema != self.dbname and schema not in self.databases:
+            # Not a schema, but e.g. a table alias.
+            return {}
+        return self.lazy_metadata.objects(kind, schema) or {}
+
+    def find_schema_objects(self, parent, text):
+        """Return the completions of the packages and sequences of a schema,
+        or of the members of a package, as far as they are loaded.
+
+        :param parent: the name before the dot, if any: a schema, or a
+                       package or a sequence of the current schema.
+        """
+        if not parent:
+            return self.find_matches(
+                text, list(self.schema_objects('packages', None)) +
+                list(self.schema_objects('sequences', None)),
+                limit=self.max_completions)
+        parent = parent.upper()
+        packages = self.schema_objects('packages', None)
+        if parent in packages:
+            signatures = self.schema_objects('signatures', None)
+            return [Completion(c.text, c.start_position,
+                               display_meta=signatures.get((parent, c.text)))
+                    for c in self.find_matches(text, packages[parent],
+                                               limit=self.max_completions)]
+        if parent in self.schema_objects('sequences', None):
+            return self.find_matches(text, ['CURRVAL', 'NEXTVAL'],
+                                     start_only=True, fuzzy=False)
+        if parent in self.databases:
+            # A schema.
+            return self.find_matches(
+                text, list(self.schema_objects('packages', parent)) +
+                list(self.schema_objects('sequences', parent)),
+                limit=self.max_completions)
+        return []
+
     def populate_schema_objects(self, schema, obj_type):
-        """Returns list of tables or functions for a (optional) schema"""
-        metadata = self.dbmetadata[obj_type]
+        """Returns the index of tables or functions for a (optional) schema"""
+        indexes = self.object_indexes[obj_type]
         schema = schema or self.dbname
         schema = schema.upper()
         try:
-            objects = metadata[schema].keys()
+            objects = indexes[schema]
         except KeyError:
             # schema doesn't exist
             objects = []
@@ -1,32 +1,85 @@
 import logging
+import threading
+import uuid
+from collections import OrderedDict
+from time import time
 
 import sqlparse
-from okcli.packages.special.dbcommands import (ALL_TABLE_COLUMNS_QUERY,
+from okcli.packages.special.dbcommands import (ALL_OWNERS_COLUMNS_QUERY,
+                                                ALL_OWNERS_FUNCTIONS_QUERY,
+                                                ALL_OWNERS_TABLES_QUERY,
+                                                ALL_OWNERS_VIEWS_QUERY,
+                                                ALL_TABLE_COLUMNS_QUERY,
+                                                CHANGED_OBJECTS_QUERY,
                                                 CONNECTION_ID_QUERY,
                                                 DATABASES_QUERY,
-                                                FUNCTIONS_QUERY, TABLES_QUERY,
-                                                USERS_QUERY,
+                                                EXPLAIN_PLAN_QUERY,
+                                                FUNCTIONS_QUERY,
+                                                OBJECT_COUNTS_QUERY,
+                                                PACKAGE_ARGUMENTS_QUERY,
+                                                PACKAGE_MEMBERS_QUERY,
+                                                PLAN_ESTIMATE_QUERY,
+                                                PLAN_ROLLBACK_QUERY,
+                                                PLAN_SAVEPOINT_QUERY,
+                                                RELATION_COLUMNS_QUERY,
+                                                SEQUENCES_QUERY,
+                                                SERVER_TIME_QUERY,
+                                                SESSION_PARSE_STATS_QUERY,
+                                                SYNONYMS_QUERY,
+                                                TABLES_LIKE_QUERY,
+                                                TABLES_QUERY, USERS_QUERY,
                                                 VERSION_COMMENT_QUERY,
-                                                VERSION_QUERY)
+                                                VERSION_QUERY, VIEWS_QUERY)
 
 from .packages import special
+from .timing import StatementTiming
 
 _logger = logging.getLogger(__name__)
 
 
 class SQLExecute(object):
 
-    def __init__(self, database, user, password, host):
+    # Seconds to wait for a cancelled call to return before giving up on the
+    # session.
+    cancel_timeout = 5.0
+
+    # Rows fetched per round trip by the data dictionary queries of the
+    # completion refresh, whose rows are narrow and many.
+    dictionary_arraysize = 5000
+
+    def __init__(self, database, user, password, host, pool=None,
+                 pool_min=2, pool_max=8, pool_increment=1,
+                 stmtcachesize=50):
         self.dbname = database
         self.user = user
         self.password = password
         self.host = host
+        self.pool = pool
+        self.pool_min = pool_min
+        self.pool_max = pool_max
+        self.pool_increment = pool_increment
+        self.statement_cache = StatementCacheStats(stmtcachesize)
+        self.conn = None
         self._server_type = None
+        self._connection_id = None
+        self.cancel_time = None
+        # The timing of the statement whose result was last returned by run.
+        self.timing = StatementTiming()
         self.connect()
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
     def connect(self, database=None, user=None, password=None, host=None):
         """Make a connection to a database.
 
+        The session is acquired from the session pool, which is only created
+        (logging in to the database) when there is no pool yet or the
+        credentials change.
+
         Paramters
         ---------
         database: `str` 
@@ -47,15 +100,19 @@ class SQLExecute(object):
         host: {host},
         '''.format(**locals()))
 
-        import cx_Oracle
-        conn = cx_Oracle.connect(user=user, password=password, dsn=host)
+        pool = self.pool
+        if pool is None or (user, password, host) != (self.user, self.password, self.host):
+            pool = self._create_pool(user, password, host)
+        conn = pool.acquire()
+        # Executing a cached statement reuses its cursor and skips the parse.
+        conn.stmtcachesize = self.statement_cache.size
         current_schema = db.upper() if db else ''
         if current_schema:
             _logger.info('current_schema {}'.format(current_schema))
             conn.current_schema = str(current_schema)  # type-cast required
 
-        if hasattr(self, 'conn'):
-            self.conn.close()
+        self.close()
+        self.pool = pool
         self.conn = conn
 
         # Update them after the connection is made to ensure that it was a
@@ -64,13 +121,53 @@ class SQLExecute(object):
         self.user = user
         self.password = password
         self.host = host
-        self._fetch_connection_id()
+        self._connection_id = None
+
+    def close(self):
+        """Release the session back to the session pool."""
+        if self.conn is None:
+            return
+        try:
+            self.pool.release(self.conn)
+        except Exception:
+            _logger.debug('Could not release the session.', exc_info=True)
+        self.conn = None
+
+    def borrow(self):
+        """Return a new SQLExecute on another session of the same pool.
+
+        This does not log in to the database again. The session must be
+        given back with `close`, e.g. by using the result as a context
+        manager.
+        """
+        return SQLExecute(self.dbname, self.user, self.password, self.host,
+                          pool=self.pool,
+                          stmtcachesize=self.statement_cache.size)
+
+    def _create_pool(self, user, password, host):
+        """Create a session pool, opening *pool_min* sessions in the
+        background."""
+        import cx_Oracle
+        pool = cx_Oracle.SessionPool(user=user, password=password, dsn=host,
+                                     min=1, max=self.pool_max,
+                                     increment=self.pool_increment,
+                                     threaded=True,
+                                     getmode=cx_Oracle.SPOOL_ATTRVAL_WAIT)
+        if self.pool_min > 1:
+            thread = threading.Thread(target=_prewarm_pool,
+                                      args=(pool, self.pool_min - 1),
+                                      name='session_pool_prewarm')
+            thread.setDaemon(True)
+            thread.start()
+        return pool
 
     def run(self, statement):
         """Execute the sql in the database and return the results. The results are a list of tuples. Each tuple has 4 values
         (title, rows, headers, status).
         """
 
+        self.cancel_time = None
+
         # Remove spaces and EOL
         statement = statement.strip()
         if not statement:  # Empty string
@@ -83,17 +180,120 @@ class SQLExecute(object):
             sql = sql.rstrip(';')
 
             cur = self.conn.cursor()
+            self.timing = timing = StatementTiming(sql)
 
             try:   # Special command
                 _logger.debug('Trying a dbspecial command. sql: %r', sql)
-                for result in special.execute(cur, sql):
+                results = special.execute(cur, sql)
+                timing.execute = time() - timing.start
+                for result in results:
                     yield result
             except special.CommandNotFound:  # Regular SQL
                 _logger.debug('Regular sql statement. sql: %r', sql)
-                cur.execute(sql)
+                self.call_cancellable(self._execute, cur, sql)
+                timing.execute = time() - timing.start
                 result = self.get_result(cur)
                 yield result
 
+    def _execute(self, cur, sql):
+        special.size_cursor(cur)
+        params = special.bindvariables.parameters(cur, sql)
+        self.statement_cache.record(sql)
+        cur.execute(sql, params)
+        special.size_fetch(cur)
+        special.bindvariables.update(params)
+
+    def call_cancellable(self, func, *args):
+        """Call *func* in a worker thread and return its result, cancelling
+        the call on Ctrl-C.
+
+        A blocking call into the database can't be interrupted by SIGINT, so
+        the main thread waits for the worker instead and, when interrupted,
+        calls `Connection.cancel`. The session, and any transaction in it,
+        survive the cancel. The time taken by the cancel is stored in
+        `cancel_time` and the KeyboardInterrupt is re-raised.
+        """
+        result = {}
+
+        def call():
+            try:
+                result['value'] = func(*args)
+            except Exception as e:
+                result['error'] = e
+
+        worker = threading.Thread(target=call, name='database_call')
+        worker.setDaemon(True)
+        worker.start()
+        try:
+            while worker.is_alive():
+                # join with a timeout, so that SIGINT is handled promptly.
+                worker.join(0.1)
+        except KeyboardInterrupt:
+            start = time()
+            self.conn.cancel()
+            worker.join(self.cancel_timeout)
+            self.cancel_time = time() - start
+            if worker.is_alive():
+                _logger.error('Cancelled call did not return after %ss, '
+                              'switching to a new session.', self.cancel_timeout)
+                self.conn = None
+                self.connect()
+            _logger.debug('Call cancelled in %0.03fs: %r', self.cancel_time,
+                          result.get('error'))
+            raise
+
+        if 'error' in result:
+            raise result['error']
+        return result.get('value')
+
+    def set_statement_cache_size(self, size):
+        """Resize the statement cache of the session."""
+        self.conn.stmtcachesize = size
+        self.statement_cache.resize(size)
+
+    def session_parse_stats(self):
+        """Return the parse statistics of the session from the server, or
+        None if the user can't read them."""
+        cur = self.conn.cursor()
+        try:
+            _logger.debug('Parse stats Query. sql: %r', SESSION_PARSE_STATS_QUERY)
+            return cur.execute(SESSION_PARSE_STATS_QUERY).fetchall()
+        except Exception:
+            _logger.debug('Could not get the session parse stats', exc_info=True)
+            return None
+        finally:
+            cur.close()
+
+    def estimate(self, sql):
+        """Return the optimizer's estimate of the number of rows and bytes
+        returned by the query *sql*, or None if it can't be explained."""
+        cur = self.conn.cursor()
+        try:
+            return self.call_cancellable(self._estimate, cur, sql)
+        except Exception:
+            _logger.debug('Could not explain sql: %r', sql, exc_info=True)
+            return None
+        finally:
+            cur.close()
+
+    def _estimate(self, cur, sql):
+        # The plan is written in the transaction of the user, if one is open:
+        # it has an id of its own, and is rolled back to a savepoint.
+        statement_id = 'okcli_' + uuid.uuid4().hex[:24]
+        cur.execute(PLAN_SAVEPOINT_QUERY)
+        try:
+            explain = EXPLAIN_PLAN_QUERY.format(statement_id=statement_id,
+                                                sql=sql)
+            _logger.debug('Explain Query. sql: %r', explain)
+            cur.execute(explain)
+            row = cur.execute(PLAN_ESTIMATE_QUERY,
+                              (statement_id,)).fetchone()
+        finally:
+            cur.execute(PLAN_ROLLBACK_QUERY)
+        if row is None:
+            return None
+        return tuple(value or 0 for value in row)
+
     def get_result(self, cursor):
         """Get the current result's data from the cursor."""
         title = headers = None
@@ -122,7 +322,10 @@ class SQLExecute(object):
         schema = schema if schema else self.dbname
         try:
             _logger.debug('Tables Query. sql: %r', TABLES_QUERY)
-            return [row for row in cur.execute(TABLES_QUERY, (schema,))]
+            special.size_cursor(cur)
+            cur.execute(TABLES_QUERY, (schema,))
+            special.size_fetch(cur)
+            return [row for row in cur]
 
         finally:
             cur.close()
@@ -134,15 +337,127 @@ class SQLExecute(object):
 
         try:
             _logger.debug('Columns Query. sql: %r', ALL_TABLE_COLUMNS_QUERY)
-            return [row for row in cur.execute(ALL_TABLE_COLUMNS_QUERY, (schema,))]
+            special.size_cursor(cur)
+            cur.execute(ALL_TABLE_COLUMNS_QUERY, (schema,))
+            special.size_fetch(cur)
+            return [row for row in cur]
         finally:
             cur.close()
 
-    def databases(self):
+    def relation_columns(self, schema, relation):
+        """Return the column names of a table or view."""
+        cur = self.conn.cursor()
+        try:
+            _logger.debug('Relation Columns Query. sql: %r',
+                          RELATION_COLUMNS_QUERY)
+            special.size_cursor(cur)
+            cur.execute(RELATION_COLUMNS_QUERY, (schema, relation))
+            special.size_fetch(cur)
+            return [x[0] for x in cur]
+        finally:
+            cur.close()
+
+    def tables_like(self, schema, prefix, limit):
+        """Return the names of at most *limit* tables and views of *schema*
+        that start with *prefix*."""
+        pattern = prefix
+        for char in '\\%_':
+            pattern = pattern.replace(char, '\\' + char)
+        cur = self.conn.cursor()
+        try:
+            _logger.debug('Tables Like Query. sql: %r', TABLES_LIKE_QUERY)
+            special.size_cursor(cur)
+            cur.execute(TABLES_LIKE_QUERY, (schema, pattern + '%', limit))
+            special.size_fetch(cur)
+            return [x[0] for x in cur]
+        finally:
+            cur.close()
+
+    def server_time(self):
+        """Return the current time of the database server, as the string
+        that changed_objects takes."""
+        cur = self.conn.cursor()
+        try:
+            _logger.debug('Server Time Query. sql: %r', SERVER_TIME_QUERY)
+            return cur.execute(SERVER_TIME_QUERY).fetchone()[0]
+        finally:
+            cur.close()
+
+    def object_counts(self):
+        """Return the number of tables, views, functions and procedures of
+        each owner, as a dict."""
+        return dict(self._stream('Object Counts', OBJECT_COUNTS_QUERY))
+
+    def changed_objects(self, since):
+        """Return the (owner, name, type) of the tables, views, functions
+        and procedures whose DDL changed since the server time *since*."""
+        return list(self._stream('Changed Objects', CHANGED_OBJECTS_QUERY,
+                                 (since,)))
+
+    def all_tables(self):
+        """Yield the (owner, name) of the tables and views of all owners."""
+        return self._stream('All Tables', ALL_OWNERS_TABLES_QUERY)
+
+    def all_table_columns(self):
+        """Yield the (owner, table name, column name) of the columns of all
+        owners."""
+        return self._stream('All Columns', ALL_OWNERS_COLUMNS_QUERY)
+
+    def all_views(self):
+        """Yield the (owner, name) of the views of all owners, which
+        all_tables lists too."""
+        return self._stream('All Views', ALL_OWNERS_VIEWS_QUERY)
+
+    def views(self, schema):
+        """Return the names of the views of *schema*."""
+        return [row[0] for row in self._stream('Views', VIEWS_QUERY,
+                                                (schema,))]
+
+    def all_functions(self):
+        """Yield the (owner, name) of the functions and procedures of all
+        owners."""
+        return self._stream('All Functions', ALL_OWNERS_FUNCTIONS_QUERY)
+
+    def synonyms(self, schema):
+        """Yield (synonym, target owner, target name) tuples."""
+        return self._stream('Synonyms', SYNONYMS_QUERY, (schema,))
+
+    def package_members(self, schema):
+        """Yield (package, procedure or function) tuples."""
+        return self._stream('Package Members', PACKAGE_MEMBERS_QUERY,
+                            (schema,))
+
+    def package_arguments(self, schema):
+        """Yield (package, member, overload, argument, in_out, data_type)
+        tuples, in the order of the arguments; the argument of the return
+        value of a function has no name."""
+        return self._stream('Package Arguments', PACKAGE_ARGUMENTS_QUERY,
+                            (schema,))
+
+    def sequences(self, schema):
+        return self._stream('Sequences', SEQUENCES_QUERY, (schema,))
+
+    def _stream(self, name, sql, params=()):
+        """Yield the rows of a data dictionary query as they are fetched,
+        dictionary_arraysize rows per round trip."""
         cur = self.conn.cursor()
         try:
+            _logger.debug('%s Query. sql: %r', name, sql)
+            cur.arraysize = self.dictionary_arraysize
+            if hasattr(cur, 'prefetchrows'):
+                cur.prefetchrows = self.dictionary_arraysize
+            for row in cur.execute(sql, params):
+                yield tuple(row)
+        finally:
+            cur.close()
 
-            databases = [x[0] for x in cur.execute(DATABASES_QUERY).fetchall()]
+    def databases(self):
+        cur = self.conn.cursor()
+        try:
+            special.size_cursor(cur)
+            cur.execute(DATABASES_QUERY)
+            special.size_fetch(cur)
+            databases = [x[0] for x in cur.fetchall()]
             _logger.debug('Databases Query. {} got {} '.format(DATABASES_QUERY, databases))
             return databases
         finally:
@@ -154,8 +469,10 @@ class SQLExecute(object):
         cur = self.conn.cursor()
         try:
             _logger.debug('Functions Query. sql: %r', FUNCTIONS_QUERY)
-            return [x[0] for x in
-                    cur.execute(FUNCTIONS_QUERY, (schema,)).fetchall()]
+            special.size_cursor(cur)
+            cur.execute(FUNCTIONS_QUERY, (schema,))
+            special.size_fetch(cur)
+            return [x[0] for x in cur.fetchall()]
         finally:
             cur.close()
 
@@ -163,8 +480,10 @@ class SQLExecute(object):
         cur = self.conn.cursor()
         try:
             _logger.debug('Users Query. sql: %r', USERS_QUERY)
-            return [x[0] for x in
-                    cur.execute(USERS_QUERY).fetchall()]
+            special.size_cursor(cur)
+            cur.execute(USERS_QUERY)
+            special.size_fetch(cur)
+            return [x[0] for x in cur.fetchall()]
         except Exception:
             _logger.error('Could not get user completions', exc_info=True)
         finally:
@@ -203,3 +522,56 @@ class SQLExecute(object):
             self._connection_id = cur.fetchone()[0]
         _logger.debug('Current connection id: {}'.format(self._connection_id))
 
+
+class StatementCacheStats(object):
+    """Keep track of the statements that the driver's statement cache
+    holds, to report its hit rate.
+
+    The cache is a least recently used cache of statement texts, the same
+    policy as the client statement cache of the driver.
+
+    >>> stats = StatementCacheStats(2)
+    >>> for sql in ('select 1', 'select 2', 'select 1', 'select 3', 'select 2'):
+    ...     stats.record(sql)
+    >>> stats.hits, stats.misses
+    (1, 4)
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._statements = OrderedDict()
+
+    def record(self, sql):
+        if sql in self._statements:
+            self.hits += 1
+            self._statements.pop(sql)
+        else:
+            self.misses += 1
+        if self.size > 0:
+            self._statements[sql] = None
+            if len(self._statements) > self.size:
+                self._statements.popitem(last=False)
+
+    def resize(self, size):
+        self.size = size
+        while len(self._statements) > max(size, 0):
+            self._statements.popitem(last=False)
+
+    @property
+    def hit_rate(self):
+        executions = self.hits + self.misses
+        return float(self.hits) / executions if executions else 0.0
+
+
+def _prewarm_pool(pool, count):
+    """Open *count* more sessions in *pool*, so that borrowers don't have to
+    wait for a login."""
+    try:
+        conns = [pool.acquire() for _ in range(count)]
+        for conn in conns:
+            pool.release(conn)
+        _logger.debug('Session pool pre-warmed with %d sessions.', count)
+    except Exception:
+        _logger.error('Could not pre-warm the session pool.', exc_info=True)
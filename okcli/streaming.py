@@ -0,0 +1,255 @@
+"""Incremental fetching and formatting of result sets.
+
+Rows are pulled from the cursor a chunk at a time and each chunk is formatted
+as soon as it arrives, so memory use stays flat and the first lines of a large
+result are shown without waiting for the whole result to be fetched.
+"""
+from __future__ import unicode_literals
+
+import logging
+from itertools import chain, islice
+
+from cli_helpers.tabular_output import tabulate_adapter
+from cli_helpers.tabular_output.output_formatter import MISSING_VALUE
+from six import binary_type, integer_types, text_type
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 1000
+
+# Formats whose columns are not padded to a fixed width.
+DELIMITED_FORMATS = ('csv', 'tsv')
+MARKUP_FORMATS = ('html', 'latex', 'latex_booktabs', 'mediawiki')
+
+# Placeholder used to find out which lines of a table are the header and the
+# footer for a given format.
+_PROBE = '@@okcli-probe@@'
+
+
+def fetch_chunks(cur, size=DEFAULT_CHUNK_SIZE, call=None):
+    """Yield lists of at most *size* rows until *cur* is exhausted.
+
+    *cur* is either a DB-API cursor (rows are fetched with ``fetchmany``) or
+    any iterable of rows, e.g. the lists returned by special commands.
+    *call*, if given, makes the fetch calls: ``call(fetchmany, size)``. It
+    is used to make fetching cancellable.
+    """
+    fetchmany = getattr(cur, 'fetchmany', None)
+    if fetchmany is None:
+        rows = iter(cur)
+
+        def fetchmany(n):
+            return list(islice(rows, n))
+
+    while True:
+        chunk = call(fetchmany, size) if call else fetchmany(size)
+        if not chunk:
+            break
+        yield chunk
+
+
+class FetchBudget(object):
+    """Stop fetching a result once it reaches *max_rows* rows or *max_bytes*
+    bytes, 0 meaning no limit.
+
+    The size of a row is estimated from the length of its values as text.
+    `exceeded` describes the limit that stopped the fetch, if any.
+    """
+
+    def __init__(self, max_rows=0, max_bytes=0):
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.rows = 0
+        self.bytes = 0
+        self.exceeded = None
+        # Rows fetched but left out when the limit was reached.
+        self.remainder = []
+
+    def limit(self, chunks):
+        """Yield the chunks of *chunks* that fit in the budget."""
+        for chunk in chunks:
+            if self.max_rows and self.rows + len(chunk) > self.max_rows:
+                end = self.max_rows - self.rows
+                chunk, self.remainder = chunk[:end], chunk[end:]
+                self.exceeded = 'the row limit is {0}'.format(self.max_rows)
+            if self.max_bytes:
+                for i, row in enumerate(chunk):
+                    size = sum(_value_width(value) for value in row)
+                    if self.bytes + size > self.max_bytes:
+                        chunk, self.remainder = chunk[:i], chunk[i:] + self.remainder
+                        self.exceeded = 'the byte limit is {0}'.format(
+                            self.max_bytes)
+                        break
+                    self.bytes += size
+            self.rows += len(chunk)
+            if chunk:
+                yield chunk
+            if self.exceeded:
+                _logger.debug('Fetch stopped after %d rows: %s.', self.rows,
+                              self.exceeded)
+                return
+
+    def notice(self):
+        """Yield a line saying why the fetch stopped, if it was stopped."""
+        if self.exceeded:
+            yield 'Fetch stopped after {0} rows, {1}.'.format(self.rows,
+                                                             self.exceeded)
+
+
+class PagedCursor(object):
+    """A cursor kept open to fetch the rest of its result a page at a time.
+
+    Rows fetched from the cursor but not shown yet are given back with
+    `keep` and are returned first by the next `fetchmany`.
+    """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.buffer = []
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount - len(self.buffer)
+
+    @property
+    def arraysize(self):
+        return self.cursor.arraysize
+
+    def fetchmany(self, size):
+        rows, self.buffer = self.buffer[:size], self.buffer[size:]
+        if len(rows) < size:
+            rows.extend(self.cursor.fetchmany(size - len(rows)))
+        return rows
+
+    def keep(self, rows):
+        self.buffer = list(rows) + self.buffer
+
+
+def format_stream(formatter, chunks, headers, format_name=None):
+    """Format an iterable of row chunks, yielding one line at a time.
+
+    The first chunk is the sample used to size the columns: the headers are
+    padded to the widest value in the sample so that later chunks, formatted
+    separately, line up with it. The header of the table is only written for
+    the first chunk and the footer only once all the chunks are written.
+    Values wider than the sample may make later chunks slightly wider.
+
+    :param formatter: a `TabularOutputFormatter`.
+    :param chunks: iterable of lists of rows.
+    :param headers: the column headers.
+    :param format_name: the output format, defaults to the formatter's.
+    """
+    format_name = format_name or formatter.format_name
+    chunks = iter(chunks)
+    sample = next(chunks, [])
+
+    if format_name == 'vertical':
+        offset = 0
+        for chunk in chain([sample], chunks):
+            output = formatter.format_output(chunk, headers,
+                                             format_name=format_name,
+                                             sep_title=_RowTitle(offset))
+            offset += len(chunk)
+            for line in output.splitlines():
+                yield line
+        return
+
+    if format_name not in DELIMITED_FORMATS + MARKUP_FORMATS:
+        headers = pad_headers(headers, sample, format_name)
+    header_len, footer_len, separator = table_frame(formatter, headers,
+                                                    format_name)
+
+    footer = []
+    for n, chunk in enumerate(chain([sample], chunks)):
+        lines = formatter.format_output(chunk, headers,
+                                        format_name=format_name).splitlines()
+        end = len(lines) - footer_len
+        if n == 0:
+            footer = lines[end:]
+            lines = lines[:end]
+        else:
+            # The separator between the last row of the previous chunk and
+            # the first row of this one, e.g. in the grid formats.
+            lines = separator + lines[header_len:end]
+        for line in lines:
+            yield line
+
+    for line in footer:
+        yield line
+
+
+def pad_headers(headers, sample, format_name):
+    """Pad *headers* to the width of the widest value of each column in
+    *sample*.
+
+    Numeric columns are right-aligned by tabulate, so their headers are
+    padded on the left to keep them in place.
+    """
+    padded = []
+    for i, header in enumerate(headers):
+        column = [row[i] for row in sample]
+        width = max([len(header)] + [_value_width(v) for v in column])
+        numeric = bool(column) and all(
+            isinstance(v, integer_types + (float,)) or v is None
+            for v in column)
+        if numeric and format_name in tabulate_adapter.supported_formats:
+            padded.append(header.rjust(width))
+        else:
+            padded.append(header.ljust(width))
+    return padded
+
+
+def table_frame(formatter, headers, format_name):
+    """Return the number of header and footer lines that *format_name* puts
+    around the rows of a table, and the lines it puts between two rows.
+
+    >>> from cli_helpers.tabular_output import TabularOutputFormatter
+    >>> table_frame(TabularOutputFormatter(), ['a', 'b'], 'ascii')
+    (3, 1, [])
+    >>> table_frame(TabularOutputFormatter(), ['a', 'b'], 'csv')
+    (1, 0, [])
+    >>> table_frame(TabularOutputFormatter(), ['a', 'b'], 'grid')[2]
+    ['+-----+-----+']
+    """
+    probe = [[_PROBE] * len(headers)] * 2
+    lines = formatter.format_output(probe, headers,
+                                    format_name=format_name).splitlines()
+    positions = [i for i, line in enumerate(lines) if _PROBE in line]
+    if len(positions) != 2:
+        _logger.debug('Unable to find the table frame for %r.', format_name)
+        return 0, 0, []
+    header_len, separator_len = positions[0], positions[1] - positions[0] - 1
+    separator = []
+    if separator_len:
+        # Rows as wide as the headers give separators as wide as the rows.
+        probe = [['-' * len(header) for header in headers]] * 2
+        lines = formatter.format_output(probe, headers,
+                                        format_name=format_name).splitlines()
+        separator = lines[header_len + 1:header_len + 1 + separator_len]
+    return header_len, len(lines) - positions[-1] - 1, separator
+
+
+def _value_width(value):
+    if value is None:
+        return len(MISSING_VALUE)
+    if isinstance(value, binary_type):
+        value = value.decode('utf-8', 'replace')
+    return max(len(line) for line in (text_type(value).splitlines() or ['']))
+
+
+class _RowTitle(object):
+    """A vertical table row title that keeps counting across chunks.
+
+    cli_helpers numbers the rows of each call from 1, calling
+    ``sep_title.format(n=...)`` to build every row separator.
+    """
+
+    def __init__(self, offset):
+        self.offset = offset
+
+    def format(self, n):
+        return '{0}. row'.format(self.offset + n)
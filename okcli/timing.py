@@ -0,0 +1,118 @@
+"""Break down where the time of a statement goes.
+
+The phases are measured separately, although fetching, formatting and output
+are interleaved as results are streamed:
+
+- execute: running the statement on the server.
+- first row: from the start of the statement to the first fetched row.
+- fetch: fetching rows, with the number of round trips to the server.
+- format: formatting the rows, without the fetch time.
+- output: writing the lines to the terminal or the pager, without the
+  format and fetch time.
+"""
+from __future__ import unicode_literals
+
+import json
+import logging
+from time import time
+
+_logger = logging.getLogger(__name__)
+
+
+class StatementTiming(object):
+    """The time spent in each phase of running one statement."""
+
+    def __init__(self, sql=None):
+        self.sql = sql
+        self.start = time()
+        self.execute = 0.0
+        self.first_row = None
+        self.fetch = 0.0
+        self.fetch_calls = 0
+        self.round_trips = 0
+        self.rows = 0
+        # Time spent producing output lines, including the fetch time.
+        self.formatting = 0.0
+        # Time spent in output, including the formatting time.
+        self.writing = 0.0
+
+    @property
+    def format(self):
+        return max(self.formatting - self.fetch, 0.0)
+
+    @property
+    def output(self):
+        return max(self.writing - self.formatting, 0.0)
+
+    @property
+    def total(self):
+        return self.execute + self.fetch + self.format + self.output
+
+    def fetch_call(self, call=None, arraysize=None):
+        """Return a function that makes fetch calls with *call* (as
+        ``call(fetchmany, size)``) and times them.
+
+        With *arraysize*, the number of round trips is worked out from the
+        number of rows fetched; otherwise every fetch call is counted as one.
+        """
+        def timed_call(fetchmany, size):
+            start = time()
+            rows = call(fetchmany, size) if call else fetchmany(size)
+            end = time()
+            self.fetch += end - start
+            self.fetch_calls += 1
+            if rows and self.first_row is None:
+                self.first_row = end - self.start
+            self.rows += len(rows)
+            if isinstance(arraysize, int) and arraysize > 0:
+                self.round_trips = max(-(-self.rows // arraysize), 1)
+            else:
+                self.round_trips = self.fetch_calls
+            return rows
+        return timed_call
+
+    def timed(self, iterable, phase):
+        """Yield the items of *iterable*, adding the time taken to produce
+        them to the *phase* attribute."""
+        iterator = iter(iterable)
+        while True:
+            start = time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                setattr(self, phase, getattr(self, phase) + time() - start)
+            yield item
+
+    def report(self):
+        """Return the breakdown as lines of text.
+
+        >>> timing = StatementTiming()
+        >>> timing.execute, timing.fetch, timing.rows = 0.5, 0.25, 10
+        >>> timing.report()[0]
+        'Execute: 0.500s'
+        """
+        lines = ['Execute: %0.03fs' % self.execute]
+        if self.fetch_calls:
+            if self.first_row is not None:
+                lines.append('First row: %0.03fs' % self.first_row)
+            lines.append('Fetch: %0.03fs (%d rows, %d round trips)' % (
+                self.fetch, self.rows, self.round_trips))
+        lines.append('Format: %0.03fs' % self.format)
+        lines.append('Output: %0.03fs' % self.output)
+        return lines
+
+    def record(self):
+        """Return the breakdown as a dict, for structured logging."""
+        return {'sql': self.sql, 'execute': round(self.execute, 6),
+                'first_row': (round(self.first_row, 6)
+                              if self.first_row is not None else None),
+                'fetch': round(self.fetch, 6), 'rows': self.rows,
+                'round_trips': self.round_trips,
+                'format': round(self.format, 6),
+                'output': round(self.output, 6),
+                'total': round(self.total, 6)}
+
+    def log(self):
+        _logger.info('timing %s', json.dumps(self.record(), sort_keys=True))
@@ -29,7 +29,7 @@ setup(
     install_requires=[
         'cx_Oracle',
         'cli_helpers >= 0.1.0,<=0.2.3',
-        'click >= 4.1',
+        'click >= 7.0',
         'Pygments >= 1.6',
         'prompt_toolkit==1.0.14',
         'sqlparse>=0.2.2,<0.3.0',
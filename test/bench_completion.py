@@ -0,0 +1,91 @@
+"""Time the completion context analysis of a keystroke in a large buffer.
+
+Run from the repository root:
+
+    python test/bench_completion.py [lines]
+
+The buffer is a script of statements, *lines* long, with a query being
+typed in its middle. For each keystroke of a WHERE clause typed there,
+suggest_type is timed, and so is the sqlparse analysis that completion used
+to run: parsing the text before the cursor, then extracting the tables of
+the current statement and the previous keyword.
+
+The first keystroke tokenizes the whole buffer, the next ones only the text
+around the edit; they are shown apart.
+"""
+from __future__ import print_function, unicode_literals
+
+import sys
+from time import time
+
+import sqlparse
+
+from okcli.packages import parseutils
+from okcli.packages.completion_engine import suggest_type
+
+TYPED = 'e.salary > 1000 and d.name like :pattern and e.id in (select id '
+
+
+def statement(n):
+    """Return a query of about 20 lines."""
+    columns = ',\n'.join('       e.column_%d_%d' % (n, i) for i in range(12))
+    return ('select e.id,\n%s\n  from employees e\n'
+            '  join departments d on d.id = e.department_id\n'
+            '  left join jobs j on j.id = e.job_id\n'
+            ' where e.hired > sysdate - %d\n'
+            ' order by e.id;\n' % (columns, n))
+
+
+def script(lines):
+    statements = []
+    while sum(s.count('\n') for s in statements) < lines:
+        statements.append(statement(len(statements)))
+    return statements
+
+
+def sqlparse_analysis(full_text, text_before_cursor):
+    """The sqlparse calls that completion made for a keystroke."""
+    sqlparse.parse(text_before_cursor)
+    start = full_text.rfind(';', 0, len(text_before_cursor)) + 1
+    parseutils.extract_tables(full_text[start:])
+    parseutils.find_prev_keyword(text_before_cursor[start:])
+
+
+def keystrokes(statements):
+    """Yield the full text and the text before the cursor of each keystroke
+    of TYPED, in a query in the middle of *statements*."""
+    middle = len(statements) // 2
+    before = ''.join(statements[:middle])
+    after = ''.join(statements[middle:])
+    query = 'select * from employees e join departments d on d.id = e.dept ' \
+            'where '
+    for end in range(len(TYPED) + 1):
+        text_before_cursor = before + query + TYPED[:end]
+        yield text_before_cursor + ';\n' + after, text_before_cursor
+
+
+def timed(analysis, statements):
+    times = []
+    for full_text, text_before_cursor in keystrokes(statements):
+        start = time()
+        analysis(full_text, text_before_cursor)
+        times.append((time() - start) * 1000)
+    first, times = times[0], times[1:]
+    return first, sum(times) / len(times), max(times)
+
+
+def main(lines):
+    statements = script(lines)
+    print('%d lines, %d statements, %d keystrokes' % (
+        sum(s.count('\n') for s in statements), len(statements),
+        len(TYPED) + 1))
+    print('%-12s %9s %9s %9s' % ('analysis', 'first ms', 'mean ms',
+                                 'max ms'))
+    for name, analysis in (('sqlcontext', suggest_type),
+                           ('sqlparse', sqlparse_analysis)):
+        print('%-12s %9.2f %9.2f %9.2f' % (
+            (name,) + timed(analysis, statements)))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 300)
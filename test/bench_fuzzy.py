@@ -0,0 +1,73 @@
+"""Time fuzzy completion lookups on a large PrefixIndex.
+
+Run from the repository root:
+
+    python test/bench_fuzzy.py [names]
+
+The names are random, which is a dense worst case: most names contain most
+characters, so the character filters leave many candidates to score.
+
+The index is built first, as the completion refresher builds it, and each
+lookup is checked against the TARGET_MS a keystroke may take. For each text,
+"cold" is its first lookup, "warm" the same lookup again, and "typed" the
+slowest of the lookups of its prefixes, one character more at a time, as when
+it is typed once the index has been used. The lookups over the target are
+marked with a '*', and the exit status is 1 if there are any.
+"""
+from __future__ import print_function, unicode_literals
+
+import random
+import string
+import sys
+from time import time
+
+from okcli.packages.prefixindex import PrefixIndex
+
+TEXTS = ['emp', 'e_h', 'ab_c', 'zzzz', 'xqj', 'employee_hist']
+LIMIT = 200
+TARGET_MS = 10
+
+
+def random_names(count, seed=0):
+    rng = random.Random(seed)
+    alphabet = string.ascii_lowercase + '_'
+    return ['%s_%d' % (''.join(rng.choice(alphabet)
+                               for _ in range(rng.randint(6, 20))), i)
+            for i in range(count)]
+
+
+def timed(function, *args):
+    start = time()
+    result = function(*args)
+    return (time() - start) * 1000, result
+
+
+def main(count):
+    index = PrefixIndex(random_names(count))
+    elapsed, _ = timed(index.build)
+    print('%d names, built in %.0fms' % (count, elapsed))
+    times = {}
+    for text in TEXTS:
+        cold, _ = timed(index.fuzzy, text, LIMIT)
+        warm, matches = timed(index.fuzzy, text, LIMIT)
+        times[text] = [cold, warm, len(matches)]
+    for text in TEXTS:
+        # Forget the texts looked up above.
+        index._bitsets._matched.clear()
+        times[text].insert(2, max(timed(index.fuzzy, text[:end], LIMIT)[0]
+                                  for end in range(1, len(text) + 1)))
+
+    print('%-15s %10s %10s %10s %8s' % ('text', 'cold ms', 'warm ms',
+                                        'typed ms', 'matches'))
+    over = False
+    for text in TEXTS:
+        cells = []
+        for elapsed in times[text][:3]:
+            cells.append('%9.1f%s' % (elapsed, '*' if elapsed > TARGET_MS
+                                      else ' '))
+            over = over or elapsed > TARGET_MS
+        print('%-15s %s %8d' % (text, ' '.join(cells), times[text][3]))
+    return 1 if over else 0
+
+if __name__ == '__main__':
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000))
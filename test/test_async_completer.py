@@ -0,0 +1,90 @@
+from __future__ import unicode_literals
+
+from mock import Mock, patch
+from prompt_toolkit.buffer import Buffer
+from prompt_toolkit.completion import CompleteEvent
+from prompt_toolkit.document import Document
+
+from okcli.async_completer import AsyncCompleter
+from okcli.sqlcompleter import SQLCompleter
+
+TYPED = CompleteEvent(text_inserted=True)
+
+
+def completions(completer, text):
+    return [c.text for c in completer.get_completions(
+        Document(text=text, cursor_position=len(text)), TYPED)]
+
+
+def test_completes_with_the_latest_snapshot():
+    async_completer = AsyncCompleter(SQLCompleter(), delay=0)
+    assert 'SELECT' in completions(async_completer, 'sel')
+
+    new_completer = SQLCompleter()
+    new_completer.extend_database_names(['hr'])
+    async_completer.completer = new_completer
+    assert 'hr' in completions(async_completer, 'select * from h')
+
+
+def test_smart_completion_toggle_does_not_change_the_snapshot():
+    completer = SQLCompleter(smart_completion=True)
+    async_completer = AsyncCompleter(completer, delay=0)
+    async_completer.smart_completion = False
+    assert 'SELECT' in completions(async_completer, 'select * from s')
+    assert completer.smart_completion
+
+
+def test_stale_completion_is_cancelled():
+    completer = Mock()
+    async_completer = AsyncCompleter(completer, delay=0)
+    buffer = Buffer()
+    async_completer.watch(buffer)
+    buffer.insert_text('select * from emp')
+
+    assert completions(async_completer, 'select * from e') == []
+    assert not completer.get_completions.called
+
+    completer.get_completions.return_value = []
+    completions(async_completer, 'select * from emp')
+    cancelled = completer.get_completions.call_args[1]['cancelled']
+    assert not cancelled()
+    buffer.cursor_position = 0
+    assert cancelled()
+
+
+def test_keystroke_within_delay_cancels_completion():
+    completer = Mock()
+    async_completer = AsyncCompleter(completer, delay=0.05)
+    buffer = Buffer()
+    async_completer.watch(buffer)
+    buffer.insert_text('sel')
+
+    def type_more(delay):
+        buffer.insert_text('e')
+
+    with patch('okcli.async_completer.time.sleep', side_effect=type_more):
+        assert completions(async_completer, 'sel') == []
+    assert not completer.get_completions.called
+
+    completer.get_completions.return_value = []
+    with patch('okcli.async_completer.time.sleep'):
+        completions(async_completer, 'sele')
+    assert completer.get_completions.called
+
+
+def test_requested_completion_is_not_delayed():
+    completer = Mock()
+    completer.get_completions.return_value = []
+    async_completer = AsyncCompleter(completer, delay=0.05)
+    with patch('okcli.async_completer.time.sleep') as sleep:
+        async_completer.get_completions(
+            Document('sel'), CompleteEvent(completion_requested=True))
+    assert not sleep.called
+    assert completer.get_completions.called
+
+
+def test_cancelled_completion_returns_nothing():
+    completer = SQLCompleter()
+    document = Document('select * from ')
+    assert completer.get_completions(document, TYPED,
+                                     cancelled=lambda: True) == []
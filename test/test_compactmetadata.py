@@ -0,0 +1,81 @@
+from __future__ import unicode_literals
+
+from okcli.packages.compactmetadata import NAMES, Relations
+from okcli.sqlcompleter import SQLCompleter
+
+
+def completer(tables):
+    comp = SQLCompleter()
+    comp.set_dbname('hr')
+    comp.extend_schemata(['hr', 'sys'])
+    comp.extend_relations([(name,) for name in tables], kind='tables',
+                          schema='hr')
+    comp.extend_columns([(name, column) for name, columns in tables.items()
+                         for column in columns], kind='tables', schema='hr')
+    comp.extend_relations([('DUAL',)], kind='tables', schema='sys')
+    return comp
+
+
+def test_columns_are_stored_once():
+    relations = Relations()
+    for name in ('EMP', 'DEPT'):
+        relations.add(name)
+        relations.add_column(name, ''.join(['I', 'D']))
+    assert relations['EMP'][1] is relations['DEPT'][1]
+    assert relations.column_count() == 2
+    assert relations.column_names() == {'*', 'ID'}
+    assert len(NAMES) >= 2
+    relations.add('PKG', star=False)
+    relations.add_column('PKG', 'GET_SALARY')
+    assert relations.column_count() == 3
+
+
+def test_unchanged_schemas_are_reused():
+    previous = completer({'EMP': ['ID', 'NAME'], 'DEPT': ['ID']})
+    previous.build_indexes()
+
+    same = completer({'EMP': ['ID', 'NAME'], 'DEPT': ['ID']})
+    same.build_indexes(previous)
+    assert same.dbmetadata['tables']['HR'] is previous.dbmetadata['tables']['HR']
+    assert (same.object_indexes['tables']['HR'] is
+            previous.object_indexes['tables']['HR'])
+
+    changed = completer({'EMP': ['ID', 'NAME', 'SALARY'], 'DEPT': ['ID']})
+    changed.build_indexes(previous)
+    assert (changed.dbmetadata['tables']['HR'] is not
+            previous.dbmetadata['tables']['HR'])
+    assert changed.populate_scoped_cols([(None, 'EMP', None)]) == [
+        '*', 'ID', 'NAME', 'SALARY']
+    assert (changed.dbmetadata['tables']['SYS'] is
+            previous.dbmetadata['tables']['SYS'])
+
+
+def test_all_completions_are_built_when_needed():
+    comp = completer({'EMP': ['ID']})
+    assert comp._all_completions is None
+    assert {'EMP', 'ID', 'SELECT', 'HR'} <= set(comp.all_completions)
+    assert '*' not in comp.all_completions
+    comp.extend_users(['SCOTT'])
+    assert 'SCOTT' in comp.all_completions
+
+
+def test_extended_keywords_are_not_shared():
+    comp, other = SQLCompleter(), SQLCompleter()
+    assert comp.keyword_index is other.keyword_index
+    comp.extend_keywords(['FROBNICATE'])
+    try:
+        assert 'FROBNICATE' in comp.keyword_index
+        assert 'FROBNICATE' not in other.keyword_index
+    finally:
+        SQLCompleter.keywords.remove('FROBNICATE')
+
+
+def test_memory_info():
+    comp = completer({'EMP': ['ID', 'NAME'], 'DEPT': ['ID']})
+    comp.build_indexes()
+    info = dict((name, (count, size))
+                for name, count, size in comp.memory_info())
+    assert info['tables'][0] == 3
+    assert info['table columns'][0] == 3
+    assert info['object indexes'][1] > 0
+    assert 'all completions' not in info
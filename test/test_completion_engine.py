@@ -445,6 +445,16 @@ def test_3_statements_2nd_current():
     ])
 
 
+def test_2_statements_2nd_current_partial_word():
+    suggestions = suggest_type('select * from a;\nselect * fr',
+                               'select * from a;\nselect * fr')
+    assert sorted_dicts(suggestions) == sorted_dicts([
+        {'type': 'column', 'tables': []},
+        {'type': 'function', 'schema': []},
+        {'type': 'keyword'},
+    ])
+
+
 def test_create_db_with_template():
     suggestions = suggest_type('create database foo with template ',
                                'create database foo with template ')
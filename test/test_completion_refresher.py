@@ -1,8 +1,9 @@
+import threading
 import time
 
 import pytest
 
-from mock import Mock, patch
+from mock import MagicMock, Mock, patch
 
 
 @pytest.fixture
@@ -40,7 +41,7 @@ def test_refresh_called_once(refresher):
         assert len(actual) == 1
         assert len(actual[0]) == 4
         assert actual[0][3] == 'Auto-completion refresh started in the background.'
-        bg_refresh.assert_called_with(sqlexecute, callbacks, {})
+        bg_refresh.assert_called_with(sqlexecute, callbacks, {}, False, False)
 
 
 def test_refresh_called_twice(refresher):
@@ -79,12 +80,364 @@ def test_refresh_with_callbacks(refresher):
 
     """
     callbacks = [Mock()]
-    sqlexecute_class = Mock()
-    sqlexecute = Mock()
+    sqlexecute = MagicMock()
 
-    with patch('okcli.completion_refresher.SQLExecute', sqlexecute_class):
-        # Set refreshers to 0: we're not testing refresh logic here
-        refresher.refreshers = {}
-        refresher.refresh(sqlexecute, callbacks)
-        time.sleep(1)  # Wait for the thread to work.
-        assert (callbacks[0].call_count == 1)
+    # Set refreshers to 0: we're not testing refresh logic here
+    refresher.refreshers = {}
+    refresher.refresh(sqlexecute, callbacks)
+    time.sleep(1)  # Wait for the thread to work.
+    assert (callbacks[0].call_count == 1)
+
+
+def test_refresh_borrows_session(refresher):
+    """The refresh must run on a session borrowed from the pool.
+
+    :param refresher:
+
+    """
+    sqlexecute = MagicMock()
+    executor = sqlexecute.borrow.return_value.__enter__.return_value
+    handler = Mock()
+
+    refresher.refreshers = {'handler': handler}
+    refresher.refresh(sqlexecute, Mock())
+    time.sleep(1)  # Wait for the thread to work.
+    sqlexecute.borrow.assert_called_once_with()
+    # The queries of the handler run on the borrowed session.
+    assert handler.call_args[0][1].users() is executor.users.return_value
+    assert sqlexecute.borrow.return_value.__exit__.called
+
+
+def test_refreshers_partition_bulk_queries():
+    """Tables, columns and functions of all schemas come from one query
+    each."""
+    from okcli.completion_refresher import refresh_functions, refresh_tables
+    from okcli.sqlcompleter import SQLCompleter
+
+    completer = SQLCompleter()
+    completer.extend_database_names(['HR'])
+    completer.extend_schemata(['HR'])
+    executor = Mock()
+    executor.all_tables.return_value = [('HR', 'EMP'), ('HR', 'EMP_V'),
+                                        ('SYS', 'DUAL')]
+    executor.all_views.return_value = [('HR', 'EMP_V')]
+    executor.all_table_columns.return_value = [
+        ('HR', 'EMP', 'ID'), ('HR', 'GONE', 'ID'), ('HR', 'EMP_V', 'ID'),
+        ('SYS', 'DUAL', 'DUMMY')]
+    executor.all_functions.return_value = [('HR', 'GET_SALARY')]
+
+    refresh_tables(completer, executor)
+    refresh_functions(completer, executor)
+    assert completer.dbmetadata['tables']['HR'] == {'EMP': ['*', 'ID']}
+    assert completer.dbmetadata['views']['HR'] == {'EMP_V': ['*', 'ID']}
+    assert list(completer.dbmetadata['functions']['HR']) == ['GET_SALARY']
+    assert not executor.tables.called
+
+
+def test_parallel_refresh_overlaps_queries():
+    """The queries of a parallel refresh run on several sessions at once."""
+    from okcli.completion_refresher import CompletionRefresher
+
+    # Each query waits for another one to run at the same time.
+    barrier = threading.Barrier(3, timeout=5)
+    sessions = []
+
+    def together(rows):
+        barrier.wait()
+        return rows
+
+    def borrow():
+        session = MagicMock()
+        session.__enter__.return_value = session
+        session.databases.side_effect = lambda: together(['HR'])
+        session.all_tables.side_effect = lambda: together([('HR', 'EMP')])
+        session.all_table_columns.side_effect = lambda: together(
+            [('HR', 'EMP', 'ID')])
+        session.users.return_value = ['SCOTT']
+        session.all_functions.return_value = []
+        sessions.append(session)
+        return session
+
+    sqlexecute = Mock(dbname='HR')
+    sqlexecute.borrow.side_effect = borrow
+    callback = Mock()
+    CompletionRefresher(parallelism=3)._bg_refresh(sqlexecute, callback, {})
+
+    completer = callback.call_args[0][0]
+    assert completer.dbmetadata['tables']['HR'] == {'EMP': ['*', 'ID']}
+    assert len(sessions) == 6
+    assert all(session.__exit__.called for session in sessions)
+
+
+@pytest.mark.parametrize('parallelism', [1, 3])
+def test_progressive_refresh_publishes_current_schema_first(parallelism):
+    from okcli.completion_refresher import CompletionRefresher
+
+    refresher = CompletionRefresher(parallelism=parallelism)
+    session = MagicMock()
+    session.__enter__.return_value = session
+    session.dbname = 'hr'
+    session.tables.return_value = [('EMP',)]
+    session.table_columns.return_value = [('EMP', 'ID')]
+    session.functions.return_value = ['GET_SALARY']
+    session.databases.return_value = ['HR', 'SYS']
+    session.all_tables.return_value = [('HR', 'EMP'), ('SYS', 'DUAL')]
+    session.all_table_columns.return_value = []
+    session.all_functions.return_value = []
+    session.users.return_value = []
+    sqlexecute = Mock(dbname='hr')
+    sqlexecute.borrow.return_value = session
+
+    published = []
+
+    def callback(completer):
+        published.append((refresher.progress.stage, completer))
+
+    refresher._bg_refresh(sqlexecute, callback, {}, progressive=True)
+    assert [stage for stage, _ in published] == [
+        'keywords', 'current schema', None]
+    keywords, current, complete = [c for _, c in published]
+    assert keywords.special_commands
+    assert not keywords.dbmetadata['tables']
+    assert current.dbmetadata['tables'] == {'HR': {'EMP': ['*', 'ID']}}
+    assert 'GET_SALARY' in current.dbmetadata['functions']['HR']
+    assert sorted(complete.dbmetadata['tables']) == ['HR', 'SYS']
+    session.tables.assert_called_once_with('HR')
+
+
+@pytest.mark.parametrize('parallelism', [1, 3])
+def test_columns_are_added_as_they_are_streamed(parallelism):
+    """The columns of an owner are added before the query of all the
+    columns ends."""
+    from okcli.completion_refresher import CompletionRefresher
+    from okcli.refresh_progress import RefreshProgress
+    from okcli.sqlcompleter import SQLCompleter
+
+    added = threading.Event()
+    extend_columns = SQLCompleter.extend_columns
+
+    def extend(completer, column_data, kind, schema):
+        extend_columns(completer, column_data, kind, schema)
+        added.set()
+
+    def columns():
+        yield ('HR', 'EMP', 'ID')
+        yield ('SYS', 'DUAL', 'DUMMY')
+        assert added.wait(5)
+        yield ('HR', 'EMP', 'NAME')
+
+    session = dictionary_session(all_table_columns=columns)
+    session.databases.return_value = ['HR', 'SYS']
+    session.all_tables.return_value = [('HR', 'EMP'), ('SYS', 'DUAL')]
+    sqlexecute = Mock(dbname='HR')
+    sqlexecute.borrow.return_value = session
+    callback = Mock()
+    with patch.object(RefreshProgress, 'batch', 1), \
+            patch.object(SQLCompleter, 'extend_columns', extend):
+        CompletionRefresher(parallelism=parallelism)._bg_refresh(
+            sqlexecute, callback, {})
+
+    completer = callback.call_args[0][0]
+    assert completer.dbmetadata['tables']['HR'] == {
+        'EMP': ['*', 'ID', 'NAME']}
+    assert completer.dbmetadata['tables']['SYS'] == {'DUAL': ['*', 'DUMMY']}
+
+
+def dictionary_session(**queries):
+    session = MagicMock()
+    session.__enter__.return_value = session
+    session.databases.return_value = ['HR']
+    session.all_tables.return_value = [('HR', 'EMP')]
+    session.all_table_columns.return_value = [('HR', 'EMP', 'ID')]
+    session.all_functions.return_value = []
+    session.users.return_value = []
+    for name, side_effect in queries.items():
+        getattr(session, name).side_effect = side_effect
+    return session
+
+
+@pytest.mark.parametrize('parallelism', [1, 3])
+def test_restart_abandons_streaming_query(parallelism):
+    """A restart stops a refresh between two batches of rows."""
+    from okcli.completion_refresher import CompletionRefresher
+
+    streaming = threading.Event()
+
+    def endless_columns():
+        streaming.set()
+        while True:
+            yield ('HR', 'EMP', 'ID')
+
+    sqlexecute = Mock(dbname='HR')
+    sqlexecute.borrow.return_value = dictionary_session(
+        all_table_columns=endless_columns)
+    callback = Mock()
+    refresher = CompletionRefresher(parallelism=parallelism)
+    refresher.refresh(sqlexecute, callback)
+    assert streaming.wait(5)
+
+    sqlexecute.borrow.return_value = dictionary_session()
+    start = time.time()
+    refresher.refresh(sqlexecute, callback)
+    refresher._completer_thread.join(5)
+    assert time.time() - start < 1
+    assert callback.call_count == 1
+    completer = callback.call_args[0][0]
+    assert completer.dbmetadata['tables']['HR'] == {'EMP': ['*', 'ID']}
+
+
+def test_restart_interrupts_running_query():
+    """A query in progress is interrupted by cancelling its session."""
+    from okcli.completion_refresher import CompletionRefresher
+
+    running = threading.Event()
+    interrupted = threading.Event()
+
+    def blocking_tables():
+        running.set()
+        assert interrupted.wait(5)
+        raise Exception('ORA-01013: user requested cancel')
+
+    session = dictionary_session(all_tables=blocking_tables)
+    session.conn.cancel.side_effect = interrupted.set
+    sqlexecute = Mock(dbname='HR')
+    sqlexecute.borrow.return_value = session
+    callback = Mock()
+    refresher = CompletionRefresher()
+    refresher.refresh(sqlexecute, callback)
+    assert running.wait(5)
+
+    sqlexecute.borrow.return_value = dictionary_session()
+    refresher.refresh(sqlexecute, callback)
+    refresher._completer_thread.join(5)
+    assert session.conn.cancel.called
+    assert callback.call_count == 1
+    progress = refresher.progress
+    assert progress.units_done == progress.units_total
+    assert progress.rows == 3
+
+
+def test_update_changes_only_the_ddl_objects():
+    """DDL updates the objects it names, in a copy of the completer."""
+    from okcli.completion_refresher import update_completer
+    from okcli.packages.ddlchanges import ddl_changes
+    from okcli.sqlcompleter import SQLCompleter
+
+    completer = SQLCompleter()
+    completer.set_dbname('hr')
+    completer.extend_database_names(['HR', 'SYS'])
+    completer.extend_schemata(['HR', 'SYS'])
+    completer.extend_relations([('EMP',), ('DEPT',)], kind='tables',
+                               schema='HR')
+    completer.extend_relations([('DUAL',)], kind='tables', schema='SYS')
+    executor = Mock()
+    executor.relation_columns.return_value = ['ID', 'NAME']
+
+    updated = update_completer(completer, ddl_changes(
+        'drop table dept; alter table emp add name int; '
+        'create function get_salary return int'), executor)
+    executor.relation_columns.assert_called_once_with('HR', 'EMP')
+    assert updated.dbmetadata['tables']['HR'] == {'EMP': ['*', 'ID', 'NAME']}
+    assert 'DEPT' not in updated.object_indexes['tables']['HR']
+    assert list(updated.dbmetadata['functions']['HR']) == ['GET_SALARY']
+    assert (updated.dbmetadata['tables']['SYS'] is
+            completer.dbmetadata['tables']['SYS'])
+    # The completer in use is left alone.
+    assert completer.dbmetadata['tables']['HR'] == {'EMP': ['*'],
+                                                    'DEPT': ['*']}
+
+
+def test_update_keeps_views_apart():
+    from okcli.completion_refresher import update_completer
+    from okcli.packages.ddlchanges import ddl_changes
+    from okcli.sqlcompleter import SQLCompleter
+
+    completer = SQLCompleter()
+    completer.set_dbname('hr')
+    completer.extend_database_names(['HR'])
+    completer.extend_schemata(['HR'])
+    completer.extend_relations([('EMP',)], kind='tables', schema='HR')
+    executor = Mock()
+    executor.relation_columns.return_value = ['ID']
+
+    updated = update_completer(completer, ddl_changes(
+        'create view emp_v as select id from emp'), executor)
+    assert updated.dbmetadata['views']['HR'] == {'EMP_V': ['*', 'ID']}
+    assert 'EMP_V' not in updated.dbmetadata['tables']['HR']
+
+    updated = update_completer(updated, ddl_changes('rename emp_v to staff_v'),
+                               executor)
+    assert 'EMP_V' not in updated.dbmetadata['views']['HR']
+
+
+def test_updates_are_coalesced(refresher):
+    """The changes requested during an update are applied together after
+    it."""
+    from okcli.packages.ddlchanges import ObjectChange
+    from okcli.sqlcompleter import SQLCompleter
+
+    refresher._published = SQLCompleter()
+    refresher._published.set_dbname('hr')
+    sqlexecute = MagicMock()
+    session = sqlexecute.borrow.return_value.__enter__.return_value
+    started, release = threading.Event(), threading.Event()
+
+    def relation_columns(schema, relation):
+        started.set()
+        release.wait(5)
+        return ['ID']
+    session.relation_columns.side_effect = relation_columns
+    published = []
+
+    refresher.update(sqlexecute, [ObjectChange('tables', None, 'T1', False)],
+                     published.append)
+    assert started.wait(5)
+    for name in ('T2', 'T3'):
+        refresher.update(sqlexecute,
+                         [ObjectChange('tables', None, name, False)],
+                         published.append)
+    thread = refresher._update_thread
+    release.set()
+    thread.join(5)
+    assert len(published) == 2
+    assert sorted(published[-1].dbmetadata['tables']['HR']) == [
+        'T1', 'T2', 'T3']
+    assert sqlexecute.borrow.call_count == 2
+
+
+def test_changes_during_a_refresh_are_applied_after_it(refresher):
+    """DDL run during a refresh doesn't restart it: its changes are applied
+    to the completer the refresh publishes."""
+    from okcli.packages.ddlchanges import ObjectChange
+
+    sqlexecute = MagicMock(dbname='HR')
+    sqlexecute.borrow.return_value = dictionary_session()
+    session = sqlexecute.borrow.return_value
+    session.dbname = 'HR'
+    session.relation_columns.return_value = ['ID']
+    started, release = threading.Event(), threading.Event()
+
+    def databases():
+        started.set()
+        release.wait(5)
+        return ['HR']
+    session.databases.side_effect = databases
+    published = []
+
+    refresher.refresh(sqlexecute, published.append)
+    assert started.wait(5)
+    for name in ('T1', 'T2'):
+        result = refresher.update(
+            sqlexecute, [ObjectChange('tables', None, name, False)],
+            published.append)
+        assert result[0][3].endswith('queued until the refresh is done.')
+    release.set()
+    refresher._completer_thread.join(5)
+    # The update starts as the refresh ends, and may be done already.
+    update_thread = refresher._update_thread
+    if update_thread is not None:
+        update_thread.join(5)
+    assert not refresher.progress.cancelled
+    assert len(published) == 2
+    assert sorted(published[-1].dbmetadata['tables']['HR']) == [
+        'EMP', 'T1', 'T2']
@@ -0,0 +1,193 @@
+from __future__ import unicode_literals
+
+import threading
+from contextlib import contextmanager
+
+from mock import Mock
+from prompt_toolkit.document import Document
+
+from okcli.completion_refresher import CompletionRefresher, refresh_packages
+from okcli.lazy_metadata import LazyMetadata, LRUCache
+from okcli.sqlcompleter import SQLCompleter
+
+TABLES = ['EMP', 'EMPLOYEES', 'DEPT', 'MyTable']
+COLUMNS = {'EMP': ['ID', 'NAME']}
+
+
+class FakeDictionary(object):
+    """Sessions answering the lazy queries, counting them."""
+
+    def __init__(self):
+        self.dbname = 'hr'
+        self.calls = []
+
+    @contextmanager
+    def borrow(self):
+        yield self
+
+    def tables_like(self, schema, prefix, limit):
+        self.calls.append(('tables_like', schema, prefix))
+        return [name for name in TABLES if name.startswith(prefix)][:limit]
+
+    def relation_columns(self, schema, relation):
+        self.calls.append(('relation_columns', schema, relation))
+        return COLUMNS.get(relation, [])
+
+    def synonyms(self, schema):
+        self.calls.append(('synonyms', schema))
+        return iter([('STAFF', 'HR', 'EMP')])
+
+    def package_members(self, schema):
+        self.calls.append(('package_members', schema))
+        return iter([('PAYROLL', 'RAISE'), ('PAYROLL', 'SALARY'),
+                     ('PAYROLL', 'RAISE')])
+
+    def package_arguments(self, schema):
+        self.calls.append(('package_arguments', schema))
+        return iter([('PAYROLL', 'RAISE', '1', 'ID', 'IN', 'NUMBER'),
+                     ('PAYROLL', 'RAISE', '2', 'NAME', 'IN', 'VARCHAR2'),
+                     ('PAYROLL', 'SALARY', None, None, 'OUT', 'NUMBER'),
+                     ('PAYROLL', 'SALARY', None, 'ID', 'IN', 'NUMBER')])
+
+    def sequences(self, schema):
+        self.calls.append(('sequences', schema))
+        return iter([('EMP_SEQ',)])
+
+
+def lazy_metadata(**kwargs):
+    fetched = threading.Event()
+    metadata = LazyMetadata(FakeDictionary(), fetched.set,
+                            loaders=CompletionRefresher.schema_refreshers,
+                            **kwargs)
+
+    def wait(lookup, *args):
+        """Return the result of *lookup* once it is fetched."""
+        fetched.clear()
+        result = lookup(*args)
+        if result is None:
+            assert fetched.wait(5)
+            result = lookup(*args)
+        return result
+    return metadata, wait
+
+
+def test_lru_cache_expires_entries(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('okcli.lazy_metadata.time.time', lambda: now[0])
+    cache = LRUCache(max_entries=10, ttl=60)
+    cache.put('EMP', ['ID'])
+    now[0] += 59
+    assert cache.get('EMP') == ['ID']
+    now[0] += 2
+    assert cache.get('EMP') is None
+    assert len(cache) == 0
+
+
+def test_tables_are_fetched_in_the_background():
+    metadata, wait = lazy_metadata()
+    assert wait(metadata.tables, 'HR', 'EMP') == ['EMP', 'EMPLOYEES']
+    assert metadata.sqlexecute.calls == [('tables_like', 'HR', 'EMP')]
+
+
+def test_complete_prefixes_are_reused():
+    metadata, wait = lazy_metadata()
+    wait(metadata.tables, 'HR', 'E')
+    assert metadata.tables('HR', 'EMPL') == ['EMPLOYEES']
+    assert len(metadata.sqlexecute.calls) == 1
+
+
+def test_capped_prefixes_are_fetched_again():
+    metadata, wait = lazy_metadata(row_limit=2)
+    wait(metadata.tables, 'HR', 'E')
+    assert wait(metadata.tables, 'HR', 'EMPL') == ['EMPLOYEES']
+    assert len(metadata.sqlexecute.calls) == 2
+
+
+def test_columns_and_clear():
+    metadata, wait = lazy_metadata()
+    assert wait(metadata.columns, 'HR', 'EMP') == ['*', 'ID', 'NAME']
+    metadata.clear()
+    assert wait(metadata.columns, 'HR', 'EMP') == ['*', 'ID', 'NAME']
+    assert len(metadata.sqlexecute.calls) == 2
+
+
+def test_fetch_errors_are_cached_as_empty():
+    metadata, wait = lazy_metadata()
+    metadata.sqlexecute.relation_columns = Mock(side_effect=Exception('boom'))
+    assert wait(metadata.columns, 'HR', 'EMP') == ['*']
+
+
+def test_completer_completes_fetched_names():
+    metadata, wait = lazy_metadata()
+    completer = SQLCompleter(lazy_metadata=metadata)
+    completer.set_dbname('hr')
+
+    def completions(text, cursor_position=None):
+        if cursor_position is None:
+            cursor_position = len(text)
+        return [c.text for c in completer.get_completions(
+            Document(text=text, cursor_position=cursor_position), None)]
+
+    assert 'EMPLOYEES' not in completions('select * from emp')
+    wait(metadata.tables, 'HR', 'EMP')
+    assert 'EMPLOYEES' in completions('select * from emp')
+
+    wait(metadata.tables, 'HR', 'My')
+    assert '"MyTable"' in completions('select * from "My')
+
+    assert 'NAME' not in completions('select  from emp', 7)
+    wait(metadata.columns, 'HR', 'EMP')
+    assert 'NAME' in completions('select  from emp', 7)
+
+
+def test_package_members_are_stored_once():
+    packages = refresh_packages(FakeDictionary(), 'HR')
+    assert packages['PAYROLL'] == ['RAISE', 'SALARY']
+
+
+def test_schema_objects_are_loaded_on_first_use():
+    metadata, wait = lazy_metadata(lazy_tables=False)
+    completer = SQLCompleter(lazy_metadata=metadata)
+    completer.set_dbname('hr')
+    completer.extend_database_names(['HR'])
+    completer.extend_schemata(['HR'])
+    completer.extend_relations([('EMP',)], kind='tables', schema='HR')
+    completer.extend_columns([('EMP', 'ID')], kind='tables', schema='HR')
+
+    def completions(text, cursor_position=None):
+        if cursor_position is None:
+            cursor_position = len(text)
+        return dict((c.text, c.display_meta) for c in completer.get_completions(
+            Document(text=text, cursor_position=cursor_position), None))
+
+    assert 'STAFF' not in completions('select * from st')
+    wait(metadata.objects, 'synonyms', 'HR')
+    assert 'STAFF' in completions('select * from st')
+    # The columns of a synonym are those of its target.
+    assert 'ID' in completions('select  from staff', 7)
+
+    for kind in ('packages', 'signatures', 'sequences'):
+        wait(metadata.objects, kind, 'HR')
+    assert {'PAYROLL', 'EMP_SEQ'} <= set(completions('select '))
+    members = completions('select payroll.')
+    assert members['SALARY'] == '(ID NUMBER) RETURN NUMBER'
+    assert members['RAISE'] == '(ID NUMBER) | (NAME VARCHAR2)'
+    assert 'NEXTVAL' in completions('select emp_seq.')
+
+    calls = len(metadata.sqlexecute.calls)
+    metadata.forget('HR')
+    wait(metadata.objects, 'sequences', 'HR')
+    assert len(metadata.sqlexecute.calls) == calls + 1
+    # Aliases aren't taken for schemas.
+    completions('select e. from emp e')
+    assert ('synonyms', 'E') not in metadata.sqlexecute.calls
+
+
+def test_lazy_refresh_leaves_out_the_tables():
+    metadata = LazyMetadata(Mock())
+    completer = SQLCompleter(lazy_metadata=metadata)
+    refresher = CompletionRefresher()
+    names = list(refresher._refreshers(completer))
+    assert 'tables' not in names
+    assert 'functions' in names
+    assert 'tables' in refresher._refreshers(SQLCompleter())
@@ -0,0 +1,233 @@
+from __future__ import unicode_literals
+
+import pytest
+from mock import MagicMock, Mock
+
+from okcli.completion_refresher import CompletionRefresher
+from okcli.metadata_cache import CachedMetadata, MetadataCache
+
+
+class FakeDictionary(object):
+    """Stand-in for the data dictionary queries of SQLExecute."""
+
+    dbname = 'HR'
+    user = 'scott'
+    host = 'xe'
+
+    def __init__(self):
+        self.schemas = {
+            'HR': {'tables': {'EMP': ['ID', 'NAME'], 'DEPT': ['ID']},
+                   'functions': ['GET_SALARY']},
+            'SYS': {'tables': {'DUAL': ['DUMMY']}, 'functions': []}}
+        self.changed = []
+        self.time = '2020-01-01 00:00:00'
+        self.calls = []
+
+    def users(self):
+        return ['SCOTT']
+
+    def server_time(self):
+        return self.time
+
+    def all_tables(self):
+        self.calls.append('all_tables')
+        return [(owner, name) for owner, entry in self.schemas.items()
+                for name in entry['tables']]
+
+    def all_views(self):
+        self.calls.append('all_views')
+        return [(owner, name) for owner, entry in self.schemas.items()
+                for name in entry.get('views', [])]
+
+    def all_table_columns(self):
+        self.calls.append('all_table_columns')
+        return [(owner, name, column)
+                for owner, entry in self.schemas.items()
+                for name, columns in entry['tables'].items()
+                for column in columns]
+
+    def all_functions(self):
+        self.calls.append('all_functions')
+        return [(owner, name) for owner, entry in self.schemas.items()
+                for name in entry['functions']]
+
+    def tables(self, schema):
+        self.calls.append(('tables', schema))
+        return [(name,) for name in self.schemas[schema]['tables']]
+
+    def views(self, schema):
+        self.calls.append(('views', schema))
+        return list(self.schemas[schema].get('views', []))
+
+    def table_columns(self, schema):
+        self.calls.append(('table_columns', schema))
+        return [(name, column)
+                for name, columns in self.schemas[schema]['tables'].items()
+                for column in columns]
+
+    def functions(self, schema):
+        self.calls.append(('functions', schema))
+        return list(self.schemas[schema]['functions'])
+
+    def object_counts(self):
+        return dict((owner, len(entry['tables']) + len(entry['functions']))
+                    for owner, entry in self.schemas.items())
+
+    def changed_objects(self, since):
+        self.calls.append(('changed_objects', since))
+        return self.changed
+
+    def relation_columns(self, schema, relation):
+        self.calls.append(('relation_columns', schema, relation))
+        return self.schemas[schema]['tables'][relation]
+
+
+@pytest.fixture
+def dictionary():
+    return FakeDictionary()
+
+
+@pytest.fixture
+def cache(tmpdir):
+    return MetadataCache.for_session(str(tmpdir), 'scott', 'xe')
+
+
+def saved_and_loaded(cache, dictionary):
+    metadata = CachedMetadata(cache, dictionary)
+    metadata.databases()
+    metadata.users()
+    cache.save()
+    loaded = MetadataCache(cache.path)
+    assert loaded.load()
+    return loaded
+
+
+def test_full_fetch_is_saved(cache, dictionary):
+    loaded = saved_and_loaded(cache, dictionary)
+    assert loaded.databases == ['HR', 'SYS']
+    assert loaded.users == ['SCOTT']
+    assert loaded.schemas['HR']['tables'] == {'EMP': ['ID', 'NAME'],
+                                              'DEPT': ['ID']}
+    assert loaded.schemas['HR']['functions'] == ['GET_SALARY']
+    assert loaded.watermark == '2020-01-01 00:00:00'
+
+
+def test_only_changed_objects_are_fetched(cache, dictionary):
+    loaded = saved_and_loaded(cache, dictionary)
+    dictionary.calls = []
+    dictionary.time = '2020-01-02 00:00:00'
+    hr = dictionary.schemas['HR']
+    hr['tables']['EMP'].append('SALARY')
+    hr['tables']['JOBS'] = ['TITLE']
+    dictionary.changed = [('HR', 'EMP', 'TABLE'), ('HR', 'JOBS', 'VIEW')]
+
+    metadata = CachedMetadata(loaded, dictionary)
+    assert sorted(metadata.all_table_columns()) == [
+        ('HR', 'DEPT', 'ID'), ('HR', 'EMP', 'ID'), ('HR', 'EMP', 'NAME'),
+        ('HR', 'EMP', 'SALARY'), ('HR', 'JOBS', 'TITLE'),
+        ('SYS', 'DUAL', 'DUMMY')]
+    assert metadata.all_functions() == [('HR', 'GET_SALARY')]
+    assert dictionary.calls == [('changed_objects', '2020-01-01 00:00:00'),
+                                ('relation_columns', 'HR', 'EMP'),
+                                ('relation_columns', 'HR', 'JOBS')]
+    assert loaded.watermark == '2020-01-02 00:00:00'
+
+
+def test_dropped_object_fetches_its_schema_again(cache, dictionary):
+    loaded = saved_and_loaded(cache, dictionary)
+    dictionary.calls = []
+    del dictionary.schemas['HR']['tables']['DEPT']
+
+    metadata = CachedMetadata(loaded, dictionary)
+    assert sorted(metadata.all_tables()) == [('HR', 'EMP'), ('SYS', 'DUAL')]
+    assert ('table_columns', 'HR') in dictionary.calls
+    assert ('table_columns', 'SYS') not in dictionary.calls
+
+
+def test_dropped_schema_is_removed(cache, dictionary):
+    loaded = saved_and_loaded(cache, dictionary)
+    del dictionary.schemas['SYS']
+    assert CachedMetadata(loaded, dictionary).databases() == ['HR']
+
+
+def test_too_many_changes_fetch_everything(cache, dictionary):
+    loaded = saved_and_loaded(cache, dictionary)
+    dictionary.calls = []
+    loaded.max_changes = 1
+    dictionary.changed = [('HR', 'EMP', 'TABLE'), ('HR', 'DEPT', 'TABLE')]
+    CachedMetadata(loaded, dictionary).databases()
+    assert 'all_tables' in dictionary.calls
+
+
+def test_views_are_told_apart(cache, dictionary):
+    hr = dictionary.schemas['HR']
+    hr['tables']['EMP_V'] = ['ID']
+    hr['views'] = ['EMP_V']
+    loaded = saved_and_loaded(cache, dictionary)
+    assert loaded.schemas['HR']['views'] == ['EMP_V']
+
+    dictionary.time = '2020-01-02 00:00:00'
+    hr['tables']['DEPT_V'] = ['ID']
+    hr['views'].append('DEPT_V')
+    dictionary.changed = [('HR', 'DEPT_V', 'VIEW')]
+    metadata = CachedMetadata(loaded, dictionary)
+    assert sorted(metadata.all_views()) == [('HR', 'DEPT_V'), ('HR', 'EMP_V')]
+    assert ('HR', 'DEPT_V') in metadata.all_tables()
+
+
+def test_unusable_cache_is_ignored(cache):
+    assert not cache.load()
+    with open(cache.path, 'w') as f:
+        f.write('{"version": 0}')
+    assert not cache.load()
+
+
+def test_cached_completer_needs_no_database(tmpdir, dictionary):
+    refresher = CompletionRefresher(cache_dir=str(tmpdir))
+    cache = saved_and_loaded(refresher.metadata_cache(dictionary), dictionary)
+
+    completer = refresher.cached_completer(cache, 'HR')
+    assert completer.dbname == 'HR'
+    assert sorted(completer.populate_scoped_cols([(None, 'EMP', None)])) == [
+        '*', 'ID', 'NAME']
+
+
+def test_refresh_publishes_the_cache_first(tmpdir, dictionary):
+    refresher = CompletionRefresher(cache_dir=str(tmpdir))
+    saved_and_loaded(refresher.metadata_cache(dictionary), dictionary)
+    dictionary.calls = []
+    sqlexecute = MagicMock(dbname='HR', user='scott', host='xe')
+    sqlexecute.borrow.return_value.__enter__.return_value = dictionary
+    published = []
+
+    def callback(completer):
+        published.append((list(dictionary.calls), completer))
+
+    refresher._bg_refresh(sqlexecute, callback, {}, progressive=True,
+                          from_cache=True)
+    (calls, cached), (_, refreshed) = published
+    assert calls == []
+    assert 'EMP' in cached.dbmetadata['tables']['HR']
+    assert refreshed is not cached
+
+
+@pytest.mark.parametrize('parallelism', [1, 3])
+def test_refresh_saves_cache(tmpdir, dictionary, parallelism):
+    refresher = CompletionRefresher(cache_dir=str(tmpdir),
+                                    parallelism=parallelism)
+    sqlexecute = MagicMock(dbname='HR', user='scott', host='xe')
+    sqlexecute.borrow.return_value.__enter__.return_value = dictionary
+    callback = Mock()
+    refresher._bg_refresh(sqlexecute, callback, {})
+
+    completer = callback.call_args[0][0]
+    assert 'EMP' in completer.dbmetadata['tables']['HR']
+    cache = refresher.metadata_cache(sqlexecute)
+    assert cache.load()
+    assert set(cache.schemas['HR']['tables']) == {'EMP', 'DEPT'}
+    assert sorted(dictionary.calls) == ['all_functions', 'all_table_columns',
+                                        'all_tables', 'all_views']
+
+
+def test_refresh_without_cache_dir_uses_executor():
+    assert CompletionRefresher().metadata_cache(Mock()) is None
@@ -0,0 +1,119 @@
+import threading
+import time
+
+from mock import Mock
+
+from okcli.parallel import ParallelRunner, parse_script, run_script
+
+SCRIPT = '''
+create table t (a int);
+grant select on other to scott;
+-- a comment
+insert into t values (1);
+-- barrier
+select * from t;
+'''
+
+
+class FakeExecutor(object):
+    """Stand-in for an SQLExecute borrowed from the pool."""
+
+    def __init__(self, log, fail):
+        self.log = log
+        self.fail = fail
+        self.conn = Mock()
+
+    def run(self, sql):
+        if sql in self.fail:
+            raise Exception('ORA-00942: table or view does not exist')
+        self.log.append(sql)
+        if sql.startswith('select'):
+            yield (None, [(1,), (2,)], ['a'], None)
+        else:
+            yield (None, None, None, 'Query OK')
+
+    def close(self):
+        pass
+
+
+def fake_sqlexecute(fail=()):
+    log = []
+    sqlexecute = Mock(pool_max=8)
+    sqlexecute.borrow.side_effect = lambda: FakeExecutor(log, fail)
+    return sqlexecute, log
+
+
+def test_parse_script_dependencies():
+    statements = parse_script(SCRIPT)
+    assert [s.sql.splitlines()[-1] for s in statements] == [
+        'create table t (a int)', 'grant select on other to scott',
+        'insert into t values (1)', 'select * from t']
+    assert [sorted(s.depends) for s in statements] == [[], [], [1], [1, 2, 3]]
+
+
+def test_parse_script_orders_drop_after_use():
+    statements = parse_script('select * from t; drop table t')
+    assert statements[1].depends == {1}
+
+
+def test_run_script_report():
+    sqlexecute, log = fake_sqlexecute()
+    failed, (title, rows, headers, status) = run_script(sqlexecute, SCRIPT, 3)
+
+    assert log.index('create table t (a int)') < log.index(
+        '-- a comment\ninsert into t values (1)') < log.index('select * from t')
+    assert [row[0] for row in rows] == [1, 2, 3, 4]
+    assert rows[3][2] == '2 rows'
+    assert '4 statements' in status and '0 failed' in status
+    assert failed == 0
+
+
+def test_run_script_skips_dependents_of_failures():
+    sqlexecute, log = fake_sqlexecute(fail=['create table t (a int)'])
+    statements = ParallelRunner(sqlexecute, 2).run(parse_script(SCRIPT))
+
+    assert statements[0].status.startswith('Error: ORA-00942')
+    assert statements[1].status == 'Query OK'
+    assert statements[2].status == 'Skipped: depends on failed statement 1'
+    assert statements[3].failed
+    assert log == ['grant select on other to scott']
+
+
+def test_run_script_counts_failures():
+    sqlexecute, log = fake_sqlexecute(fail=['create table t (a int)'])
+    failed, (title, rows, headers, status) = run_script(sqlexecute, SCRIPT, 2)
+    assert failed == 3
+    assert status.endswith('3 failed or skipped.')
+
+
+def test_jobs_waiting_for_a_session_hold_no_statement():
+    """More jobs than sessions in the pool wait for one, rather than for the
+    statements the jobs with a session depend on."""
+    sqlexecute, log = fake_sqlexecute()
+    sessions = threading.Semaphore(2)
+
+    def borrow():
+        sessions.acquire()
+        time.sleep(0.05)
+        executor = FakeExecutor(log, ())
+        executor.close = sessions.release
+        return executor
+
+    sqlexecute.borrow.side_effect = borrow
+    statements = parse_script('create table a (x int); create table b (x int);'
+                              ' create table c (x int); select * from c;'
+                              ' select x from c')
+    runner = threading.Thread(
+        target=ParallelRunner(sqlexecute, 3).run, args=(statements,))
+    runner.daemon = True
+    runner.start()
+    runner.join(5)
+    assert not runner.is_alive()
+    assert [s.status for s in statements] == ['Query OK'] * 3 + ['2 rows'] * 2
+
+
+def test_run_script_leaves_a_session_to_the_prompt():
+    sqlexecute, log = fake_sqlexecute()
+    sqlexecute.pool_max = 3
+    failed, (title, rows, headers, status) = run_script(sqlexecute, SCRIPT, 8)
+    assert status.endswith('with 2 jobs, 0 failed or skipped.')
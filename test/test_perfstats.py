@@ -0,0 +1,45 @@
+from __future__ import unicode_literals
+
+import json
+
+from prompt_toolkit.document import Document
+
+from okcli.perfstats import PERF, PerfStats
+from okcli.sqlcompleter import SQLCompleter
+
+
+def test_dump_writes_the_histograms(tmpdir):
+    stats = PerfStats()
+    stats.record('query all_tables', 0.03, rows=1200)
+    stats.record('query all_tables', 0.7, rows=800)
+    path = str(tmpdir.join('perf.json'))
+    stats.dump(path)
+
+    with open(path) as f:
+        operation = json.load(f)['operations']['query all_tables']
+    assert operation['count'] == 2
+    assert operation['rows'] == 2000
+    assert operation['buckets_ms'] == {'50': 1, '1000': 1}
+
+
+def test_percentile_of_the_last_bucket_is_the_max():
+    stats = PerfStats()
+    stats.record('refresh', 12.5)
+    assert stats.rows() == [('refresh', 1, 12500.0, 12500.0, 12500.0,
+                             12500.0, 0)]
+
+
+def test_completions_are_measured():
+    PERF.reset()
+    completer = SQLCompleter()
+    text = 'select * from '
+    list(completer.get_completions(
+        Document(text=text, cursor_position=len(text)), None))
+    assert PERF.get('completion').count == 1
+    assert PERF.get('suggest_type').count == 1
+    assert PERF.get('completion table').count == 1
+
+    completer.get_completions(
+        Document(text=text, cursor_position=len(text)), None,
+        cancelled=lambda: True)
+    assert PERF.get('completion abandoned').count == 1
@@ -0,0 +1,72 @@
+from __future__ import unicode_literals
+
+import pytest
+
+from bench_fuzzy import LIMIT, TARGET_MS, TEXTS, random_names, timed
+from okcli.packages.fuzzymatch import CharBitsets
+from okcli.packages.prefixindex import PrefixIndex
+from okcli.sqlcompleter import SQLCompleter
+
+NAMES = ['EMPLOYEES', 'emp_history', 'Emp', 'DEPARTMENTS', 'JOBS', 'empty']
+
+
+def test_prefixed_after_changes():
+    index = PrefixIndex(NAMES)
+    assert sorted(index.prefixed('emp')) == ['EMPLOYEES', 'Emp', 'emp_history',
+                                             'empty']
+    index.add('EMPLOYEE_ARCHIVE')
+    index.discard('empty')
+    assert sorted(index.prefixed('empl')) == ['EMPLOYEES', 'EMPLOYEE_ARCHIVE']
+    assert list(index.prefixed('x')) == []
+    assert len(list(index.prefixed(''))) == len(NAMES)
+
+
+@pytest.mark.parametrize('text', ['', 'e', 'EMP', 'emp_', 'job', 'zz'])
+@pytest.mark.parametrize('start_only, fuzzy', [(True, False), (False, False),
+                                               (False, True)])
+def test_find_matches_same_for_index_and_list(text, start_only, fuzzy):
+    def matches(collection):
+        return [c.text for c in SQLCompleter.find_matches(
+            text, collection, start_only=start_only, fuzzy=fuzzy)]
+
+    assert matches(PrefixIndex(NAMES)) == matches(NAMES)
+
+
+@pytest.mark.parametrize('text', ['e', 'ep', 'emp', 'mp', 'pl', 'dt', 'jb', 'o',
+                                  'zz', ''])
+def test_fuzzy_top_k_matches_full_ranking(text):
+    index = PrefixIndex(NAMES)
+    ranked = [c.text for c in SQLCompleter.find_matches(text, NAMES)]
+    assert [c.text for c in SQLCompleter.find_matches(text, index)] == ranked
+    assert [c.text for c in SQLCompleter.find_matches(text, index,
+                                                      limit=2)] == ranked[:2]
+
+
+def test_fuzzy_matches_as_text_is_typed():
+    names = NAMES + ['employee_id_seq', 'reemployed', 'deep']
+    index = PrefixIndex(names)
+    index._bitsets = CharBitsets(index.entries() and index._keys)
+    index._bitsets.few = 0
+    for text in ['e', 'ee', 'eee', 'eeey', 'ep', 'eps', 'ed', 'e']:
+        ranked = [c.text for c in SQLCompleter.find_matches(text, names)]
+        assert [c.text for c in SQLCompleter.find_matches(text, index)] == ranked
+
+
+def test_build_makes_the_fuzzy_lookups_of_single_characters():
+    index = PrefixIndex(NAMES)
+    index.build()
+    built = dict(index._bitsets._bits)
+    assert set(built) == set((char, 1) for char in ''.join(index._keys))
+    for text in ['e', 'emp', 'dpt', 'jobs', 'x']:
+        index.fuzzy(text, 2)
+    assert index._bitsets._bits == built
+
+
+def test_fuzzy_lookups_as_typed_meet_the_target():
+    # The benchmark's texts, on an index small enough for the test suite.
+    index = PrefixIndex(random_names(10000))
+    index.build()
+    for text in TEXTS:
+        for end in range(1, len(text) + 1):
+            elapsed, _ = timed(index.fuzzy, text[:end], LIMIT)
+            assert elapsed < TARGET_MS, text[:end]
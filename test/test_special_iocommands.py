@@ -4,6 +4,7 @@ import stat
 import tempfile
 
 import pytest
+from mock import Mock
 
 import okcli.packages.special
 from okcli.packages.special.main import CommandNotFound
@@ -98,10 +99,89 @@ def test_once_command():
     with tempfile.NamedTemporaryFile() as f:
         okcli.packages.special.execute(None, u"\once " + f.name)
         okcli.packages.special.write_once(u"hello world")
+        okcli.packages.special.close_once()
         assert f.read() == b"hello world\n"
 
         okcli.packages.special.execute(None, u"\once -o " + f.name)
-        okcli.packages.special.write_once(u"hello world")
+        okcli.packages.special.write_once(u"hello")
+        okcli.packages.special.write_once(u"")
+        okcli.packages.special.close_once()
+        okcli.packages.special.write_once(u"world")
+        okcli.packages.special.unset_once_if_written()
+        okcli.packages.special.write_once(u"not written")
         f.seek(0)
-        assert f.read() == b"hello world\n"
-
+        assert f.read() == b"hello\n\nworld\n"
+
+
+def test_fetchsize_command():
+    result = okcli.packages.special.execute(None, u'\\fetchsize 500')
+    assert result[0][3] == 'Fetch size is 500 rows.'
+    assert okcli.packages.special.get_arraysize() == 500
+
+    result = okcli.packages.special.execute(None, u'\\fetchsize abc')
+    assert result[0][3].startswith('Invalid fetch size')
+    assert okcli.packages.special.get_arraysize() == 500
+
+    okcli.packages.special.execute(None, u'\\fetchsize auto')
+    assert okcli.packages.special.get_arraysize() == 'auto'
+
+
+def test_size_cursor():
+    from mock import Mock
+    cur = Mock(description=[('ID', None, 39, 22, 38, 0, 0)])
+
+    okcli.packages.special.set_arraysize(250)
+    okcli.packages.special.size_cursor(cur)
+    assert cur.arraysize == 250
+    assert cur.prefetchrows == 250
+    okcli.packages.special.size_fetch(cur)
+    assert cur.arraysize == 250
+
+    okcli.packages.special.set_arraysize('auto')
+    cur = Mock(description=[('ID', None, 39, 22, 38, 0, 0)])
+    okcli.packages.special.size_cursor(cur)
+    okcli.packages.special.size_fetch(cur)
+    assert not cur.parse.called
+    assert cur.arraysize == okcli.packages.special.auto_arraysize(
+        cur.description)
+
+
+def test_variable_command():
+    bindvariables = okcli.packages.special.bindvariables
+    try:
+        okcli.packages.special.execute(None, u"variable dept 20")
+        assert bindvariables.get('DEPT') == 20
+        result = okcli.packages.special.execute(None, u"var :dept")
+        assert result[0][1] == [('dept', 20)]
+        assert bindvariables.parameters(None, u'select :dept, :other from dual') == {'dept': 20}
+    finally:
+        bindvariables.values.clear()
+
+
+def test_variable_declaration():
+    bindvariables = okcli.packages.special.bindvariables
+    cur = Mock()
+    try:
+        okcli.packages.special.execute(None, u"variable dept number")
+        okcli.packages.special.execute(None, u"variable name VARCHAR2(20)")
+        assert bindvariables.list() == [('dept', None), ('name', None)]
+        bindvariables.parameters(cur, u'begin :dept := 10; end;')
+        cur.var.assert_called_with(float)
+        okcli.packages.special.execute(None, u"variable name 'number'")
+        assert bindvariables.get('name') == 'number'
+    finally:
+        bindvariables.values.clear()
+        bindvariables.types.clear()
+
+
+def test_detailed_timing():
+    okcli.packages.special.set_timing_enabled(False)
+    try:
+        okcli.packages.special.execute(None, u'\\t+')
+        assert okcli.packages.special.is_timing_enabled()
+        assert okcli.packages.special.is_timing_detailed()
+        okcli.packages.special.execute(None, u'\\t')
+        assert not okcli.packages.special.is_timing_enabled()
+        assert not okcli.packages.special.is_timing_detailed()
+    finally:
+        okcli.packages.special.set_timing_enabled(False)
@@ -0,0 +1,132 @@
+# coding=UTF-8
+import io
+import os
+
+import pytest
+from mock import Mock
+
+from okcli.packages.special.loader import (TRANSACTION_QUERY, Loader,
+                                           load_file, parse_load_command,
+                                           read_rows)
+
+
+def test_parse_load_command():
+    options = parse_load_command("-c 10 -f tsv 'my data.txt' into emp")
+    assert options['filename'] == 'my data.txt'
+    assert options['format'] == 'tsv'
+    assert options['commit_interval'] == 10
+    assert options['columns'] is None
+
+
+@pytest.mark.parametrize('arg', ['data.csv', '-x 1 data.csv into emp',
+                                 '-b 0 data.csv into emp',
+                                 '-f xml data.csv into emp',
+                                 '-h maybe data.csv into emp',
+                                 '-h no data.csv into emp'])
+def test_parse_load_command_errors(arg):
+    with pytest.raises(ValueError):
+        parse_load_command(arg)
+
+
+def test_read_rows_csv():
+    f = io.StringIO(u'id,name\n1,a\n2\n3,\n')
+    columns, rows = read_rows(f, 'csv')
+    rows = list(rows)
+    assert columns == ['id', 'name']
+    assert rows[0] == ['1', 'a']
+    assert rows[1].values == ['2']
+    assert rows[2] == ['3', None]
+
+
+@pytest.mark.parametrize('header, expected', [
+    (None, [['1', 'a']]), (True, [['1', 'a']]),
+    (False, [['ID', 'NAME'], ['1', 'a']])])
+def test_read_rows_skips_the_header(header, expected):
+    f = io.StringIO(u'ID,NAME\n1,a\n')
+    columns, rows = read_rows(f, 'csv', ['id', 'name'], header)
+    assert list(rows) == expected
+
+
+def test_read_rows_without_header():
+    f = io.StringIO(u'1,a\n2,b\n')
+    columns, rows = read_rows(f, 'csv', ['id', 'name'])
+    assert list(rows) == [['1', 'a'], ['2', 'b']]
+
+
+def test_read_rows_json():
+    f = io.StringIO(u'{"id": 1, "name": "a"}\n\n{"id": 2}\nnot json\n'
+                    u'{"id": 3, "name": {"first": "c"}}\n{"id": 4}\n')
+    columns, rows = read_rows(f, 'json')
+    rows = list(rows)
+    assert columns == ['id', 'name']
+    assert rows[:2] == [[1, 'a'], [2, None]]
+    assert 'Invalid JSON' in rows[2].reason
+    assert rows[3].reason == 'Not a scalar value: name'
+    assert rows[4] == [4, None]
+
+
+def test_loader_batches_and_commits(tmpdir):
+    cur = Mock()
+    error = Mock(offset=1, message='ORA-00001: unique constraint violated')
+    cur.getbatcherrors.side_effect = [[error], [], []]
+    rejected = str(tmpdir.join('rejected'))
+    loader = Loader(cur, 'insert', batch_size=2, commit_interval=3,
+                    rejected_file=rejected)
+
+    loader.load([[1], [2], [3], [4], [5]])
+    loader.close()
+
+    assert cur.executemany.call_count == 3
+    assert cur.connection.commit.call_count == 2
+    assert (loader.loaded, loader.rejected) == (4, 1)
+    with io.open(rejected) as f:
+        assert f.read().startswith('2,ORA-00001')
+
+
+def test_loader_rejects_the_rows_it_cannot_bind(tmpdir):
+    cur = Mock()
+    cur.getbatcherrors.return_value = []
+    # The batch, then its rows one at a time.
+    cur.executemany.side_effect = [TypeError('expecting number'), None,
+                                   TypeError('expecting number'), None]
+    rejected = str(tmpdir.join('rejected'))
+    loader = Loader(cur, 'insert', batch_size=3, commit_interval=3,
+                    rejected_file=rejected)
+
+    loader.load([[1], ['a'], [2]])
+    loader.close()
+
+    assert cur.executemany.call_count == 4
+    assert (loader.loaded, loader.rejected) == (2, 1)
+    with io.open(rejected) as f:
+        assert f.read() == 'a,Cannot bind the values: expecting number\n'
+
+
+def test_load_file(tmpdir):
+    data = tmpdir.join('emp.csv')
+    data.write('id,name\n1,a\n2,b\n')
+    cur = Mock()
+    cur.fetchone.return_value = (None,)
+    cur.getbatcherrors.return_value = []
+
+    result = load_file(cur, '{0} into emp'.format(data))
+
+    cur.executemany.assert_called_once_with(
+        'insert into emp (id, name) values (:1, :2)',
+        [['1', 'a'], ['2', 'b']], batcherrors=True)
+    assert result[0][3].startswith('Loaded 2 rows into emp')
+    assert not os.path.exists(str(data) + '.rejected')
+
+
+def test_load_file_refuses_to_commit_a_pending_transaction(tmpdir):
+    data = tmpdir.join('emp.csv')
+    data.write('id,name\n1,a\n')
+    cur = Mock()
+    cur.fetchone.return_value = ('5.12.3456',)
+
+    result = load_file(cur, '{0} into emp'.format(data))
+
+    cur.execute.assert_called_once_with(TRANSACTION_QUERY)
+    assert not cur.executemany.called
+    assert not cur.connection.commit.called
+    assert 'pending transaction' in result[0][3]
@@ -0,0 +1,146 @@
+from __future__ import unicode_literals
+
+import random
+
+import pytest
+from sqlparse.lexer import tokenize as sqlparse_tokenize
+
+from okcli.packages import parseutils, sqlcontext
+from okcli.packages.completion_engine import suggest_type
+from okcli.packages.sqlcontext import (GROUP, STRING, Token, TokenBuffer,
+                                       extract_tables, identifier_parent,
+                                       last_token, statement_bounds, tokenize)
+
+QUERIES = [
+    'select * from abc',
+    'select a, b from abc, def where ',
+    'select * from hr.emp e join hr.dept d on e.deptno = d.deptno',
+    'SELECT * FROM my_table AS m WHERE m.a > 5',
+    'insert into abc (col1, col2) values (1, 2)',
+    'update hr.emp set sal = 1',
+    'select * from (select id from emp) x where ',
+    'select count(*) from abc a left outer join def using (id) ',
+    "select 'a, b' from dual d -- comment\n where ",
+    'create table t (a int)',
+    'select * from abc, ',
+    'select * from abc.',
+]
+
+
+@pytest.mark.parametrize('sql', QUERIES)
+def test_tokens_same_as_sqlparse(sql):
+    assert [t.value for t in tokenize(sql)] == [
+        value for _, value in sqlparse_tokenize(sql)]
+
+
+@pytest.mark.parametrize('sql, string', [
+    ("select q'[it's]' from dual", "q'[it's]'"),
+    ("select nq'{a}b}' from dual", "nq'{a}b}'"),
+    ("select 'a\\' from dual", "'a\\'"),
+    ("select 'it''s' from dual", "'it''s'"),
+])
+def test_oracle_strings(sql, string):
+    assert Token(STRING, string) in tokenize(sql)
+
+
+def test_multiword_keywords():
+    assert tokenize('select * from a left outer join b')[-3].normalized == (
+        'LEFT OUTER JOIN')
+
+
+def test_token_buffer_same_as_tokenize():
+    text = ("select e.name, 'a;b' /* note */ from emp e -- x\n"
+            "where e.id = q'[1]'; select 1 from dual")
+    edits = [(len(text), ''), (7, 'x.'), (21, '/*'), (22, ''), (0, "'"),
+             (1, ''), (30, "q'["), (33, ']'), (50, ' left outer join d ')]
+    randomness = random.Random(0)
+    edits += [(randomness.randint(0, len(text)),
+               randomness.choice(["'", '/*', '*/', ' ', 'ab', ';', '']))
+              for _ in range(200)]
+
+    buffer = TokenBuffer()
+    for position, insert in edits:
+        position = min(position, len(text))
+        if insert:
+            text = text[:position] + insert + text[position:]
+        else:
+            text = text[:position] + text[position + 1:]
+        tokens, starts = buffer.update(text)
+        assert list(tokens) == list(tokenize(text))
+        assert ''.join(t.value for t in tokens) == text
+        assert starts == [sum(len(t.value) for t in tokens[:i])
+                          for i in range(len(tokens))]
+
+
+@pytest.mark.parametrize('text, start', [
+    ('', 0),
+    ('select 1', 0),
+    ('select 1;', 0),
+    ('select 1; ', 0),
+    ('select 1; s', 10),
+    ('select 1; -- one\nselect', 17),
+    ('select 1;\n', 9),
+    ("select ';' from dual", 0),
+    ("select 1; select 'a;b;c' from dual where ", 10),
+    ('select 1; /* two; */ select', 10),
+    ('begin null; end; sel', 17),
+])
+def test_statement_start(text, start):
+    assert statement_bounds(text, len(text))[0] == start
+
+
+@pytest.mark.parametrize('position, bounds', [
+    (0, (0, 9)),
+    (5, (0, 9)),
+    (12, (10, 29)),
+    # The spaces after a semicolon go with the statement it ends.
+    (30, (10, 29)),
+    (31, (30, 33)),
+])
+def test_statement_bounds(position, bounds):
+    assert statement_bounds('select 1; select 2 from dual; sel',
+                            position) == bounds
+
+
+@pytest.mark.parametrize('sql', QUERIES)
+def test_extract_tables_same_as_sqlparse(sql):
+    assert extract_tables(sql) == parseutils.extract_tables(sql)
+
+
+@pytest.mark.parametrize('sql, token', [
+    ('select ', Token('dml', 'select')),
+    ('select a, b', Token(GROUP, 'a, b')),
+    ('select x.a y, 1, b', Token(GROUP, 'x.a y, 1, b')),
+    ('select * from abc a', Token(GROUP, 'abc a')),
+    ('select count(', Token('punctuation', '(')),
+    ('select * desc', Token('order', 'desc')),
+    ('select null, update ', Token('dml', 'update')),
+    ('', None),
+])
+def test_last_token(sql, token):
+    assert last_token(sql) == token
+
+
+@pytest.mark.parametrize('word, parent', [
+    ('emp', None),
+    ('hr.emp', 'hr'),
+    ('hr.', 'hr'),
+    ('"Sales".', 'Sales'),
+    ('a.id=d.', None),
+    ('count(', None),
+])
+def test_identifier_parent(word, parent):
+    assert identifier_parent(word) == parent
+
+
+def test_repeated_keystroke_is_parsed_once():
+    caches = (sqlcontext.tokenize, sqlcontext._extract_tables,
+              sqlcontext.last_token, sqlcontext.identifier_parent)
+    sqlcontext.clear_caches()
+    text = 'select * from hr.emp e join hr.dept d on e.'
+    suggestions = suggest_type(text, text)
+    misses = [cached.cache_info().misses for cached in caches]
+
+    assert suggest_type(text, text) == suggestions
+    assert [cached.cache_info().misses for cached in caches] == misses
+    assert all(cached.cache_info().hits for cached in caches)
@@ -0,0 +1,130 @@
+import threading
+
+import pytest
+
+from mock import Mock
+from six.moves import _thread
+
+from okcli.packages import special
+from okcli.sqlexecute import SQLExecute, StatementCacheStats
+
+
+class FakePool(object):
+    """Stand-in for a cx_Oracle.SessionPool."""
+
+    def __init__(self):
+        self.busy = []
+        self.released = []
+
+    def acquire(self):
+        conn = Mock()
+        self.busy.append(conn)
+        return conn
+
+    def release(self, conn):
+        self.busy.remove(conn)
+        self.released.append(conn)
+
+
+@pytest.fixture
+def pool():
+    return FakePool()
+
+
+@pytest.fixture
+def executor(pool):
+    return SQLExecute('hr', 'scott', 'tiger', 'xe', pool=pool)
+
+
+def test_connect_acquires_from_pool(executor, pool):
+    assert pool.busy == [executor.conn]
+    assert executor.conn.current_schema == 'HR'
+
+
+def test_reconnect_releases_session(executor, pool):
+    old_conn = executor.conn
+    executor.connect(database='sales')
+    assert pool.released == [old_conn]
+    assert pool.busy == [executor.conn]
+    assert executor.conn.current_schema == 'SALES'
+    assert executor.pool is pool
+
+
+def test_borrow_shares_pool(executor, pool):
+    with executor.borrow() as borrowed:
+        assert borrowed.pool is pool
+        assert borrowed.conn is not executor.conn
+        assert borrowed.dbname == executor.dbname
+        assert len(pool.busy) == 2
+    assert pool.busy == [executor.conn]
+    assert borrowed.conn is None
+
+
+def test_call_cancellable_returns_result(executor):
+    assert executor.call_cancellable(lambda x: x * 2, 21) == 42
+
+
+def test_call_cancellable_raises_errors(executor):
+    def fail():
+        raise ValueError('ORA-00942')
+
+    with pytest.raises(ValueError):
+        executor.call_cancellable(fail)
+
+
+def test_call_cancellable_cancels_on_interrupt(executor, pool):
+    cancelled = threading.Event()
+    conn = executor.conn
+    conn.cancel.side_effect = cancelled.set
+
+    def blocking_call():
+        cancelled.wait(5)
+        raise Exception('ORA-01013: user requested cancel')
+
+    threading.Timer(0.2, _thread.interrupt_main).start()
+    with pytest.raises(KeyboardInterrupt):
+        executor.call_cancellable(blocking_call)
+
+    conn.cancel.assert_called_once_with()
+    assert executor.conn is conn
+    assert executor.cancel_time is not None
+    assert executor.cancel_time < executor.cancel_timeout
+
+
+def test_statement_cache_stats():
+    stats = StatementCacheStats(2)
+    for sql in ['select 1', 'select 2', 'select 1', 'select 3', 'select 2']:
+        stats.record(sql)
+    assert (stats.hits, stats.misses) == (1, 4)
+    stats.resize(0)
+    stats.record('select 3')
+    assert stats.misses == 5
+
+
+def test_run_binds_variables(executor):
+    special.bindvariables.set('dept', 20)
+    try:
+        cur = executor.conn.cursor.return_value
+        cur.description = None
+        list(executor.run('delete from departments where id = :dept'))
+        cur.execute.assert_called_with(
+            'delete from departments where id = :dept', {'dept': 20})
+    finally:
+        special.bindvariables.values.clear()
+
+
+def test_estimate(executor):
+    cur = executor.conn.cursor.return_value
+    cur.execute.return_value.fetchone.return_value = (1000, None)
+    assert executor.estimate('select * from emp') == (1000, 0)
+    statements = [call[0][0] for call in cur.execute.call_args_list]
+    assert any('explain plan' in sql for sql in statements)
+    # The plan doesn't change the transaction of the user.
+    assert statements[0] == 'savepoint okcli_estimate'
+    assert statements[-1] == 'rollback to savepoint okcli_estimate'
+
+
+def test_estimate_unavailable(executor):
+    cur = executor.conn.cursor.return_value
+    cur.execute.side_effect = Exception('ORA-02402: PLAN_TABLE not found')
+    assert executor.estimate('select * from emp') is None
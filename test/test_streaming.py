@@ -0,0 +1,98 @@
+from __future__ import unicode_literals
+
+import pytest
+
+from cli_helpers.tabular_output import TabularOutputFormatter
+from mock import Mock
+
+from okcli.streaming import (FetchBudget, PagedCursor, fetch_chunks,
+                             format_stream)
+
+HEADERS = ['id', 'name']
+ROWS = [(i, 'name{}'.format(i)) for i in range(10)]
+
+
+@pytest.fixture
+def formatter():
+    return TabularOutputFormatter(format_name='ascii')
+
+
+def test_fetch_chunks_from_list():
+    chunks = list(fetch_chunks(ROWS, 4))
+    assert [len(c) for c in chunks] == [4, 4, 2]
+    assert sum(chunks, []) == ROWS
+
+
+def test_fetch_chunks_uses_fetchmany():
+    cur = Mock()
+    cur.fetchmany.side_effect = [ROWS[:3], ROWS[3:], []]
+    assert list(fetch_chunks(cur, 3)) == [ROWS[:3], ROWS[3:]]
+    cur.fetchmany.assert_called_with(3)
+
+
+@pytest.mark.parametrize('format_name', ['ascii', 'psql', 'simple', 'csv',
+                                         'grid', 'fancy_grid'])
+def test_format_stream_matches_single_table(formatter, format_name):
+    expected = formatter.format_output(ROWS, HEADERS,
+                                       format_name=format_name).splitlines()
+    streamed = list(format_stream(formatter, fetch_chunks(ROWS, 3), HEADERS,
+                                  format_name))
+    whole = list(format_stream(formatter, [ROWS], HEADERS, format_name))
+
+    assert streamed == whole
+    assert len(whole) == len(expected)
+
+
+def test_format_stream_writes_frame_once(formatter):
+    lines = list(format_stream(formatter, fetch_chunks(ROWS, 3), HEADERS))
+    assert len(lines) == len(ROWS) + 4
+    assert lines[0] == lines[2] == lines[-1]
+    assert sum('name' in line for line in lines) == len(ROWS) + 1
+
+
+def test_format_stream_vertical_numbers_rows(formatter):
+    lines = list(format_stream(formatter, fetch_chunks(ROWS, 3), HEADERS,
+                               'vertical'))
+    titles = [line for line in lines if line.startswith('*')]
+    assert len(titles) == len(ROWS)
+    assert '[ 10. row ]' in titles[-1]
+
+
+def test_format_stream_no_rows(formatter):
+    lines = list(format_stream(formatter, [], HEADERS))
+    assert len(lines) == 3
+    assert 'id' in lines[1]
+
+
+@pytest.mark.parametrize('max_rows, expected', [(0, 10), (4, 4), (10, 10)])
+def test_fetch_budget_rows(max_rows, expected):
+    budget = FetchBudget(max_rows=max_rows)
+    rows = sum(budget.limit(fetch_chunks(ROWS, 3)), [])
+    assert rows == ROWS[:expected]
+    assert bool(list(budget.notice())) == (expected < len(ROWS))
+
+
+def test_fetch_budget_bytes():
+    # Each row is 1 + 5 characters wide.
+    budget = FetchBudget(max_bytes=20)
+    rows = sum(budget.limit(fetch_chunks(ROWS, 4)), [])
+    assert rows == ROWS[:3]
+    assert list(budget.notice()) == [
+        'Fetch stopped after 3 rows, the byte limit is 20.']
+
+
+def test_paged_cursor_keeps_remainder():
+    cur = Mock()
+    source = list(ROWS)
+    cur.fetchmany.side_effect = lambda n: [source.pop(0) for _ in range(min(n, len(source)))]
+    paged = PagedCursor(cur)
+
+    pages = []
+    while True:
+        budget = FetchBudget(max_rows=4)
+        pages.append(sum(budget.limit(fetch_chunks(paged, 5)), []))
+        paged.keep(budget.remainder)
+        if not budget.exceeded:
+            break
+
+    assert pages == [ROWS[:4], ROWS[4:8], ROWS[8:]]
@@ -0,0 +1,32 @@
+from okcli.streaming import fetch_chunks
+from okcli.timing import StatementTiming
+
+
+def test_fetch_call_counts_rows_and_round_trips():
+    timing = StatementTiming('select * from t')
+    rows = [(i,) for i in range(25)]
+    chunks = list(fetch_chunks(rows, 10, timing.fetch_call(arraysize=4)))
+
+    assert sum(len(c) for c in chunks) == 25
+    assert timing.rows == 25
+    assert timing.fetch_calls == 4
+    assert timing.round_trips == 7
+    assert timing.first_row is not None
+
+
+def test_timed_phases_exclude_nested_time():
+    timing = StatementTiming()
+    lines = timing.timed(iter(['a', 'b']), 'formatting')
+    assert list(lines) == ['a', 'b']
+    timing.fetch = timing.formatting + 1
+    timing.writing = timing.formatting + 2
+    assert timing.format == 0.0
+    assert round(timing.output, 6) == 2.0
+
+
+def test_record():
+    timing = StatementTiming('select 1 from dual')
+    record = timing.record()
+    assert record['sql'] == 'select 1 from dual'
+    assert set(record) >= {'execute', 'first_row', 'fetch', 'rows',
+                           'round_trips', 'format', 'output', 'total'}